@@ -10,15 +10,22 @@ import perf
 from perf._metadata import _common_metadata
 from perf._cli import (format_metadata, empty_line,
                        format_checks, format_histogram, format_title,
-                       format_benchmark, display_title, format_result)
+                       format_benchmark, display_title, format_result,
+                       format_result_value)
 from perf._formatter import format_timedelta, format_seconds, format_datetime
 from perf._cpu_utils import get_isolated_cpus, parse_cpu_list, set_cpu_affinity
 from perf._timeit_cli import TimeitRunner
-from perf._utils import parse_run_list
+from perf._utils import parse_run_list, get_python_names
+
+
+# Number of slowest imports displayed by perf command --python-importtime
+IMPORTTIME_TOP = 10
 
 
 def add_cmdline_args(cmd, args):
     cmd.extend(('--name', args.name))
+    if args.python_importtime:
+        cmd.append('--python-importtime')
     cmd.append(args.program)
     if args.program_args:
         cmd.extend(args.program_args)
@@ -36,11 +43,84 @@ class CommandRunner(perf.Runner):
 
         cmd.add_argument('--name', type=parse_name, default='command',
                          help='Benchmark name (default: command)')
+        cmd.add_argument('--python-importtime', action='store_true',
+                         help='The program is a Python 3.7+ interpreter: '
+                              'run it with -X importtime and store the '
+                              'import time of each module as a benchmark')
         cmd.add_argument('program',
                          help='Program path')
         cmd.add_argument('program_args', nargs=argparse.REMAINDER,
                          help='Program arguments')
 
+    def _split_import_times(self, bench, python=None):
+        # Move import series out of the command benchmark: the import suite
+        # is stored in _import_suites as (python, suite)
+        if not self.args.python_importtime:
+            return bench
+
+        from perf._importtime import split_import_times
+        bench, import_suite = split_import_times(bench)
+        self._import_suites.append((python or self.args.python,
+                                    import_suite))
+        return bench
+
+    def _spawn_workers(self, python=None, newline=True, name=None):
+        bench = perf.Runner._spawn_workers(self, python=python,
+                                           newline=newline, name=name)
+        return self._split_import_times(bench, python)
+
+    def _spawn_compare_workers(self, pythons, names, bench_name=None):
+        benchs = perf.Runner._spawn_compare_workers(self, pythons, names,
+                                                    bench_name)
+        return [self._split_import_times(bench, python)
+                for bench, python in zip(benchs, pythons)]
+
+    def _master(self, name=None):
+        self._import_suites = []
+        bench = perf.Runner._master(self, name)
+        if self.args.python_importtime:
+            self._display_import_times(self._import_suites[0][1])
+        return bench
+
+    def _compare_to(self, name=None):
+        self._import_suites = []
+        perf.Runner._compare_to(self, name)
+        if not self.args.python_importtime:
+            return
+
+        args = self.args
+        if args.python_names:
+            python_names = args.python_names
+        else:
+            python_names = get_python_names(args.compare_to, args.python)
+        # import suites are ordered as (reference python, changed python)
+        for python_name, (python, suite) in zip(python_names,
+                                                self._import_suites):
+            self._display_import_times(suite, python_name)
+
+    def _display_import_times(self, suite, python_name=None):
+        args = self.args
+        if suite is None:
+            print("WARNING: no import time found in stderr of the command")
+            return
+
+        if not args.quiet:
+            benchmarks = sorted(suite, key=lambda bench: bench.mean(),
+                                reverse=True)
+            print()
+            if python_name:
+                print("Slowest imports of %s (self time):" % python_name)
+            else:
+                print("Slowest imports (self time):")
+            for bench in benchmarks[:IMPORTTIME_TOP]:
+                print("%s: %s" % (bench.get_name(),
+                                  format_result_value(bench)))
+
+        if args.append:
+            perf.add_runs(args.append, suite)
+        if args.output:
+            perf.add_runs(args.output, suite)
+
 
 def create_parser():
     parser = argparse.ArgumentParser(description='Display benchmark results.',
@@ -166,7 +246,8 @@ def create_parser():
     cmd.add_argument('--add', metavar='FILE',
                      help='Add benchmark runs of benchmark FILE')
     cmd.add_argument('--extract-metadata', metavar='NAME',
-                     help='Use metadata NAME as the new run values')
+                     help='Use metadata or series NAME as the new run '
+                          'values')
     cmd.add_argument('--remove-all-metadata', action="store_true",
                      help='Remove all benchmarks metadata, but keep '
                           'the benchmarks name')
@@ -696,6 +777,11 @@ def cmd_convert(args):
                       % (benchmark.get_name(), name),
                       file=sys.stderr)
                 sys.exit(1)
+            except ValueError as exc:
+                print("ERROR: Benchmark %r: %s"
+                      % (benchmark.get_name(), exc),
+                      file=sys.stderr)
+                sys.exit(1)
             except TypeError:
                 raise
                 print("ERROR: Metadata %r of benchmark %r is not an integer"
@@ -744,7 +830,7 @@ def cmd_bench_command(runner, args):
     runner._set_args(args)
     name = args.name
     command = [args.program] + args.program_args
-    runner.bench_command(name, command)
+    runner._bench_command(name, command, args.python_importtime)
 
 
 def main():
@@ -0,0 +1,114 @@
+"""
+Benchmark of coroutine functions: Runner.bench_async_func().
+
+The coroutine code is compiled at runtime, since the async/await syntax
+requires Python 3.5 and the perf module must remain importable on Python 2.
+"""
+from __future__ import division, print_function, absolute_import
+
+import sys
+
+import perf
+
+
+LOOP_POLICIES = ('asyncio', 'uvloop', 'auto')
+
+_CODE = '''
+async def time_coro_loops(coro_func, args, loops):
+    # use fast local variables
+    local_timer = perf.perf_counter
+    local_func = coro_func
+    range_it = range(loops)
+
+    t0 = local_timer()
+    for _ in range_it:
+        await local_func(*args)
+    return local_timer() - t0
+
+
+async def noop_coro(*args):
+    pass
+'''
+
+_namespace = None
+
+
+def _get_namespace():
+    global _namespace
+
+    if _namespace is None:
+        if sys.version_info < (3, 5):
+            raise RuntimeError("bench_async_func() requires Python 3.5 "
+                               "or newer")
+        namespace = {'perf': perf}
+        exec(_CODE, namespace)
+        _namespace = namespace
+    return _namespace
+
+
+def create_event_loop(policy):
+    # Return (loop, name) where name is the name of the event loop
+    # implementation: 'asyncio' or 'uvloop'
+    import asyncio
+
+    if policy in ('uvloop', 'auto'):
+        try:
+            import uvloop
+        except ImportError:
+            if policy == 'uvloop':
+                raise ImportError("--loop-policy=uvloop requires "
+                                  "the uvloop module")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            return (loop, 'uvloop')
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return (loop, 'asyncio')
+
+
+class AsyncBench(object):
+    # Run awaits of a coroutine function in an event loop created once per
+    # worker process. The loop is created on the first call, so it is not
+    # shared by processes forked by the fork server.
+
+    def __init__(self, coro_func, args, policy):
+        # fail early on Python older than 3.5
+        _get_namespace()
+
+        self.coro_func = coro_func
+        self.args = args
+        self.policy = policy
+        self.loop = None
+
+    def _get_loop(self, task):
+        if self.loop is None:
+            self.loop, name = create_event_loop(self.policy)
+            task.metadata['event_loop'] = name
+        return self.loop
+
+    def task_func(self, task, loops):
+        # Only the awaits are timed: the timer runs inside the coroutine
+        loop = self._get_loop(task)
+        time_coro_loops = _get_namespace()['time_coro_loops']
+        coro = time_coro_loops(self.coro_func, self.args, loops)
+        return loop.run_until_complete(coro)
+
+    def overhead_func(self, task, loops):
+        from perf._runner import _time_empty_loops
+
+        loop = self._get_loop(task)
+        namespace = _get_namespace()
+        coro = namespace['time_coro_loops'](namespace['noop_coro'],
+                                            self.args, loops)
+        loop_overhead = _time_empty_loops(loops)
+        call_overhead = loop.run_until_complete(coro) - loop_overhead
+        return {'loop_overhead': loop_overhead,
+                'call_overhead': call_overhead}
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.close()
+            self.loop = None
@@ -1,19 +1,22 @@
 from __future__ import division, print_function, absolute_import
 
+import array
 import datetime
 import errno
 import json
 import math
 import os.path
 import sys
+import weakref
 
 import six
 import statistics
 
 from perf._metadata import (NUMBER_TYPES, parse_metadata,
                             _common_metadata, get_metadata_info,
-                            _exclude_common_metadata)
-from perf._formatter import DEFAULT_UNIT, format_values
+                            _exclude_common_metadata, _intern_metadata,
+                            _LayeredMetadata)
+from perf._formatter import DEFAULT_UNIT, RATE_FORMATTERS, format_values
 from perf._utils import parse_iso8601, median_abs_dev
 
 
@@ -42,17 +45,26 @@ _CHECKED_METADATA = (
     'cpu_model_name',
     'hostname',
     'inner_loops',
+    'items_per_loop',
     'name',
     'platform',
     'python_executable',
     'python_implementation',
     'python_unicode',
     'python_version',
+    'rate_unit',
     'unit')
 
 
 _UNSET = object()
 
+# array typecode of a C integer of 64 bits ('q' is not available on
+# Python 2.7)
+if six.PY3:
+    _INT_TYPECODE = 'q'
+else:
+    _INT_TYPECODE = 'l'
+
 
 def _check_warmups(warmups):
     for item in warmups:
@@ -75,6 +87,45 @@ def _check_warmups(warmups):
     return True
 
 
+def _as_array(numbers):
+    # Store numbers as an array of C doubles, or C integers if all numbers
+    # are integers, rather than a tuple of Python objects: 8 bytes per
+    # number instead of 24 bytes per float plus 8 bytes per tuple item
+    if all(isinstance(number, six.integer_types) for number in numbers):
+        typecode = _INT_TYPECODE
+    else:
+        typecode = 'd'
+    try:
+        return array.array(typecode, numbers)
+    except (TypeError, OverflowError):
+        # number which doesn't fit into a C type
+        return tuple(numbers)
+
+
+def _concat_arrays(arrays):
+    if len(arrays) == 1:
+        return arrays[0]
+
+    typecodes = set(getattr(numbers, 'typecode', None) for numbers in arrays)
+    if len(typecodes) == 1 and None not in typecodes:
+        result = array.array(typecodes.pop())
+        for numbers in arrays:
+            result.extend(numbers)
+        return result
+
+    return _as_array([number for numbers in arrays for number in numbers])
+
+
+def _get_series_unit(name):
+    # Series ending with "_time" and clock counters of --counters are
+    # durations in seconds (ex: process_time, command_user_time,
+    # task-clock), other series are counts (ex: cycles, command_minflt)
+    if name.endswith('_time') or name in ('cpu-clock', 'task-clock'):
+        return 'second'
+    else:
+        return 'integer'
+
+
 def _cached_attr(func):
     attr = '_' + func.__name__
 
@@ -91,9 +142,15 @@ def _cached_attr(func):
 
 
 class Run(object):
-    # Run is immutable, so it can be shared/exchanged between two benchmarks
+    # Run is immutable, so it can be shared/exchanged between two benchmarks.
+    #
+    # Values are stored in an array, see _as_array(). Warmups are stored as
+    # two parallel arrays (loops, values), or None if the run has no warmup.
+    # The public values and warmups properties return tuples, the values
+    # tuple is cached.
 
-    __slots__ = ('_warmups', '_values', '_metadata')
+    __slots__ = ('_warmups', '_values', '_values_tuple', '_metadata',
+                 '_series')
 
     def __init__(self, values, warmups=None,
                  metadata=None, collect_metadata=True):
@@ -106,15 +163,17 @@ class Run(object):
                              "where loops is a int >= 1 and value "
                              "is a float >= 0.0")
 
-        if warmups:
-            self._warmups = tuple(warmups)
-        else:
-            self._warmups = None
-        self._values = tuple(values)
+        self._warmups = self._warmups_as_arrays(warmups)
+        self._values = _as_array(values)
+        self._values_tuple = None
 
         if not self._values and not self._warmups:
             raise ValueError("values and warmups are empty sequence")
 
+        # Optional series of measures made in parallel to values:
+        # dict {name: tuple of numbers}, one number per value
+        self._series = None
+
         if collect_metadata:
             from perf._collect_metadata import collect_metadata as collect_func
 
@@ -131,11 +190,67 @@ class Run(object):
         else:
             self._metadata = {}
 
+    @classmethod
+    def _from_worker(cls, values, warmups, metadata, series=None):
+        # Fast path for a run produced by a worker process: values, warmups
+        # and metadata were already validated by the worker
+        run = cls.__new__(cls)
+        run._values = _as_array(values)
+        run._values_tuple = None
+        run._warmups = cls._warmups_as_arrays(warmups)
+        run._metadata = metadata
+        if series:
+            run._series = dict((name, tuple(numbers))
+                               for name, numbers in series.items())
+        else:
+            run._series = None
+        return run
+
+    @staticmethod
+    def _warmups_as_arrays(warmups):
+        if not warmups:
+            return None
+        loops = array.array(_INT_TYPECODE, [item[0] for item in warmups])
+        values = _as_array([item[1] for item in warmups])
+        return (loops, values)
+
+    def _set_series(self, series):
+        # Only called on a newly created Run, Run objects are immutable
+        if not series:
+            self._series = None
+            return
+
+        result = {}
+        for name, numbers in series.items():
+            if not isinstance(name, six.string_types):
+                raise TypeError("series name must be a string, got %s"
+                                % type(name).__name__)
+            numbers = tuple(numbers)
+            if len(numbers) != len(self._values):
+                raise ValueError("series %r has %s numbers, expected %s"
+                                 % (name, len(numbers), len(self._values)))
+            if any(not isinstance(number, NUMBER_TYPES) or number < 0
+                   for number in numbers):
+                raise ValueError("series %r must be a sequence of "
+                                 "number >= 0" % name)
+            result[name] = numbers
+        self._series = result
+
+    def _get_series(self, name):
+        if not self._series:
+            return None
+        return self._series.get(name)
+
+    def _get_series_names(self):
+        if not self._series:
+            return ()
+        return sorted(self._series)
+
     def _replace(self, values=None, warmups=True, metadata=None):
         if values is None:
             values = self._values
         if warmups:
-            warmups = self._warmups
+            warmups = self.warmups
         else:
             warmups = None
         if metadata is None:
@@ -143,6 +258,14 @@ class Run(object):
             metadata = self._metadata
         run = Run(values, warmups=warmups, collect_metadata=False)
         run._metadata = metadata
+        if warmups:
+            # share arrays since Run is immutable
+            run._warmups = self._warmups
+        if values is self._values:
+            run._values = self._values
+            run._values_tuple = self._values_tuple
+            # series are only valid for the same values
+            run._series = self._series
         return run
 
     def _is_calibration(self):
@@ -160,13 +283,16 @@ class Run(object):
     @property
     def warmups(self):
         if self._warmups:
-            return self._warmups
+            loops, values = self._warmups
+            return tuple(zip(loops, values))
         else:
             return ()
 
     @property
     def values(self):
-        return self._values
+        if self._values_tuple is None:
+            self._values_tuple = tuple(self._values)
+        return self._values_tuple
 
     def _get_loops(self):
         return self._metadata.get('loops', 1)
@@ -183,7 +309,7 @@ class Run(object):
         if warmups and self._warmups:
             inner_loops = self._get_inner_loops()
             raw_values.extend(value * (loops * inner_loops)
-                              for loops, value in self._warmups)
+                              for loops, value in zip(*self._warmups))
 
         total_loops = self.get_total_loops()
         raw_values.extend(value * total_loops for value in self._values)
@@ -208,9 +334,11 @@ class Run(object):
     def _as_json(self, common_metadata):
         data = {}
         if self._warmups:
-            data['warmups'] = self._warmups
+            data['warmups'] = self.warmups
         if self._values:
-            data['values'] = self._values
+            data['values'] = list(self._values)
+        if self._series:
+            data['series'] = self._series
 
         metadata = _exclude_common_metadata(self._metadata, common_metadata)
         if metadata:
@@ -219,9 +347,12 @@ class Run(object):
 
     @classmethod
     def _json_load(cls, version, run_data, common_metadata):
-        metadata = run_data.get('metadata', {})
+        # common_metadata was already parsed by Benchmark._json_load():
+        # only parse metadata specific to the run
+        metadata = _intern_metadata(parse_metadata(run_data.get('metadata',
+                                                                {})))
         if common_metadata:
-            metadata = dict(common_metadata, **metadata)
+            metadata = _LayeredMetadata(common_metadata, metadata)
 
         warmups = run_data.get('warmups', None)
         if warmups:
@@ -236,10 +367,12 @@ class Run(object):
         else:
             values = run_data['samples']
 
-        return cls(values,
-                   warmups=warmups,
-                   metadata=metadata,
-                   collect_metadata=False)
+        run = cls(values,
+                  warmups=warmups,
+                  collect_metadata=False)
+        run._metadata = metadata
+        run._set_series(run_data.get('series'))
+        return run
 
     def _extract_metadata(self, name):
         value = self._metadata.get(name, None)
@@ -258,6 +391,17 @@ class Run(object):
 
         return self._replace(values=(value,), warmups=False, metadata=metadata)
 
+    def _extract_series(self, name):
+        numbers = self._get_series(name)
+        if numbers is None:
+            raise KeyError("run has no series %r" % name)
+        if not all(numbers):
+            raise ValueError("series %r contains zero, it cannot be "
+                             "used as values" % name)
+
+        metadata = dict(self._metadata, unit=_get_series_unit(name))
+        return self._replace(values=numbers, warmups=False, metadata=metadata)
+
     def _remove_all_metadata(self):
         name = self._metadata.get('name', None)
         unit = self._metadata.get('unit', None)
@@ -283,6 +427,9 @@ class Run(object):
 class Benchmark(object):
     def __init__(self, runs):
         self._runs = []   # list of Run objects
+        # BenchmarkSuite objects containing this benchmark, notified when
+        # the benchmark is renamed
+        self._suites = weakref.WeakSet()
         self._clear_runs_cache()
 
         if not runs:
@@ -317,6 +464,13 @@ class Benchmark(object):
         durations = [run._get_duration() for run in self._runs]
         return math.fsum(durations)
 
+    def _get_values(self):
+        # Array of values of all runs. Don't copy values if the benchmark
+        # has a single run.
+        if self._values is None:
+            self._values = _concat_arrays([run._values for run in self._runs])
+        return self._values
+
     def _get_run_property(self, get_property):
         # ignore calibration runs
         values = [get_property(run) for run in self._runs
@@ -328,10 +482,11 @@ class Benchmark(object):
         return math.fsum(values) / len(values)
 
     def _get_nwarmup(self):
-        return self._get_run_property(lambda run: len(run.warmups))
+        return self._get_run_property(lambda run: len(run._warmups[0])
+                                      if run._warmups else 0)
 
     def _get_nvalue_per_run(self):
-        return self._get_run_property(lambda run: len(run.values))
+        return self._get_run_property(lambda run: len(run._values))
 
     def _get_loops(self):
         return self._get_run_property(lambda run: run._get_loops())
@@ -344,6 +499,7 @@ class Benchmark(object):
 
     def _clear_runs_cache(self, keep_common_metadata=False):
         self._values = None
+        self._values_tuple = None
         self._mean = None
         self._stdev = None
         self._median = None
@@ -354,7 +510,7 @@ class Benchmark(object):
 
     @_cached_attr
     def mean(self):
-        value = statistics.mean(self.get_values())
+        value = statistics.mean(self._get_values())
         # add_run() ensures that all values are greater than zero
         if value <= 0:
             raise ValueError("mean must be > 0")
@@ -362,7 +518,7 @@ class Benchmark(object):
 
     @_cached_attr
     def stdev(self):
-        values = self.get_values()
+        values = self._get_values()
         value = statistics.stdev(values)
         # add_run() ensures that all values are greater than zero
         if value < 0:
@@ -371,7 +527,7 @@ class Benchmark(object):
 
     @_cached_attr
     def median(self):
-        value = statistics.median(self.get_values())
+        value = statistics.median(self._get_values())
         # add_run() ensures that all values are greater than zero
         if value <= 0:
             raise ValueError("median must be > 0")
@@ -379,7 +535,7 @@ class Benchmark(object):
 
     @_cached_attr
     def median_abs_dev(self):
-        value = median_abs_dev(self.get_values())
+        value = median_abs_dev(self._get_values())
         # add_run() ensures that all values are greater than zero
         if value < 0:
             raise ValueError("MAD must be >= 0")
@@ -389,7 +545,7 @@ class Benchmark(object):
         if not(0 <= p <= 100):
             raise ValueError("p must be in the range [0; 100]")
 
-        values = sorted(self.get_values())
+        values = sorted(self._get_values())
         if not values:
             raise ValueError("no value")
 
@@ -434,10 +590,44 @@ class Benchmark(object):
         run = self._runs[0]
         return run._metadata.get('unit', DEFAULT_UNIT)
 
+    def _get_rate(self):
+        # Return (rate_unit, items_per_loop) if values must be displayed as
+        # a throughput, or None
+        metadata = self._runs[0]._metadata
+        rate_unit = metadata.get('rate_unit')
+        if not rate_unit or self.get_unit() != 'second':
+            return None
+        return (rate_unit, metadata.get('items_per_loop', 1))
+
     def format_values(self, values):
+        rate = self._get_rate()
+        if rate is not None:
+            rate_unit, items = rate
+            rates = [items / value if value else float('inf')
+                     for value in values]
+            return RATE_FORMATTERS[rate_unit](rates)
+
         unit = self.get_unit()
         return format_values(unit, values)
 
+    def _format_raw_values(self, values):
+        # Format values in the unit of the stored values: raw values are not
+        # displayed as a throughput
+        return format_values(self.get_unit(), values)
+
+    def _format_spread(self, value, spread):
+        # Format (value, spread) where spread is a standard deviation or a
+        # median absolute deviation. For a throughput, the spread keeps the
+        # same ratio to the value.
+        rate = self._get_rate()
+        if rate is None:
+            return self.format_values((value, spread))
+
+        rate_unit, items = rate
+        rate_value = items / value
+        rate_spread = spread * rate_value / value
+        return RATE_FORMATTERS[rate_unit]((rate_value, rate_spread))
+
     def format_value(self, value):
         return self.format_values((value,))[0]
 
@@ -451,18 +641,16 @@ class Benchmark(object):
         if self._values is not None:
             return len(self._values)
         else:
-            return sum(len(run.values) for run in self._runs)
+            return sum(len(run._values) for run in self._runs)
 
     def get_values(self):
-        if self._values is not None:
-            return self._values
-
-        values = []
-        for run in self._runs:
-            values.extend(run.values)
-        values = tuple(values)
-        self._values = values
-        return values
+        if self._values_tuple is None:
+            if len(self._runs) == 1:
+                # share the tuple of the run
+                self._values_tuple = self._runs[0].values
+            else:
+                self._values_tuple = tuple(self._get_values())
+        return self._values_tuple
 
     def _get_raw_values(self, warmups=False):
         raw_values = []
@@ -470,6 +658,25 @@ class Benchmark(object):
             raw_values.extend(run._get_raw_values(warmups))
         return raw_values
 
+    def _get_series_names(self):
+        names = set()
+        for run in self._runs:
+            names.update(run._get_series_names())
+        return sorted(names)
+
+    def _get_series(self, name):
+        # Return (values, series): values of runs which have the series, and
+        # the series numbers
+        values = []
+        numbers = []
+        for run in self._runs:
+            series = run._get_series(name)
+            if series is None:
+                continue
+            values.extend(run._values)
+            numbers.extend(series)
+        return (values, numbers)
+
     def _only_calibration(self):
         # If the benchmark only contains a single run which is a calibration
         # run: return the number of loops, otherwise return None
@@ -489,6 +696,8 @@ class Benchmark(object):
         metadata = parse_metadata(metadata)
         if suite_metadata:
             metadata = dict(suite_metadata, **metadata)
+        # dict shared by all runs of the benchmark, see _LayeredMetadata
+        metadata = _intern_metadata(metadata)
 
         runs = []
         for run_data in data['runs']:
@@ -534,8 +743,12 @@ class Benchmark(object):
     def _replace_runs(self, new_runs):
         if not new_runs:
             raise ValueError("no more runs")
+        old_name = self.get_name()
         self._runs[:] = new_runs
         self._clear_runs_cache()
+        if self.get_name() != old_name:
+            for suite in list(self._suites):
+                suite._invalidate_index()
 
     def _filter_runs(self, include, only_runs):
         if include:
@@ -595,7 +808,12 @@ class Benchmark(object):
         return self._dates
 
     def _extract_metadata(self, name):
-        new_runs = [run._extract_metadata(name) for run in self._runs]
+        if name in self._get_series_names():
+            # series are measured with values: skip calibration runs
+            new_runs = [run._extract_series(name) for run in self._runs
+                        if not run._is_calibration()]
+        else:
+            new_runs = [run._extract_metadata(name) for run in self._runs]
         self._replace_runs(new_runs)
 
     def _remove_all_metadata(self):
@@ -619,9 +837,23 @@ class BenchmarkSuite(object):
 
         self.filename = filename
         self._benchmarks = []
+        # name index: dict {name: Benchmark}, None if it must be rebuilt
+        self._index = {}
         for benchmark in benchmarks:
             self.add_benchmark(benchmark)
 
+    def _invalidate_index(self):
+        # called by Benchmark._replace_runs() when a benchmark is renamed
+        self._index = None
+
+    def _get_index(self):
+        if self._index is None:
+            # reversed() to index the first benchmark if two benchmarks
+            # have the same name
+            self._index = {bench.get_name(): bench
+                           for bench in reversed(self._benchmarks)}
+        return self._index
+
     def get_benchmark_names(self):
         return [bench.get_name() for bench in self]
 
@@ -638,9 +870,8 @@ class BenchmarkSuite(object):
 
     def _add_benchmark_runs(self, benchmark):
         name = benchmark.get_name()
-        try:
-            existing = self.get_benchmark(name)
-        except KeyError:
+        existing = self._get_index().get(name)
+        if existing is None:
             self.add_benchmark(benchmark)
         else:
             existing.add_runs(benchmark)
@@ -656,29 +887,27 @@ class BenchmarkSuite(object):
                             % type(result).__name__)
 
     def get_benchmark(self, name):
-        for bench in self._benchmarks:
-            if bench.get_name() == name:
-                return bench
-        raise KeyError("there is no benchmark called %r" % name)
+        try:
+            return self._get_index()[name]
+        except KeyError:
+            raise KeyError("there is no benchmark called %r" % name)
 
     def get_benchmarks(self):
         return list(self._benchmarks)
 
     def add_benchmark(self, benchmark):
-        if benchmark in self._benchmarks:
+        if self in benchmark._suites:
             raise ValueError("benchmark already part of the suite")
 
         name = benchmark.get_name()
-        if name:
-            try:
-                self.get_benchmark(name)
-            except KeyError:
-                pass
-            else:
-                raise ValueError("the suite has already a benchmark called %r"
-                                 % name)
+        index = self._get_index()
+        if name in index:
+            raise ValueError("the suite has already a benchmark called %r"
+                             % name)
 
         self._benchmarks.append(benchmark)
+        benchmark._suites.add(self)
+        index[name] = benchmark
 
     @classmethod
     def _json_load(cls, filename, data):
@@ -805,22 +1034,23 @@ class BenchmarkSuite(object):
     def _replace_benchmarks(self, benchmarks):
         if not benchmarks:
             raise ValueError("empty benchmark suite")
+        for bench in self._benchmarks:
+            bench._suites.discard(self)
         self._benchmarks[:] = benchmarks
+        for bench in self._benchmarks:
+            bench._suites.add(self)
+        self._invalidate_index()
 
     def _convert_include_benchmark(self, name):
-        benchmarks = []
-        for bench in self:
-            if bench.get_name() == name:
-                benchmarks.append(bench)
+        # a suite loaded from JSON can contain multiple benchmarks
+        # with the same name
+        benchmarks = [bench for bench in self if bench.get_name() == name]
         if not benchmarks:
             raise KeyError("benchmark %r not found" % name)
         self._replace_benchmarks(benchmarks)
 
     def _convert_exclude_benchmark(self, name):
-        benchmarks = []
-        for bench in self:
-            if bench.get_name() != name:
-                benchmarks.append(bench)
+        benchmarks = [bench for bench in self if bench.get_name() != name]
         self._replace_benchmarks(benchmarks)
 
     def get_total_duration(self):
@@ -851,18 +1081,3 @@ def add_runs(filename, result):
         suite.dump(filename, replace=True)
     else:
         result.dump(filename)
-
-
-def _load_suite_from_pipe(bench_json):
-    lines = bench_json.split("\n")
-    result = None
-    for line in lines:
-        if not line:
-            continue
-        suite = BenchmarkSuite.loads(line)
-        if result is not None:
-            for bench in suite:
-                result.add_benchmark(bench)
-        else:
-            result = suite
-    return result
@@ -0,0 +1,117 @@
+"""
+Persistent cache of calibrated numbers of loops (--calibration-cache option).
+
+The cache is a JSON file. An entry is identified by the benchmark name, the
+Python executable, the hostname, the CPU model name and the minimum duration
+of a value (--min-time). The entry also stores the Python version, which is
+checked against the metadata of the worker using the cached number of loops.
+"""
+from __future__ import division, print_function, absolute_import
+
+import errno
+import json
+import os
+import socket
+
+from perf._collect_metadata import collect_cpu_model
+from perf._utils import open_text
+
+
+_CACHE_VERSION = 1
+
+# Entry fields which identify an entry
+_KEY_FIELDS = ('name', 'python_executable', 'hostname', 'cpu_model_name',
+               'min_time')
+
+
+class CalibrationCache(object):
+    def __init__(self, filename):
+        self.filename = filename
+        # list of dict
+        self._entries = []
+        self._load()
+
+    def _load(self):
+        try:
+            fp = open_text(self.filename)
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return
+            raise
+
+        with fp:
+            data = json.load(fp)
+        if data.get('version') != _CACHE_VERSION:
+            # ignore cache written by an incompatible perf version
+            return
+        self._entries = data['entries']
+
+    def _dump(self):
+        data = {'version': _CACHE_VERSION, 'entries': self._entries}
+
+        # write into a temporary file and then rename it, to not corrupt
+        # the cache if perf is interrupted
+        tmp_filename = self.filename + '.tmp'
+        with open_text(tmp_filename, write=True) as fp:
+            json.dump(data, fp, sort_keys=True, indent=4)
+            fp.write("\n")
+        if hasattr(os, 'replace'):
+            # Python 3.3
+            os.replace(tmp_filename, self.filename)
+        else:
+            if os.path.exists(self.filename):
+                os.unlink(self.filename)
+            os.rename(tmp_filename, self.filename)
+
+    @staticmethod
+    def get_key(name, python, min_time):
+        metadata = {}
+        collect_cpu_model(metadata)
+        return {'name': name,
+                'python_executable': python,
+                'hostname': socket.gethostname(),
+                'cpu_model_name': metadata.get('cpu_model_name'),
+                'min_time': min_time}
+
+    def _find(self, key):
+        for index, entry in enumerate(self._entries):
+            if all(entry.get(field) == key[field] for field in _KEY_FIELDS):
+                return index
+        return None
+
+    def get(self, key):
+        index = self._find(key)
+        if index is None:
+            return None
+        return self._entries[index]
+
+    def set(self, key, loops, python_version):
+        entry = dict(key, loops=loops, python_version=python_version)
+        index = self._find(key)
+        if index is not None:
+            self._entries[index] = entry
+        else:
+            self._entries.append(entry)
+        self._dump()
+
+    def invalidate(self, key):
+        index = self._find(key)
+        if index is None:
+            return
+        del self._entries[index]
+        self._dump()
+
+
+def check_cached_loops(run, entry, margin):
+    """Check if a run computed with cached loops is still valid.
+
+    Return False if the Python version changed, or if the shortest raw value
+    is smaller than min_time minus margin (ex: 0.25 for 25%).
+    """
+    if run._metadata.get('python_version') != entry.get('python_version'):
+        return False
+
+    raw_values = run._get_raw_values()
+    if not raw_values:
+        return True
+    return (min(raw_values) >= entry['min_time'] * (1.0 - margin))
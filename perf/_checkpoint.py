@@ -0,0 +1,73 @@
+"""
+Checkpoint of a benchmark session (--checkpoint option).
+
+The checkpoint file is written as soon as a worker completes: one JSON object
+per line, {"name": str, "python": str, "suite": dict} where suite is the
+BenchmarkSuite JSON of the worker run. Each line is appended with a single
+write() and the file is flushed to disk, so an interrupted session only loses
+the workers which were running. An incomplete last line is removed.
+"""
+from __future__ import division, print_function, absolute_import
+
+import errno
+import json
+import os
+
+from perf._bench import BenchmarkSuite
+
+
+class Checkpoint(object):
+    def __init__(self, filename):
+        self.filename = filename
+        # (name, python) => list of Run
+        self._runs = {}
+        self._load()
+
+    def _load(self):
+        try:
+            fp = open(self.filename, 'rb')
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return
+            raise
+
+        with fp:
+            data = fp.read()
+
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            # the session was interrupted while writing the last line:
+            # remove it, to append the next lines after the last complete
+            # line
+            with open(self.filename, 'r+b') as fp:
+                fp.truncate(end)
+
+        for line in data[:end].decode('utf8').splitlines():
+            entry = json.loads(line)
+            suite = BenchmarkSuite._json_load(self.filename, entry['suite'])
+            key = (entry['name'], entry['python'])
+            runs = self._runs.setdefault(key, [])
+            for bench in suite:
+                runs.extend(bench.get_runs())
+
+    def get_runs(self, name, python):
+        return list(self._runs.get((name, python), ()))
+
+    def add(self, name, python, bench):
+        suite = BenchmarkSuite([bench])
+        data = {'name': name, 'python': python, 'suite': suite._as_json()}
+        line = json.dumps(data, sort_keys=True) + '\n'
+        line = line.encode('utf8')
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o666)
+        try:
+            while line:
+                written = os.write(fd, line)
+                line = line[written:]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        runs = self._runs.setdefault((name, python), [])
+        runs.extend(bench.get_runs())
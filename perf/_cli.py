@@ -4,7 +4,9 @@ import os.path
 import sys
 
 from perf._formatter import (format_seconds, format_number,
-                             format_timedelta, format_datetime)
+                             format_timedelta, format_timedeltas,
+                             format_datetime)
+from perf._bench import _get_series_unit
 from perf._metadata import format_metadata as _format_metadata
 
 
@@ -69,21 +71,30 @@ def format_run(bench, run_index, run, common_metadata=None, raw=False,
 
     total_loops = run.get_total_loops()
 
+    if raw:
+        fmt = bench._format_raw_values
+    else:
+        fmt = bench.format_values
+    # percents of a throughput are computed on the throughput
+    is_rate = (not raw and bench._get_rate() is not None)
+
     def format_values(values):
-        values_str = [bench.format_value(value) for value in values]
+        values_str = [fmt((value,))[0] for value in values]
         mean = bench.mean()
-        max_delta = mean * 0.05
         for index, value in enumerate(values):
             if raw:
                 value = float(value) / total_loops
-            delta = float(value) - mean
-            if abs(delta) > max_delta:
-                values_str[index] += ' (%+.0f%%)' % (delta * 100 / mean)
+            if is_rate:
+                percent = (mean / value - 1.0) * 100
+            else:
+                percent = (float(value) - mean) * 100 / mean
+            if abs(percent) > 5.0:
+                values_str[index] += ' (%+.0f%%)' % percent
         return values_str
 
     values = run.values
     if raw:
-        warmups = [bench.format_value(value * (loops * inner_loops))
+        warmups = [fmt((value * (loops * inner_loops),))[0]
                    for loops, value in run.warmups]
         values = [value * total_loops for value in values]
     else:
@@ -161,7 +172,7 @@ PERCENTILE_NAMES = {0: 'minimum', 50: 'median', 100: 'maximum'}
 
 def format_stats(bench, lines):
     fmt = bench.format_value
-    values = bench.get_values()
+    values = bench._get_values()
 
     nrun = bench.get_nrun()
     nvalue = len(values)
@@ -182,8 +193,10 @@ def format_stats(bench, lines):
 
     # Raw value minimize/maximum
     raw_values = bench._get_raw_values()
-    lines.append("Raw value minimum: %s" % bench.format_value(min(raw_values)))
-    lines.append("Raw value maximum: %s" % bench.format_value(max(raw_values)))
+    raw_min, raw_max = bench._format_raw_values((min(raw_values),
+                                                 max(raw_values)))
+    lines.append("Raw value minimum: %s" % raw_min)
+    lines.append("Raw value maximum: %s" % raw_max)
     lines.append('')
 
     # Number of values
@@ -227,9 +240,18 @@ def format_stats(bench, lines):
     lines.append("Loop iterations per value: %s" % text)
     lines.append('')
 
+    # A throughput is the inverse of the time: the minimum throughput is
+    # the maximum time, and the p-th percentile of throughputs is the
+    # (100-p)-th percentile of times
+    is_rate = (bench._get_rate() is not None)
+    if is_rate:
+        minimum, maximum = max(values), min(values)
+    else:
+        minimum, maximum = min(values), max(values)
+
     # Minimum
     table = []
-    table.append(("Minimum", bench.format_value(min(values))))
+    table.append(("Minimum", bench.format_value(minimum)))
 
     # Median +- MAD
     median = bench.median()
@@ -237,20 +259,21 @@ def format_stats(bench, lines):
         median_abs_dev = bench.median_abs_dev()
         table.append(("Median +- MAD",
                       "%s +- %s"
-                      % bench.format_values((median, median_abs_dev))))
+                      % bench._format_spread(median, median_abs_dev)))
     else:
         table.append(("Mean", bench.format_value(median)))
 
-    # Mean +- std dev
+    # Mean +- std dev: the mean throughput is the harmonic mean of
+    # throughputs
     mean = bench.mean()
     if len(values) > 2:
         stdev = bench.stdev()
         table.append(("Mean +- std dev",
-                      "%s +- %s" % bench.format_values((mean, stdev))))
+                      "%s +- %s" % bench._format_spread(mean, stdev)))
     else:
         table.append(("Mean", bench.format_value(mean)))
 
-    table.append(("Maximum", bench.format_value(max(values))))
+    table.append(("Maximum", bench.format_value(maximum)))
 
     # Render table
     width = max(len(row[0]) + 1 for row in table)
@@ -260,20 +283,88 @@ def format_stats(bench, lines):
     lines.append('')
 
     def format_limit(mean, value):
-        return ("%s (%+.0f%% of the mean)"
-                % (fmt(value), (value - mean) * 100.0 / mean))
+        if is_rate:
+            percent = (mean / value - 1.0) * 100.0
+        else:
+            percent = (value - mean) * 100.0 / mean
+        return "%s (%+.0f%% of the mean)" % (fmt(value), percent)
 
     # Percentiles
     for p in (0, 5, 25, 50, 75, 95, 100):
-        text = format_limit(mean, bench.percentile(p))
+        if is_rate:
+            value = bench.percentile(100 - p)
+        else:
+            value = bench.percentile(p)
+        text = format_limit(mean, value)
         text = "%3sth percentile: %s" % (p, text)
         name = PERCENTILE_NAMES.get(p)
         if name:
             text = '%s -- %s' % (text, name)
         lines.append(text)
+
+    format_series(bench, lines)
     return lines
 
 
+def _format_series_number(number):
+    if number >= 100:
+        return '{0:,.0f}'.format(number)
+    else:
+        return '%.3g' % number
+
+
+def _format_series_numbers(name, numbers):
+    if _get_series_unit(name) == 'second':
+        return format_timedeltas(numbers)
+    return [_format_series_number(number) for number in numbers]
+
+
+# CPU time series compared to wall clock values (--cpu-time)
+CPU_TIME_SERIES = ('process_time', 'thread_time')
+
+
+def _get_cpu_time_ratios(bench, name):
+    # Return the list of wall time / CPU time ratios of each value
+    values, cpu_times = bench._get_series(name)
+    return [value / cpu_time
+            for value, cpu_time in zip(values, cpu_times)
+            if cpu_time]
+
+
+def format_series(bench, lines):
+    # Series measured in parallel to values (ex: --counters)
+    names = bench._get_series_names()
+    if not names:
+        return
+
+    import statistics
+
+    lines.append('')
+    lines.append("Series per loop iteration:")
+    for name in names:
+        numbers = bench._get_series(name)[1]
+        mean = statistics.mean(numbers)
+        if len(numbers) > 2:
+            stdev = statistics.stdev(numbers)
+            text = ("Mean +- std dev: %s +- %s"
+                    % tuple(_format_series_numbers(name, (mean, stdev))))
+        else:
+            text = "Mean: %s" % _format_series_numbers(name, (mean,))[0]
+        lines.append("- %s: %s" % (name, text))
+
+    if bench.get_unit() != 'second':
+        return
+    for name in CPU_TIME_SERIES:
+        if name not in names:
+            continue
+        ratios = _get_cpu_time_ratios(bench, name)
+        if not ratios:
+            continue
+        lines.append("Wall time / %s ratio: mean %.2f, min %.2f, max %.2f"
+                     % (name, statistics.mean(ratios),
+                        min(ratios), max(ratios)))
+
+
 def format_histogram(benchmarks, bins=20, extend=False, lines=None,
                      checks=False):
     import collections
@@ -291,7 +382,7 @@ def format_histogram(benchmarks, bins=20, extend=False, lines=None,
 
     all_values = []
     for bench, title in benchmarks:
-        all_values.extend(bench.get_values())
+        all_values.extend(bench._get_values())
     all_min = min(all_values)
     all_max = max(all_values)
     value_k = float(all_max - all_min) / bins
@@ -314,7 +405,7 @@ def format_histogram(benchmarks, bins=20, extend=False, lines=None,
         if title:
             lines.append("[ %s ]" % title)
 
-        values = bench.get_values()
+        values = bench._get_values()
 
         buckets = [value_bucket(value) for value in values]
         counter = collections.Counter(buckets)
@@ -345,10 +436,32 @@ def format_histogram(benchmarks, bins=20, extend=False, lines=None,
     return lines
 
 
+# Warn if the wall time is at least 10% greater than the CPU time
+CPU_TIME_MAX_RATIO = 1.10
+
+
+def check_cpu_time(bench, warn):
+    names = bench._get_series_names()
+    for name in CPU_TIME_SERIES:
+        if name not in names:
+            continue
+        ratios = _get_cpu_time_ratios(bench, name)
+        diverge = sum(1 for ratio in ratios if ratio >= CPU_TIME_MAX_RATIO)
+        if diverge:
+            warn("%s values (%.0f%%) have a wall time at least %.0f%% "
+                 "greater than their %s: the process was interrupted "
+                 "or waited"
+                 % (diverge, diverge * 100.0 / len(ratios),
+                    (CPU_TIME_MAX_RATIO - 1.0) * 100, name))
+        # the process CPU time is enough, thread_time is only used
+        # if process_time is not available
+        break
+
+
 def format_checks(bench, lines=None):
     if lines is None:
         lines = []
-    values = bench.get_values()
+    values = bench._get_values()
     mean = bench.mean()
     warnings = []
     warn = warnings.append
@@ -358,15 +471,25 @@ def format_checks(bench, lines=None):
         stdev = bench.stdev()
         percent = stdev * 100.0 / mean
         if percent >= 10.0:
+            if bench._get_rate() is not None:
+                mean_str, stdev_str = bench._format_spread(mean, stdev)
+            else:
+                mean_str = bench.format_value(mean)
+                stdev_str = bench.format_value(stdev)
             warn("the standard deviation (%s) is %.0f%% of the mean (%s)"
-                 % (bench.format_value(stdev), percent, bench.format_value(mean)))
+                 % (stdev_str, percent, mean_str))
 
-    # Minimum and maximum, detect obvious outliers
+    # Minimum and maximum, detect obvious outliers. A throughput is the
+    # inverse of the time.
+    is_rate = (bench._get_rate() is not None)
     for minimum, value in (
-        ('minimum', min(values)),
-        ('maximum', max(values)),
+        ('minimum', max(values) if is_rate else min(values)),
+        ('maximum', min(values) if is_rate else max(values)),
     ):
-        percent = (value - mean) * 100.0 / mean
+        if is_rate:
+            percent = (mean / value - 1.0) * 100.0
+        else:
+            percent = (value - mean) * 100.0 / mean
         if abs(percent) >= 50:
             if percent >= 0:
                 text = "%.0f%% greater" % (percent)
@@ -380,7 +503,11 @@ def format_checks(bench, lines=None):
         shortest = min(bench._get_raw_values())
         if shortest < 1e-3:
             warn("the shortest raw value is only %s"
-                 % bench.format_value(shortest))
+                 % bench._format_raw_values((shortest,))[0])
+
+        # Check that the wall time doesn't diverge from the CPU time
+        # (--cpu-time): the process was interrupted or waited
+        check_cpu_time(bench, warn)
 
     if warnings:
         empty_line(lines)
@@ -420,7 +547,7 @@ def format_result_value(bench):
 
     mean = bench.mean()
     if bench.get_nvalue() >= 2:
-        args = bench.format_values((mean, bench.stdev()))
+        args = bench._format_spread(mean, bench.stdev())
         return '%s +- %s' % args
     else:
         return bench.format_value(mean)
@@ -7,8 +7,8 @@ from perf._utils import is_significant
 
 
 def is_significant_benchs(bench1, bench2):
-    values1 = bench1.get_values()
-    values2 = bench2.get_values()
+    values1 = bench1._get_values()
+    values2 = bench2._get_values()
 
     if len(values1) == 1 and len(values2) == 1:
         # FIXME: is it ok to consider that comparison between two values
@@ -36,7 +36,17 @@ def compute_speed(ref, changed):
     ref_avg = ref.mean()
     changed_avg = changed.mean()
     # Note: means cannot be zero, it's a warranty of perf API
-    speed = ref_avg / changed_avg
+
+    ref_rate = ref._get_rate()
+    changed_rate = changed._get_rate()
+    if ref_rate is not None and changed_rate is not None:
+        # Compare throughputs: faster means a higher throughput. The mean
+        # throughput is the harmonic mean of throughputs.
+        ref_avg = ref_rate[1] / ref_avg
+        changed_avg = changed_rate[1] / changed_avg
+        speed = changed_avg / ref_avg
+    else:
+        speed = ref_avg / changed_avg
     percent = (changed_avg - ref_avg) * 100.0 / ref_avg
     return (speed, percent)
 
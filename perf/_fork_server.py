@@ -0,0 +1,157 @@
+"""
+Fork server (--fork-server option): a template worker process imports the
+benchmark script once, and then forks a fresh child process per worker
+rather than spawning a new Python process per worker.
+
+Protocol:
+
+* the master writes a request per worker into the stdin of the template
+  process: worker command line arguments encoded to JSON on a single line;
+* the template process forks a child process which parses these arguments
+  and runs the worker task, the child writes its result into a private pipe;
+* once the child completes, the template process writes a single JSON line
+  into its --pipe: {"exitcode": int, "result": str}, where result is the
+  binary output of the child encoded to base64.
+"""
+from __future__ import division, print_function, absolute_import
+
+import base64
+import json
+import os
+import subprocess
+import sys
+import traceback
+
+from perf._stream import load_worker_result
+from perf._utils import (popen_killer, create_environ, create_pipe,
+                         WritePipe)
+
+
+class ForkServer(object):
+    # Master side of the fork server: spawn the template process and send
+    # it worker requests
+
+    def __init__(self, runner, python):
+        self._runner = runner
+        args = runner.args
+
+        env = create_environ(args.inherit_environ, args.locale)
+
+        self._rpipe, wpipe = create_pipe()
+        with wpipe:
+            warg = wpipe.to_subprocess()
+            cmd = runner._worker_cmd(python, False, warg, fork_server=True)
+
+            kw = {}
+            if sys.version_info >= (3, 2):
+                kw['pass_fds'] = [wpipe.fd]
+            self._cmd = cmd
+            self._proc = subprocess.Popen(cmd, env=env,
+                                          stdin=subprocess.PIPE,
+                                          universal_newlines=True,
+                                          **kw)
+        self._rfile = self._rpipe.open_text()
+
+    def spawn_worker(self, calibrate=False):
+        # the pipe argument is replaced by the template process
+        cmd = self._runner._worker_cmd(self._cmd[0], calibrate, 'FD')
+        worker_args = cmd[1 + len(self._runner._program_args):]
+
+        with popen_killer(self._proc):
+            self._proc.stdin.write(json.dumps(worker_args) + '\n')
+            self._proc.stdin.flush()
+            line = self._rfile.readline()
+
+        if not line:
+            exitcode = self._proc.wait()
+            raise RuntimeError("%s fork server exited with exit code %s"
+                               % (self._cmd[0], exitcode))
+
+        reply = json.loads(line)
+        exitcode = reply['exitcode']
+        if exitcode:
+            from perf._runner import WorkerError
+            raise WorkerError("%s forked worker failed with exit code %s"
+                              % (self._cmd[0], exitcode),
+                              self._cmd[0], exitcode)
+        result = base64.b64decode(reply['result'].encode('ascii'))
+        return load_worker_result(result)
+
+    def close(self):
+        # closing stdin asks the template process to exit
+        self._proc.stdin.close()
+        self._rfile.close()
+        exitcode = self._proc.wait()
+        if exitcode:
+            raise RuntimeError("%s fork server failed with exit code %s"
+                               % (self._cmd[0], exitcode))
+
+
+def _run_child(runner, task, worker_args, wfd):
+    # Code of the forked child process: never return
+    exitcode = 0
+    try:
+        worker_args = list(worker_args)
+        index = worker_args.index('--pipe')
+        worker_args[index + 1] = str(wfd)
+
+        runner.args = None
+        runner.parse_args(worker_args)
+        task._set_args(runner.args)
+        try:
+            runner._worker(task)
+        finally:
+            # os._exit() doesn't run the finally blocks of the template
+            # process: stop the command helper and remove its files
+            task.close()
+    except SystemExit as exc:
+        exitcode = exc.code
+        if exitcode is None:
+            exitcode = 0
+        elif not isinstance(exitcode, int):
+            print(exitcode, file=sys.stderr)
+            exitcode = 1
+    except BaseException:
+        traceback.print_exc()
+        exitcode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exitcode)
+
+
+def _fork_worker(runner, task, worker_args):
+    rfd, wfd = os.pipe()
+
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        _run_child(runner, task, worker_args, wfd)
+
+    os.close(wfd)
+    with os.fdopen(rfd, "rb") as rfile:
+        result = base64.b64encode(rfile.read()).decode('ascii')
+
+    status = os.waitpid(pid, 0)[1]
+    if os.WIFSIGNALED(status):
+        exitcode = -os.WTERMSIG(status)
+    else:
+        exitcode = os.WEXITSTATUS(status)
+    return (exitcode, result)
+
+
+def run_fork_server(runner, task):
+    # Template process side of the fork server: fork a child process per
+    # request written by the master into stdin, until stdin is closed
+    wpipe = WritePipe.from_subprocess(runner.args.pipe)
+    with wpipe.open_text() as wfile:
+        while True:
+            line = sys.stdin.readline()
+            if not line:
+                break
+            worker_args = json.loads(line)
+
+            exitcode, result = _fork_worker(runner, task, worker_args)
+            reply = {'exitcode': exitcode, 'result': result}
+            wfile.write(json.dumps(reply) + '\n')
+            wfile.flush()
@@ -103,6 +103,34 @@ def format_integers(numbers):
     return tuple(format_number(number) for number in numbers)
 
 
+def _format_rates(rates, units, base):
+    ref_rate = abs(rates[0])
+    k = 0
+    while k < len(units) - 1 and ref_rate >= base ** (k + 1):
+        k += 1
+    factor = base ** k
+
+    ref_rate /= factor
+    if ref_rate >= 100:
+        precision = 0
+    elif ref_rate >= 10:
+        precision = 1
+    else:
+        precision = 2
+    fmt = "%%.%sf %s" % (precision, units[k])
+
+    return tuple(fmt % (rate / factor,) for rate in rates)
+
+
+def format_op_rates(rates):
+    return _format_rates(rates, ('op/s', 'kop/s', 'Mop/s', 'Gop/s'), 1000)
+
+
+def format_byte_rates(rates):
+    # use 1024 as format_filesize()
+    return _format_rates(rates, ('byte/s', 'kB/s', 'MB/s', 'GB/s'), 1024)
+
+
 DEFAULT_UNIT = 'second'
 UNIT_FORMATTERS = {
     'second': format_timedeltas,
@@ -110,6 +138,13 @@ UNIT_FORMATTERS = {
     'integer': format_integers,
 }
 
+# Rate units: values are stored in seconds and displayed as a throughput,
+# see the rate_unit and items_per_loop metadata
+RATE_FORMATTERS = {
+    'op/s': format_op_rates,
+    'byte/s': format_byte_rates,
+}
+
 
 def format_values(unit, values):
     if not unit:
@@ -0,0 +1,157 @@
+"""
+Import time of Python modules: perf command --python-importtime.
+
+The command is a Python 3.7+ interpreter run with -X importtime: for each
+execution, Python writes a tree of the imported modules into stderr:
+
+    import time: self [us] | cumulative | imported package
+    import time:       271 |        271 |   _io
+    import time:       610 |       1580 | _frozen_importlib_external
+
+Worker: ImportTimeProbe parses stderr and records the self and cumulative
+import time per execution of each module as run series,
+"import:MODULE:self_time" and "import:MODULE:cumulative_time".
+
+Master: split_import_times() moves these series out of the command
+benchmark into a family of benchmarks, one per module, called
+"NAME: import MODULE". Values are the self import time; the cumulative
+import time is kept as the cumulative_time series.
+"""
+from __future__ import division, print_function, absolute_import
+
+import perf
+from perf._bench import Run
+
+
+_PREFIX = 'import:'
+_SELF_SUFFIX = ':self_time'
+_CUMULATIVE_SUFFIX = ':cumulative_time'
+_LINE_PREFIX = 'import time:'
+
+
+def parse_importtime(text):
+    # Parse the stderr of one or more executions of python3 -X importtime.
+    # Return a dict {module: [self, cumulative]}: import times in
+    # microseconds summed on all executions.
+    modules = {}
+    for line in text.splitlines():
+        if not line.startswith(_LINE_PREFIX):
+            continue
+        parts = line[len(_LINE_PREFIX):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_time = int(parts[0])
+            cumulative = int(parts[1])
+        except ValueError:
+            # header line
+            continue
+        module = parts[2].strip()
+
+        times = modules.setdefault(module, [0, 0])
+        times[0] += self_time
+        times[1] += cumulative
+    return modules
+
+
+def _get_self_series(module):
+    return _PREFIX + module + _SELF_SUFFIX
+
+
+def _get_cumulative_series(module):
+    return _PREFIX + module + _CUMULATIVE_SUFFIX
+
+
+class ImportTimeProbe(object):
+    # Import times of each value of Runner.bench_command(): parse the stderr
+    # of the command written by the CommandHelper. The probe returns all
+    # modules seen by previous values, so series keep the same length.
+
+    def __init__(self, helper):
+        self._helper = helper
+        self._modules = set()
+
+    def start(self):
+        # ignore stderr of warmups and of the calibration
+        self._helper.read_stderr()
+
+    def stop(self):
+        text = self._helper.read_stderr().decode('utf8', 'replace')
+        modules = parse_importtime(text)
+        self._modules.update(modules)
+
+        measures = {}
+        for module in self._modules:
+            self_time, cumulative = modules.get(module, (0, 0))
+            measures[_get_self_series(module)] = self_time * 1e-6
+            measures[_get_cumulative_series(module)] = cumulative * 1e-6
+        return measures
+
+    def close(self):
+        pass
+
+
+def _get_modules(run):
+    modules = []
+    for name in run._get_series_names():
+        if name.startswith(_PREFIX) and name.endswith(_SELF_SUFFIX):
+            modules.append(name[len(_PREFIX):-len(_SELF_SUFFIX)])
+    return modules
+
+
+def _strip_run(run):
+    # Return a copy of run without import series
+    names = run._get_series_names()
+    if not any(name.startswith(_PREFIX) for name in names):
+        return run
+
+    series = dict((name, run._get_series(name)) for name in names
+                  if not name.startswith(_PREFIX))
+    new_run = run._replace()
+    new_run._series = series or None
+    return new_run
+
+
+def _module_run(run, module, name):
+    # Return a run of the import time of module, or None if the import time
+    # is zero for a value (too short to be measured, or the module was not
+    # imported)
+    values = run._get_series(_get_self_series(module))
+    if not all(values):
+        return None
+
+    metadata = dict(run._metadata, name=name, unit='second')
+    new_run = Run(values, warmups=None, collect_metadata=False)
+    new_run._metadata = metadata
+    new_run._set_series({
+        'cumulative_time': run._get_series(_get_cumulative_series(module)),
+    })
+    return new_run
+
+
+def get_import_bench_name(name, module):
+    return '%s: import %s' % (name, module)
+
+
+def split_import_times(bench):
+    # Return (bench, suite): bench without import series, and a
+    # BenchmarkSuite of the import time of each module, or None if the
+    # benchmark has no import series
+    name = bench.get_name()
+    module_runs = {}
+    runs = []
+    for run in bench.get_runs():
+        for module in _get_modules(run):
+            bench_name = get_import_bench_name(name, module)
+            module_run = _module_run(run, module, bench_name)
+            if module_run is not None:
+                module_runs.setdefault(module, []).append(module_run)
+        runs.append(_strip_run(run))
+
+    if not module_runs:
+        return (bench, None)
+
+    bench = perf.Benchmark(runs)
+    benchmarks = [perf.Benchmark(module_runs[module])
+                  for module in sorted(module_runs)]
+    return (bench, perf.BenchmarkSuite(benchmarks))
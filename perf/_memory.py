@@ -1,8 +1,10 @@
 from __future__ import division, print_function, absolute_import
 
+import os
 import threading
 import time
 
+import perf
 from perf._utils import proc_path
 
 
@@ -11,53 +13,223 @@ from perf._utils import proc_path
 # See http://bmaurer.blogspot.com/2006/03/memory-usage-with-smaps.html for
 # a quick introduction to smaps.
 #
-# Need Linux 2.6.16 or newer.
-def read_smap_file():
+# Need Linux 2.6.16 or newer. /proc/self/smaps_rollup (Linux 4.14) contains
+# the sum of all mappings of /proc/self/smaps: it's much cheaper to read for
+# a process with many memory mappings.
+def parse_private_memory(data):
     total = 0
-    fp = open(proc_path("self/smaps"), "rb")
-    with fp:
-        for line in fp:
-            # Include both Private_Clean and Private_Dirty sections.
-            line = line.rstrip()
-            if line.startswith(b"Private_") and line.endswith(b'kB'):
-                parts = line.split()
-                total += int(parts[1]) * 1024
+    for line in data.splitlines():
+        # Include both Private_Clean and Private_Dirty sections.
+        line = line.rstrip()
+        if line.startswith(b"Private_") and line.endswith(b'kB'):
+            parts = line.split()
+            total += int(parts[1]) * 1024
     return total
 
 
+class SmapsReader(object):
+    # Read the private memory usage of the current process. The file is only
+    # opened once, and read again from the start for each sample.
+
+    def __init__(self):
+        self.path = proc_path("self/smaps_rollup")
+        try:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            self.path = proc_path("self/smaps")
+            self._fd = os.open(self.path, os.O_RDONLY)
+
+    def read(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return parse_private_memory(b''.join(chunks))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def read_smap_file():
+    reader = SmapsReader()
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+
+def downsample(samples, size):
+    # Downsample a list of (timestamp, usage) into size buckets of the same
+    # duration: keep the maximum usage of each bucket. An empty bucket
+    # reuses the usage of the previous bucket.
+    start = samples[0][0]
+    duration = samples[-1][0] - start
+    if len(samples) <= size or not duration:
+        return [usage for timestamp, usage in samples]
+
+    buckets = [None] * size
+    for timestamp, usage in samples:
+        index = min(int((timestamp - start) * size / duration), size - 1)
+        if buckets[index] is None or usage > buckets[index]:
+            buckets[index] = usage
+
+    timeline = []
+    usage = samples[0][1]
+    for bucket in buckets:
+        if bucket is not None:
+            usage = bucket
+        timeline.append(usage)
+    return timeline
+
+
+class BucketTimeline(object):
+    # Maximum usage per time bucket, with a fixed number of buckets: when a
+    # sample falls after the last bucket, adjacent buckets are merged and the
+    # duration of a bucket is doubled. The memory used by the timeline
+    # doesn't depend on the duration of the benchmark.
+
+    def __init__(self, size, duration):
+        self.size = size
+        # duration of a bucket in seconds
+        self.duration = duration
+        self.start = None
+        # maximum usage per bucket, None for an empty bucket
+        self.buckets = []
+        self.nsample = 0
+
+    def _merge(self):
+        buckets = []
+        for index in range(0, len(self.buckets), 2):
+            pair = [usage for usage in self.buckets[index:index + 2]
+                    if usage is not None]
+            buckets.append(max(pair) if pair else None)
+        self.buckets = buckets
+        self.duration *= 2
+
+    def add(self, timestamp, usage):
+        if self.start is None:
+            self.start = timestamp
+        self.nsample += 1
+
+        index = int((timestamp - self.start) / self.duration)
+        while index >= self.size:
+            self._merge()
+            index = int((timestamp - self.start) / self.duration)
+
+        if index >= len(self.buckets):
+            self.buckets.extend([None] * (index + 1 - len(self.buckets)))
+        if self.buckets[index] is None or usage > self.buckets[index]:
+            self.buckets[index] = usage
+
+    def get_samples(self):
+        # Return the list of (timestamp, usage) of non-empty buckets
+        return [(self.start + index * self.duration, usage)
+                for index, usage in enumerate(self.buckets)
+                if usage is not None]
+
+
 class PeakMemoryUsageThread(threading.Thread):
+    # Sample the memory usage of the current process in a thread.
+    #
+    # The sampling interval is adaptive: it starts at MIN_INTERVAL, is
+    # doubled up to MAX_INTERVAL while the memory usage doesn't change, and
+    # is reset to MIN_INTERVAL when the usage changes. The interval is also
+    # long enough to keep the sampler busy at most MAX_DUTY of the time.
+    MIN_INTERVAL = 0.001   # 1 ms
+    MAX_INTERVAL = 0.016   # 16 ms
+    MAX_DUTY = 0.02   # 2%
+    # Number of points of the memory usage timeline
+    TIMELINE_SIZE = 32
+
     def __init__(self):
         threading.Thread.__init__(self)
+        self.daemon = True
         self.peak_usage = 0
-        self._done = threading.Event()
-        self.sleep = 0.001   # 1 ms
-        self._quit = False
+        self.min_usage = None
+        self.final_usage = None
+        # bounded timeline: twice more buckets than timeline points, to keep
+        # the timeline precise after buckets are merged
+        self.timeline = BucketTimeline(self.TIMELINE_SIZE * 2,
+                                       self.MIN_INTERVAL)
+        # CPU time spent by the sampler thread in seconds
+        self.sampler_time = 0.0
+        self._reader = None
+        self._quit = threading.Event()
 
     def get(self):
-        usage = read_smap_file()
+        if self._reader is None:
+            self._reader = SmapsReader()
+        usage = self._reader.read()
         self.peak_usage = max(self.peak_usage, usage)
+        if self.min_usage is None:
+            self.min_usage = usage
+        else:
+            self.min_usage = min(self.min_usage, usage)
+        self.final_usage = usage
+        self.timeline.add(perf.perf_counter(), usage)
+        return usage
 
     def run(self):
+        # Measure the CPU time of the sampler rather than the elapsed time
+        # which includes the time spent to wait for the GIL.
+        # time.thread_time() requires Python 3.7.
+        clock = getattr(time, 'thread_time', perf.perf_counter)
+
+        interval = self.MIN_INTERVAL
+        previous = None
         try:
-            while not self._quit:
-                self.get()
-                time.sleep(self.sleep)
+            while not self._quit.is_set():
+                start = clock()
+                usage = self.get()
+                cost = clock() - start
+                self.sampler_time += cost
+
+                if usage == previous:
+                    interval = min(interval * 2, self.MAX_INTERVAL)
+                else:
+                    interval = self.MIN_INTERVAL
+                interval = max(interval, cost / self.MAX_DUTY)
+                previous = usage
+
+                self._quit.wait(interval)
         finally:
-            self._done.set()
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
 
     def stop(self):
-        self._quit = True
-        self._done.wait()
+        self._quit.set()
+        self.join()
         return self.peak_usage
 
+    def get_metadata(self):
+        if not self.timeline.nsample:
+            return {}
+
+        timeline = downsample(self.timeline.get_samples(), self.TIMELINE_SIZE)
+        timeline = ','.join(str(usage // 1024) for usage in timeline)
+        return {'mem_min_usage': self.min_usage,
+                'mem_final_usage': self.final_usage,
+                'mem_timeline': timeline,
+                'mem_samples': self.timeline.nsample,
+                'mem_sampler_time': self.sampler_time}
+
 
 def check_tracking_memory():
     mem_thread = PeakMemoryUsageThread()
     try:
         mem_thread.get()
-    except IOError as exc:
+    except (IOError, OSError) as exc:
         path = proc_path("self/smaps")
         return "unable to read %s: %s" % (path, exc)
+    finally:
+        if mem_thread._reader is not None:
+            mem_thread._reader.close()
 
     if not mem_thread.peak_usage:
         return "memory usage is zero"
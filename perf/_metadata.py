@@ -2,19 +2,107 @@ from __future__ import division, print_function, absolute_import
 
 import collections
 import six
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
 
 from perf._formatter import (format_number, format_seconds, format_filesize,
-                             UNIT_FORMATTERS)
+                             UNIT_FORMATTERS, RATE_FORMATTERS)
 
 
 METADATA_VALUE_TYPES = six.integer_types + six.string_types + (float,)
 NUMBER_TYPES = six.integer_types + (float,)
 
 
+_MISSING = object()
+
+
+class _LayeredMetadata(Mapping):
+    # Immutable metadata of a run loaded from JSON: metadata common to all
+    # runs of a benchmark are shared by reference, only the metadata
+    # specific to the run are stored in a small overlay dict
+
+    __slots__ = ('_common', '_overlay')
+
+    def __init__(self, common, overlay):
+        self._common = common
+        self._overlay = overlay
+
+    def __getitem__(self, key):
+        try:
+            return self._overlay[key]
+        except KeyError:
+            return self._common[key]
+
+    def get(self, key, default=None):
+        value = self._overlay.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self._common.get(key, default)
+
+    def __contains__(self, key):
+        return (key in self._overlay or key in self._common)
+
+    def __iter__(self):
+        for key in self._common:
+            if key not in self._overlay:
+                yield key
+        for key in self._overlay:
+            yield key
+
+    def __len__(self):
+        return len(self._common) + sum(1 for key in self._overlay
+                                       if key not in self._common)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _intern(value):
+    if type(value) is str:
+        return six.moves.intern(value)
+    return value
+
+
+def _intern_metadata(metadata):
+    # Loading many runs from JSON creates many copies of the same strings:
+    # intern metadata names and string values
+    return {_intern(name): _intern(value) for name, value in metadata.items()}
+
+
+def _layered_common_metadata(metadatas):
+    # Compute the common metadata of _LayeredMetadata objects sharing the
+    # same common dict: only keys of overlays have to be compared
+    common = metadatas[0]._common
+    keys = set()
+    for metadata in metadatas:
+        keys.update(metadata._overlay)
+
+    result = {key: value for key, value in common.items()
+              if key not in keys}
+    for key in keys:
+        value = metadatas[0].get(key, _MISSING)
+        if value is _MISSING:
+            continue
+        if all(metadata.get(key, _MISSING) == value
+               for metadata in metadatas[1:]):
+            result[key] = value
+    return result
+
+
 def _common_metadata(metadatas):
     if not metadatas:
         return {}
 
+    first = metadatas[0]
+    if (isinstance(first, _LayeredMetadata)
+       and all(isinstance(metadata, _LayeredMetadata)
+               and metadata._common is first._common
+               for metadata in metadatas)):
+        return _layered_common_metadata(metadatas)
+
     metadata = dict(metadatas[0])
     for run_metadata in metadatas[1:]:
         for key in set(metadata) - set(run_metadata):
@@ -53,6 +141,10 @@ def parse_load_avg(value):
         return float(value)
 
 
+def format_percent(value):
+    return '%.1f%%' % (value * 100)
+
+
 def format_noop(value):
     return value
 
@@ -67,16 +159,30 @@ DATETIME = _MetadataInfo(format_noop, six.string_types, None, None)
 METADATA = {
     'loops': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
     'inner_loops': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'warmups': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'processes': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'precision': _MetadataInfo(format_percent, NUMBER_TYPES, is_positive, None),
+    'worker_failures': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'worker_timeouts': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
 
     'duration': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
+    'spawn_overhead': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
+    'loop_overhead': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
+    'call_overhead': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'uptime': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'load_avg_1min': _MetadataInfo(format_system_load, NUMBER_TYPES, is_positive, None),
 
     'mem_max_rss': BYTES,
+    'mem_min_usage': BYTES,
+    'mem_final_usage': BYTES,
+    'mem_samples': _MetadataInfo(format_number, six.integer_types, is_strictly_positive, 'integer'),
+    'mem_sampler_time': _MetadataInfo(format_seconds, NUMBER_TYPES, is_positive, 'second'),
     'mem_peak_pagefile_usage': BYTES,
     'command_max_rss': BYTES,
 
     'unit': _MetadataInfo(format_noop, six.string_types, UNIT_FORMATTERS.__contains__, None),
+    'rate_unit': _MetadataInfo(format_noop, six.string_types, RATE_FORMATTERS.__contains__, None),
+    'items_per_loop': _MetadataInfo(format_number, NUMBER_TYPES, is_strictly_positive, None),
     'date': DATETIME,
     'boot_time': DATETIME,
 }
@@ -160,4 +266,6 @@ def _exclude_common_metadata(metadata, common_metadata):
     if common_metadata:
         metadata = {key: value for key, value in metadata.items()
                     if key not in common_metadata}
+    elif isinstance(metadata, _LayeredMetadata):
+        metadata = dict(metadata)
     return metadata
@@ -0,0 +1,193 @@
+"""
+Linux performance counters (--counters option) using the perf_event_open()
+syscall through ctypes.
+
+Counters count events of the worker process and of its child processes
+(inherit flag). If the kernel refuses to count kernel events
+(/proc/sys/kernel/perf_event_paranoid), only user space events are counted.
+Counters which cannot be opened (no PMU in a virtual machine, event not
+supported) are skipped.
+
+If more hardware events are requested than the PMU has counters, the kernel
+multiplexes events: each counter only runs part of the time. Counters are
+read with the time enabled and the time running, and counts are scaled by
+enabled/running.
+"""
+from __future__ import division, print_function, absolute_import
+
+import ctypes
+import errno
+import os
+import platform
+import struct
+
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+
+# name => (type, config)
+COUNTERS = {
+    'cycles': (PERF_TYPE_HARDWARE, 0),
+    'instructions': (PERF_TYPE_HARDWARE, 1),
+    'cache-references': (PERF_TYPE_HARDWARE, 2),
+    'cache-misses': (PERF_TYPE_HARDWARE, 3),
+    'branches': (PERF_TYPE_HARDWARE, 4),
+    'branch-misses': (PERF_TYPE_HARDWARE, 5),
+
+    'cpu-clock': (PERF_TYPE_SOFTWARE, 0),
+    'task-clock': (PERF_TYPE_SOFTWARE, 1),
+    'page-faults': (PERF_TYPE_SOFTWARE, 2),
+    'context-switches': (PERF_TYPE_SOFTWARE, 3),
+    'cpu-migrations': (PERF_TYPE_SOFTWARE, 4),
+    'minor-faults': (PERF_TYPE_SOFTWARE, 5),
+    'major-faults': (PERF_TYPE_SOFTWARE, 6),
+}
+
+# Counters measuring a duration in nanoseconds: converted to seconds
+TIME_COUNTERS = ('cpu-clock', 'task-clock')
+
+# perf_event_open() syscall number per architecture
+_SYSCALL_NUMBERS = {
+    'x86_64': 298,
+    'amd64': 298,
+    'i386': 336,
+    'i686': 336,
+    'aarch64': 241,
+    'armv7l': 364,
+    'ppc64le': 319,
+    'ppc64': 319,
+    's390x': 331,
+}
+
+# perf_event_attr flags
+_INHERIT = 1 << 1
+_EXCLUDE_KERNEL = 1 << 5
+_EXCLUDE_HV = 1 << 6
+
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+
+# perf_event_attr read_format
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+
+# (value, time_enabled, time_running)
+_COUNT = struct.Struct('QQQ')
+
+
+class _PerfEventAttr(ctypes.Structure):
+    # PERF_ATTR_SIZE_VER0 layout of struct perf_event_attr
+    _fields_ = [
+        ('type', ctypes.c_uint32),
+        ('size', ctypes.c_uint32),
+        ('config', ctypes.c_uint64),
+        ('sample_period', ctypes.c_uint64),
+        ('sample_type', ctypes.c_uint64),
+        ('read_format', ctypes.c_uint64),
+        ('flags', ctypes.c_uint64),
+        ('wakeup_events', ctypes.c_uint32),
+        ('bp_type', ctypes.c_uint32),
+        ('config1', ctypes.c_uint64),
+    ]
+
+
+def parse_counters(names):
+    # names: list of counter names, raise ValueError on unknown counter
+    for name in names:
+        if name not in COUNTERS:
+            raise ValueError("unknown counter %r, available counters: %s"
+                             % (name, ', '.join(sorted(COUNTERS))))
+    return names
+
+
+def _perf_event_open(libc, syscall_number, name):
+    event_type, config = COUNTERS[name]
+    attr = _PerfEventAttr()
+    attr.type = event_type
+    attr.size = ctypes.sizeof(_PerfEventAttr)
+    attr.config = config
+    attr.read_format = (PERF_FORMAT_TOTAL_TIME_ENABLED
+                        | PERF_FORMAT_TOTAL_TIME_RUNNING)
+
+    # first try to count kernel events, then only user space events
+    for flags in (_INHERIT, _INHERIT | _EXCLUDE_KERNEL | _EXCLUDE_HV):
+        attr.flags = flags
+        fd = libc.syscall(ctypes.c_long(syscall_number), ctypes.byref(attr),
+                          ctypes.c_long(0), ctypes.c_long(-1),
+                          ctypes.c_long(-1),
+                          ctypes.c_long(PERF_FLAG_FD_CLOEXEC))
+        if fd >= 0:
+            return fd
+
+        err = ctypes.get_errno()
+        if err not in (errno.EACCES, errno.EPERM):
+            break
+    raise OSError(err, os.strerror(err))
+
+
+def _scale_count(start, end):
+    # start and end are (value, time_enabled, time_running) tuples
+    count = end[0] - start[0]
+    enabled = end[1] - start[1]
+    running = end[2] - start[2]
+    if running <= 0:
+        # the counter was never scheduled on the PMU
+        return 0
+    if running < enabled:
+        # the counter was multiplexed with other counters
+        count = int(round(count * enabled / running))
+    return count
+
+
+class Counters(object):
+    def __init__(self, names):
+        # list of (name, fd) of opened counters
+        self._counters = []
+        # name => error message of counters which cannot be opened
+        self.errors = {}
+        self._start = None
+
+        syscall_number = _SYSCALL_NUMBERS.get(platform.machine())
+        if not platform.system() == 'Linux' or syscall_number is None:
+            for name in names:
+                self.errors[name] = ("perf_event_open() is not available "
+                                     "on this platform")
+            return
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.syscall.restype = ctypes.c_long
+        for name in names:
+            try:
+                fd = _perf_event_open(libc, syscall_number, name)
+            except OSError as exc:
+                self.errors[name] = str(exc)
+            else:
+                self._counters.append((name, fd))
+
+    @property
+    def names(self):
+        return [name for name, fd in self._counters]
+
+    def _read(self):
+        return [_COUNT.unpack(os.read(fd, _COUNT.size))
+                for name, fd in self._counters]
+
+    def start(self):
+        self._start = self._read()
+
+    def stop(self):
+        # Return the counter deltas since start(): dict {name: number},
+        # counts are ints, TIME_COUNTERS are floats in seconds
+        end = self._read()
+        result = {}
+        for (name, fd), start, stop in zip(self._counters, self._start, end):
+            count = _scale_count(start, stop)
+            if name in TIME_COUNTERS:
+                count = count * 1e-9
+            result[name] = count
+        return result
+
+    def close(self):
+        counters = self._counters
+        self._counters = []
+        for name, fd in counters:
+            os.close(fd)
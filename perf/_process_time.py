@@ -7,12 +7,27 @@ timer.
 
 Python subprocess.Popen() is implemented with fork()+exec(). Minimize the
 Python imports to reduce the memory footprint, to reduce the cost of
-fork()+exec().
+fork()+exec(). The program is spawned with os.posix_spawnp() if available
+(Python 3.8).
 
 Measure wall-time, not CPU time.
 
-If resource.getrusage() is available: compute the maximum RSS memory in bytes
-per process and writes it into stdout as a second line.
+If os.wait4() is available: get the resource usage of each run of the
+program, and write the maximum RSS memory in bytes into stdout as a second
+line.
+
+Server mode, "--server program [arg1 arg2 ...]": the script is a long-lived
+helper process of a perf worker, so the worker doesn't pay a Python startup
+per value. The helper reads a number of loops per line from stdin, runs the
+program loops times and writes one line into stdout: "elapsed max_rss" if
+os.wait4() is not available, otherwise "elapsed max_rss user_time sys_time
+minflt majflt nvcsw nivcsw" (elapsed and times in seconds, max_rss in bytes,
+resource usage summed on all runs of the program, except of max_rss). If the
+program fails, the line is "error exitcode".
+
+In server mode, "--stderr PATH" option written before the program appends
+the stderr of the program to the PATH file, rather than redirecting it to
+stdout (ex: to parse the output of python3 -X importtime).
 """
 from __future__ import division, print_function, absolute_import
 
@@ -30,53 +45,147 @@ except ImportError:
     else:
         perf_counter = time.time
 
-try:
-    import resource
-except ImportError:
-    resource = None
+
+PY3 = (sys.version_info >= (3,))
+if PY3:
+    xrange = range
+
+HAS_WAIT4 = hasattr(os, 'wait4')
+
+
+class CommandFailed(Exception):
+    pass
 
 
-def get_max_rss():
-    if resource is not None:
-        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
-        return usage.ru_maxrss * 1024
+def _wait(pid):
+    if HAS_WAIT4:
+        status, rusage = os.wait4(pid, 0)[1:]
     else:
-        return 0
+        status = os.waitpid(pid, 0)[1]
+        rusage = None
 
+    if os.WIFSIGNALED(status):
+        exitcode = -os.WTERMSIG(status)
+    else:
+        exitcode = os.WEXITSTATUS(status)
+    return (exitcode, rusage)
 
-PY3 = (sys.version_info >= (3,))
-if PY3:
-    xrange = range
+
+def _spawn(args, kw):
+    # Return (exitcode, rusage): rusage is None if os.wait4() is not available
+    if 'file_actions' in kw:
+        pid = os.posix_spawnp(args[0], args, os.environ,
+                              file_actions=kw['file_actions'])
+        return _wait(pid)
+
+    proc = subprocess.Popen(args, stdin=kw['stdin'], stdout=kw['stdout'],
+                            stderr=kw.get('stderr', subprocess.STDOUT))
+    if os.name != 'posix':
+        proc.wait()
+        return (proc.returncode, None)
+
+    exitcode, rusage = _wait(proc.pid)
+    # the process was waited by _wait(): don't wait it again
+    proc.returncode = exitcode
+    return (exitcode, rusage)
 
 
 def bench_process(timer, loops, args, kw):
+    # Return (elapsed, max_rss, usage) where usage is a tuple: (user_time,
+    # sys_time, minflt, majflt, nvcsw, nivcsw) summed on all runs, or None
+    # if os.wait4() is not available
     max_rss = 0
+    user_time = sys_time = 0.0
+    minflt = majflt = nvcsw = nivcsw = 0
     range_it = xrange(loops)
     start_time = timer()
 
     for loop in range_it:
-        start_rss = get_max_rss()
+        exitcode, rusage = _spawn(args, kw)
+        if exitcode != 0:
+            raise CommandFailed(exitcode)
 
-        proc = subprocess.Popen(args, **kw)
-        if PY3:
-            with proc:
-                proc.wait()
-        else:
-            proc.wait()
+        if rusage is not None:
+            max_rss = max(max_rss, rusage.ru_maxrss * 1024)
+            user_time += rusage.ru_utime
+            sys_time += rusage.ru_stime
+            minflt += rusage.ru_minflt
+            majflt += rusage.ru_majflt
+            nvcsw += rusage.ru_nvcsw
+            nivcsw += rusage.ru_nivcsw
 
-        exitcode = proc.returncode
-        if exitcode != 0:
-            print("Command failed with exit code %s" % exitcode,
-                  file=sys.stderr)
-            sys.exit(exitcode)
+    dt = timer() - start_time
+    if HAS_WAIT4:
+        usage = (user_time, sys_time, minflt, majflt, nvcsw, nivcsw)
+    else:
+        usage = None
+    return (dt, max_rss, usage)
 
-        proc = None
 
-        rss = get_max_rss() - start_rss
-        max_rss = max(max_rss, rss)
+def _open_devnull(stderr=None):
+    # Return (kw, files): files is a list of files which must be closed.
+    # If stderr is set, append stderr of the program to the stderr file.
+    kw = {}
+    if hasattr(os, 'posix_spawnp'):
+        if stderr is not None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            redirect_stderr = (os.POSIX_SPAWN_OPEN, 2, stderr, flags, 0o600)
+        else:
+            redirect_stderr = (os.POSIX_SPAWN_DUP2, 1, 2)
+        kw['file_actions'] = [
+            (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+            (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+            redirect_stderr,
+        ]
+        return (kw, [])
+
+    files = []
+    if stderr is not None:
+        kw['stderr'] = open(stderr, 'a')
+        files.append(kw['stderr'])
 
-    dt = timer() - start_time
-    return (dt, max_rss)
+    if hasattr(subprocess, 'DEVNULL'):
+        kw['stdin'] = subprocess.DEVNULL
+        kw['stdout'] = subprocess.DEVNULL
+        return (kw, files)
+
+    devnull = open(os.devnull, 'w+', 0)
+    kw['stdin'] = devnull
+    kw['stdout'] = devnull
+    files.append(devnull)
+    return (kw, files)
+
+
+def _close_files(files):
+    for fp in files:
+        fp.close()
+
+
+def server(args, stderr=None):
+    kw, files = _open_devnull(stderr)
+    stdin = sys.stdin
+    stdout = sys.stdout
+    try:
+        while True:
+            line = stdin.readline()
+            if not line:
+                # the worker process exited
+                break
+
+            loops = int(line)
+            try:
+                dt, max_rss, usage = bench_process(perf_counter, loops,
+                                                   args, kw)
+            except CommandFailed as exc:
+                stdout.write("error %s\n" % exc.args[0])
+            else:
+                fields = [repr(dt), str(max_rss)]
+                if usage is not None:
+                    fields.extend(repr(item) for item in usage)
+                stdout.write(' '.join(fields) + '\n')
+            stdout.flush()
+    finally:
+        _close_files(files)
 
 
 def main():
@@ -86,30 +195,36 @@ def main():
               % os.path.basename(sys.executable))
         sys.exit(1)
 
+    if len(sys.argv) >= 3 and sys.argv[1] == '--server':
+        args = sys.argv[2:]
+        stderr = None
+        if len(args) >= 3 and args[0] == '--stderr':
+            stderr = args[1]
+            args = args[2:]
+        server(args, stderr)
+        return
+
     if len(sys.argv) < 3:
         print("Usage: %s %s loops program [arg1 arg2 ...]"
               % (os.path.basename(sys.executable), __file__))
+        print("       %s %s --server [--stderr PATH] "
+              "program [arg1 arg2 ...]"
+              % (os.path.basename(sys.executable), __file__))
         sys.exit(1)
 
     loops = int(sys.argv[1])
     args = sys.argv[2:]
-    timer = perf_counter
-
-    kw = {}
-    if hasattr(subprocess, 'DEVNULL'):
-        devnull = None
-        kw['stdin'] = subprocess.DEVNULL
-        kw['stdout'] = subprocess.DEVNULL
-    else:
-        devnull = open(os.devnull, 'w+', 0)
-        kw['stdin'] = devnull
-        kw['stdout'] = devnull
-    kw['stderr'] = subprocess.STDOUT
-
-    dt, max_rss = bench_process(timer, loops, args, kw)
 
-    if devnull is not None:
-        devnull.close()
+    kw, files = _open_devnull()
+    try:
+        dt, max_rss, usage = bench_process(perf_counter, loops, args, kw)
+    except CommandFailed as exc:
+        exitcode = exc.args[0]
+        print("Command failed with exit code %s" % exitcode,
+              file=sys.stderr)
+        sys.exit(exitcode)
+    finally:
+        _close_files(files)
 
     # Write timing in seconds into stdout
     print(dt)
@@ -1,26 +1,38 @@
 from __future__ import division, print_function, absolute_import
 
 import argparse
-import errno
+import collections
 import functools
 import math
 import os
+import random
+import signal
 import subprocess
 import sys
+import threading
 
 import six
 
 import perf
 from perf._cli import (format_run, format_benchmark, format_checks,
                        multiline_output, display_title, format_result_value)
-from perf._bench import _load_suite_from_pipe
 from perf._cpu_utils import (format_cpu_list, parse_cpu_list,
                              get_isolated_cpus, set_cpu_affinity)
 from perf._formatter import format_timedelta, format_number
+from perf._async import LOOP_POLICIES
+from perf._metadata import check_metadata
+from perf._stream import StreamReader, StreamWriter
 from perf._utils import (MS_WINDOWS, popen_killer, abs_executable,
                          create_environ, create_pipe, WritePipe,
-                         get_python_names, popen_communicate)
-from perf._worker import WorkerProcessTask, BenchCommandTask
+                         get_python_names, grouped_mean_precision)
+from perf._worker import WorkerProcessTask, BenchCommandTask, CommandHelper
+
+try:
+    # Python 3.3 provides a real monotonic clock (PEP 418)
+    from time import monotonic as monotonic_clock
+except ImportError:
+    # time.time() can go backward on Python 2, but it's fine for Runner
+    from time import time as monotonic_clock
 
 try:
     # Optional dependency
@@ -36,6 +48,13 @@ def strictly_positive(value):
     return value
 
 
+def strictly_positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise ValueError("value must be > 0")
+    return value
+
+
 def positive_or_nul(value):
     if '^' in value:
         x, _, y = value.partition('^')
@@ -49,11 +68,30 @@ def positive_or_nul(value):
     return value
 
 
+GC_MODES = ('default', 'disable', 'collect-between')
+
+
+def parse_warmups(value):
+    if value.strip() == 'auto':
+        return 'auto'
+    return positive_or_nul(value)
+
+
 def comma_separated(values):
     values = [value.strip() for value in values.split(',')]
     return list(filter(None, values))
 
 
+def parse_percent(value):
+    value = value.strip()
+    if value.endswith('%'):
+        value = value[:-1]
+    value = float(value)
+    if value <= 0:
+        raise ValueError("value must be > 0")
+    return value / 100.0
+
+
 def parse_python_names(names):
     parts = names.split(':')
     if len(parts) != 2:
@@ -61,6 +99,156 @@ def parse_python_names(names):
     return parts
 
 
+class _WorkerThread(threading.Thread):
+    # Thread spawning a worker process: func() must return the worker suite
+    def __init__(self, func):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._func = func
+        self._suite = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._suite = self._func()
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+    def get_suite(self):
+        self.join()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._suite
+
+
+def _noop():
+    pass
+
+
+def _make_noop(nargs):
+    # Create a no-op function with nargs positional parameters: the cost of
+    # packing arguments into a tuple (def func(*args)) would be part of the
+    # measured call overhead
+    params = ', '.join('arg%s' % index for index in range(nargs))
+    namespace = {}
+    exec("def noop(%s):\n    pass" % params, namespace)
+    return namespace['noop']
+
+
+def _time_func_loops(func, loops):
+    # use fast local variables
+    local_timer = perf.perf_counter
+    local_func = func
+    if loops != 1:
+        range_it = range(loops)
+
+        t0 = local_timer()
+        for _ in range_it:
+            local_func()
+        dt = local_timer() - t0
+    else:
+        t0 = local_timer()
+        local_func()
+        dt = local_timer() - t0
+
+    return dt
+
+
+def _time_empty_loops(loops):
+    # Same loop than _time_func_loops(), but without the function call
+    local_timer = perf.perf_counter
+    if loops != 1:
+        range_it = range(loops)
+
+        t0 = local_timer()
+        for _ in range_it:
+            pass
+        dt = local_timer() - t0
+    else:
+        t0 = local_timer()
+        dt = local_timer() - t0
+
+    return dt
+
+
+class WorkerError(RuntimeError):
+    # A worker process failed or was killed by the watchdog
+    def __init__(self, msg, python, exitcode, timeout=False):
+        RuntimeError.__init__(self, msg)
+        self.python = python
+        self.exitcode = exitcode
+        self.timeout = timeout
+
+
+class _Watchdog(object):
+    # Kill a worker process which doesn't produce any warmup or value
+    # during timeout seconds (--worker-timeout)
+    def __init__(self, proc, timeout):
+        self._proc = proc
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._timer = None
+        self._deadline = None
+        self._cancelled = False
+        self.expired = False
+
+    def _start_timer(self, delay):
+        # must be called with the lock held
+        self._timer = threading.Timer(delay, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            # the worker may have completed just before the timer expired,
+            # or the watchdog was cancelled while the timer was waiting for
+            # the lock: don't report a successful worker as a timeout
+            if self._cancelled or self._proc.poll() is not None:
+                return
+
+            delay = self._deadline - monotonic_clock()
+            if delay > 0:
+                # reset() was called since the timer was started
+                self._start_timer(delay)
+                return
+
+            self.expired = True
+            try:
+                self._proc.kill()
+            except OSError:
+                # process already terminated
+                pass
+
+    def reset(self):
+        # Called for each warmup and value: only move the deadline, don't
+        # start a new thread
+        with self._lock:
+            self._deadline = monotonic_clock() + self._timeout
+            if self._timer is None:
+                self._start_timer(self._timeout)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+def _format_exitcode(exitcode):
+    if exitcode >= 0 or MS_WINDOWS:
+        return 'exit code %s' % exitcode
+    return 'signal %s' % _signal_name(-exitcode)
+
+
+def _signal_name(signum):
+    for name in dir(signal):
+        if (name.startswith('SIG') and not name.startswith('SIG_')
+                and getattr(signal, name) == signum):
+            return name
+    return str(signum)
+
+
 class Runner:
     # Default parameters are chosen to have approximatively a run of 0.5 second
     # and so a total duration of 5 seconds by default
@@ -103,6 +291,25 @@ class Runner:
         # Set used to check that benchmark names are unique
         self._bench_names = set()
 
+        # CPUs used to pin worker processes run in parallel (--parallel)
+        self._parallel_cpus = None
+
+        # CalibrationCache object, created at the first use
+        # (--calibration-cache)
+        self._calibration_cache = None
+
+        # CPU lists of REF_PYTHON and PYTHON workers with
+        # --compare-mode=concurrent
+        self._compare_cpus = None
+
+        # Checkpoint object, created at the first use (--checkpoint)
+        self._checkpoint = None
+
+        # Failed worker processes of the current benchmark: list of
+        # WorkerError (--max-failures)
+        self._worker_failures = []
+        self._failures_lock = threading.Lock()
+
         # result of argparser.parse_args()
         self.args = None
 
@@ -143,15 +350,45 @@ class Runner:
                             help='number of values per process (default: %s)'
                                  % values)
         parser.add_argument('-w', '--warmups', dest="warmups",
-                            type=positive_or_nul, default=warmups,
+                            type=parse_warmups, default=warmups,
                             help='number of skipped values per run used '
-                                 'to warmup the benchmark (default: %s)'
+                                 'to warmup the benchmark, or "auto" to '
+                                 'run warmups until values are stable '
+                                 '(default: %s)'
                                  % warmups)
+        parser.add_argument('--max-warmups', metavar='WARMUPS',
+                            type=strictly_positive, default=50,
+                            help='maximum number of warmups per run '
+                                 'with --warmups=auto (default: 50)')
         parser.add_argument('-l', '--loops',
                             type=positive_or_nul, default=loops,
                             help='number of loops per value, 0 means '
                                  'automatic calibration (default: %s)'
                             % loops)
+        parser.add_argument('--target-precision', metavar='PERCENT',
+                            type=parse_percent,
+                            help='Spawn worker processes until the 95%% '
+                                 'confidence interval of the mean is smaller '
+                                 'than PERCENT of the mean (ex: 1%%)')
+        parser.add_argument('--max-processes', metavar='PROCESSES',
+                            type=strictly_positive,
+                            help='maximum number of processes used with '
+                                 '--target-precision (default: %s)'
+                                 % (processes * 2))
+        parser.add_argument('--calibration-cache', metavar='FILENAME',
+                            help='Persistent cache of calibrated numbers of '
+                                 'loops: reuse the cached number of loops '
+                                 'rather than calibrating the benchmark')
+        parser.add_argument('--calibration-margin', metavar='PERCENT',
+                            type=parse_percent, default=0.25,
+                            help='Invalidate a cached number of loops if a '
+                                 'value is shorter than MIN_TIME minus '
+                                 'PERCENT (default: 25%%)')
+        parser.add_argument('--checkpoint', metavar='FILENAME',
+                            help='Append the run of each worker to '
+                                 'FILENAME as soon as it completes. If the '
+                                 'file exists, skip processes which already '
+                                 'completed: resume an interrupted session')
         parser.add_argument('-v', '--verbose', action="store_true",
                             help='enable verbose mode')
         parser.add_argument('-q', '--quiet', action="store_true",
@@ -168,6 +405,28 @@ class Runner:
                                  'value, used to calibrate the number of '
                                  'loops (default: %s)'
                             % format_timedelta(min_time))
+        parser.add_argument('--subtract-overhead', action='store_true',
+                            help='Subtract the loop and call overhead, '
+                                 'measured by each worker, from values')
+        parser.add_argument('--counters', metavar='LIST',
+                            type=comma_separated,
+                            help='Comma-separated list of Linux performance '
+                                 'counters measured for each value, ex: '
+                                 'instructions,cycles,task-clock')
+        parser.add_argument('--loop-policy', default='asyncio',
+                            choices=LOOP_POLICIES,
+                            help='Event loop used by bench_async_func(): '
+                                 'asyncio, uvloop, or auto to use uvloop '
+                                 'if available (default: asyncio)')
+        parser.add_argument('--gc', choices=GC_MODES,
+                            help='Garbage collector mode: default, disable '
+                                 '(disable the GC while computing a value) '
+                                 'or collect-between (collect the garbage '
+                                 'before each value). Record the GC '
+                                 'activity of each value.')
+        parser.add_argument('--cpu-time', action='store_true',
+                            help='Measure also the process CPU time and the '
+                                 'thread CPU time of each value')
         parser.add_argument('--worker', action='store_true',
                             help='Worker process, run the benchmark.')
         parser.add_argument('--worker-task', type=positive_or_nul, metavar='TASK_ID',
@@ -191,6 +450,26 @@ class Runner:
                                  'run variation. By default, worker processes '
                                  'are pinned to isolate CPUs if isolated CPUs '
                                  'are found.')
+        parser.add_argument('--parallel', metavar='NJOBS',
+                            type=strictly_positive, default=1,
+                            help='Run up to NJOBS worker processes in '
+                                 'parallel. Each worker is pinned to its own '
+                                 'CPU, taken from isolated CPUs or from '
+                                 '--affinity (default: 1, run workers '
+                                 'sequentially)')
+        parser.add_argument('--fork-server', action='store_true',
+                            help='Spawn a single template worker process per '
+                                 'benchmark which imports the script once, '
+                                 'and then forks a child process per worker')
+        parser.add_argument('--worker-timeout', metavar='SECONDS',
+                            type=strictly_positive_float,
+                            help='Kill a worker process which does not '
+                                 'produce any value during SECONDS seconds')
+        parser.add_argument('--max-failures', metavar='N',
+                            type=positive_or_nul, default=0,
+                            help='Maximum number of failed worker processes '
+                                 'replaced by new workers, before giving up '
+                                 '(default: 0)')
         parser.add_argument("--inherit-environ", metavar='VARS',
                             type=comma_separated,
                             help='Comma-separated list of environment '
@@ -208,6 +487,17 @@ class Runner:
                             help='Run benchmark on the Python executable REF_PYTHON, '
                                  'run benchmark on Python executable PYTHON, '
                                  'and then compare REF_PYTHON result to PYTHON result')
+        parser.add_argument("--compare-mode", default='sequential',
+                            choices=('sequential', 'interleaved', 'random',
+                                     'concurrent'),
+                            help='order of worker processes with '
+                                 '--compare-to: run all REF_PYTHON workers '
+                                 'and then all PYTHON workers (sequential, '
+                                 'default), alternate REF_PYTHON and PYTHON '
+                                 'workers (interleaved), alternate them in '
+                                 'randomized blocks (random), or run them at '
+                                 'the same time on two disjoint sets of CPUs '
+                                 '(concurrent)')
         parser.add_argument("--python-names", metavar="REF_NAME:CHANGED_NAMED",
                             type=parse_python_names,
                             help='option used with --compare-to to name '
@@ -219,6 +509,12 @@ class Runner:
                             help='Trace memory allocations using tracemalloc')
         memory.add_argument('--track-memory', action="store_true",
                             help='Track memory usage using a thread')
+        memory.add_argument('--track-allocations', nargs='?',
+                            const='blocks', choices=('blocks', 'tracemalloc'),
+                            help='Count memory allocations of each value '
+                                 'using sys.getallocatedblocks(), and the '
+                                 'traced memory if the mode is '
+                                 'tracemalloc (default mode: blocks)')
 
         self.argparser = parser
 
@@ -251,6 +547,9 @@ class Runner:
             args.loops = 1
             args.min_time = 1e-9
 
+        if args.target_precision and not args.max_processes:
+            args.max_processes = nprocess * 2
+
         if args.calibrate:
             if not args.worker:
                 print("ERROR: Calibration can only be done "
@@ -271,7 +570,7 @@ class Runner:
             print("ERROR: --worker-task can only be used with --worker")
             sys.exit(1)
 
-        if args.tracemalloc:
+        if args.tracemalloc or args.track_allocations == 'tracemalloc':
             try:
                 import tracemalloc   # noqa
             except ImportError as exc:
@@ -289,10 +588,77 @@ class Runner:
                       "(--track-memory): %s" % err_msg)
                 sys.exit(1)
 
+        if args.parallel > 1 and not args.worker:
+            if args.affinity:
+                cpus = parse_cpu_list(args.affinity)
+            else:
+                cpus = get_isolated_cpus()
+            if not cpus:
+                print("ERROR: --parallel requires isolated CPUs "
+                      "or the --affinity option")
+                sys.exit(1)
+            # never run more than one worker per CPU
+            cpus = sorted(set(cpus))
+            args.parallel = min(args.parallel, len(cpus))
+            self._parallel_cpus = cpus
+
+        if args.counters and not args.worker:
+            self._check_counters()
+
+        if args.fork_server:
+            if not hasattr(os, 'fork'):
+                print("ERROR: --fork-server requires os.fork()")
+                sys.exit(1)
+            if args.parallel > 1:
+                print("ERROR: --fork-server option is incompatible "
+                      "with --parallel option")
+                sys.exit(1)
+            if args.worker_timeout:
+                print("ERROR: --fork-server option is incompatible "
+                      "with --worker-timeout option")
+                sys.exit(1)
+            # Forked workers share the hash secret and the address space
+            # layout of the template process: only accept the option if the
+            # user chose a fixed hash seed
+            env = create_environ(args.inherit_environ, args.locale)
+            hash_seed = env.get('PYTHONHASHSEED')
+            if not args.worker and (not hash_seed or hash_seed == 'random'):
+                print("ERROR: --fork-server requires a fixed PYTHONHASHSEED "
+                      "inherited by workers, ex: PYTHONHASHSEED=0 and "
+                      "--inherit-environ=PYTHONHASHSEED")
+                sys.exit(1)
+
         args.python = abs_executable(args.python)
         if args.compare_to:
             args.compare_to = abs_executable(args.compare_to)
 
+        if args.compare_mode != 'sequential':
+            if not args.compare_to:
+                print("ERROR: --compare-mode option requires "
+                      "the --compare-to option")
+                sys.exit(1)
+            if (args.fork_server or args.parallel > 1
+                    or args.target_precision or args.checkpoint):
+                print("ERROR: --compare-mode=%s is incompatible with "
+                      "--fork-server, --parallel, --target-precision and "
+                      "--checkpoint options" % args.compare_mode)
+                sys.exit(1)
+
+        if args.compare_mode == 'concurrent' and not args.worker:
+            if args.affinity:
+                cpus = parse_cpu_list(args.affinity)
+            else:
+                cpus = get_isolated_cpus()
+            cpus = sorted(set(cpus or ()))
+            if len(cpus) < 2:
+                print("ERROR: --compare-mode=concurrent requires at least "
+                      "2 isolated CPUs or 2 CPUs in --affinity")
+                sys.exit(1)
+            # one set of CPUs per Python executable
+            half = len(cpus) // 2
+            self._compare_cpus = (format_cpu_list(cpus[:half]),
+                                  format_cpu_list(cpus[half:]))
+
         if args.compare_to:
             for option in ('output', 'append'):
                 if getattr(args, option):
@@ -356,9 +722,41 @@ class Runner:
                       "isolated CPUs, CPU affinity not available")
                 print("Use Python 3.3 or newer, or install psutil dependency")
 
+    def _check_counters(self):
+        # Only pass available counters to workers
+        from perf._perf_event import Counters, parse_counters
+
+        args = self.args
+        try:
+            parse_counters(args.counters)
+        except ValueError as exc:
+            print("ERROR: %s" % exc)
+            sys.exit(1)
+
+        counters = Counters(args.counters)
+        names = counters.names
+        counters.close()
+        if not args.quiet:
+            for name in args.counters:
+                if name in counters.errors:
+                    print("WARNING: unable to use the %s counter: %s"
+                          % (name, counters.errors[name]))
+        args.counters = names
+
     def _worker(self, task):
         self._cpu_affinity()
-        run = task.create_run()
+        if self.args.pipe is not None:
+            # stream values to the master process
+            wpipe = WritePipe.from_subprocess(self.args.pipe)
+            with wpipe.open_binary() as wfile:
+                task._stream = StreamWriter(wfile)
+                try:
+                    run = task.create_run()
+                    task._stream.write_run(run)
+                finally:
+                    task._stream = None
+        else:
+            run = task.create_run()
         bench = perf.Benchmark((run,))
         self._display_result(bench, checks=False)
         return bench
@@ -383,13 +781,17 @@ class Runner:
 
         args = self.parse_args()
         try:
-            if args.worker:
+            if args.worker and args.fork_server:
+                from perf._fork_server import run_fork_server
+                run_fork_server(self, task)
+                bench = None
+            elif args.worker:
                 bench = self._worker(task)
             elif args.compare_to:
-                self._compare_to()
+                self._compare_to(task.name)
                 bench = None
             else:
-                bench = self._master()
+                bench = self._master(task.name)
         except KeyboardInterrupt:
             what = "Benchmark worker" if args.worker else "Benchmark"
             print("%s interrupted: exit" % what, file=sys.stderr)
@@ -406,11 +808,40 @@ class Runner:
         args = ', '.join(map(repr, sorted(kwargs)))
         raise TypeError('unexpected keyword argument %s' % args)
 
+    @staticmethod
+    def _pop_rate_metadata(kwargs, metadata):
+        # items_per_loop and bytes_per_loop keywords: values are still
+        # measured in seconds, but displayed as a throughput
+        items = kwargs.pop('items_per_loop', None)
+        nbytes = kwargs.pop('bytes_per_loop', None)
+        if items is None and nbytes is None:
+            return metadata
+        if items is not None and nbytes is not None:
+            raise ValueError("items_per_loop and bytes_per_loop "
+                             "are mutually exclusive")
+
+        if nbytes is not None:
+            rate_unit = 'byte/s'
+            items = nbytes
+        else:
+            rate_unit = 'op/s'
+        check_metadata('items_per_loop', items)
+
+        metadata = dict(metadata or {})
+        metadata['rate_unit'] = rate_unit
+        metadata['items_per_loop'] = items
+        return metadata
+
     def bench_time_func(self, name, time_func, *args, **kwargs):
         inner_loops = kwargs.pop('inner_loops', None)
         metadata = kwargs.pop('metadata', None)
+        metadata = self._pop_rate_metadata(kwargs, metadata)
         self._no_keyword_argument(kwargs)
+        return self._bench_time_func(name, time_func, args,
+                                     inner_loops, metadata)
 
+    def _bench_time_func(self, name, time_func, args, inner_loops, metadata,
+                         overhead_func=None):
         if not metadata:
             metadata = {'unit': 'second'}
         elif 'unit' not in metadata:
@@ -424,6 +855,7 @@ class Runner:
 
         task = WorkerProcessTask(self, name, task_func, metadata)
         task.inner_loops = inner_loops
+        task.overhead_func = overhead_func
         return self._main(task)
 
     def bench_func(self, name, func, *args, **kwargs):
@@ -431,6 +863,7 @@ class Runner:
 
         inner_loops = kwargs.pop('inner_loops', None)
         metadata = kwargs.pop('metadata', None)
+        metadata = self._pop_rate_metadata(kwargs, metadata)
         self._no_keyword_argument(kwargs)
 
         if not self._check_worker_task():
@@ -438,29 +871,47 @@ class Runner:
 
         if args:
             func = functools.partial(func, *args)
+            noop_func = functools.partial(_make_noop(len(args)), *args)
+        else:
+            noop_func = _noop
 
         def task_func(task, loops):
-            # use fast local variables
-            local_timer = perf.perf_counter
-            local_func = func
-            if loops != 1:
-                range_it = range(loops)
-
-                t0 = local_timer()
-                for _ in range_it:
-                    local_func()
-                dt = local_timer() - t0
-            else:
-                t0 = local_timer()
-                local_func()
-                dt = local_timer() - t0
+            return _time_func_loops(func, loops)
 
-            return dt
+        def overhead_func(task, loops):
+            loop_overhead = _time_empty_loops(loops)
+            call_overhead = _time_func_loops(noop_func, loops) - loop_overhead
+            return {'loop_overhead': loop_overhead,
+                    'call_overhead': call_overhead}
 
         task = WorkerProcessTask(self, name, task_func, metadata)
         task.inner_loops = inner_loops
+        task.overhead_func = overhead_func
         return self._main(task)
 
+    def bench_async_func(self, name, coro_func, *args, **kwargs):
+        """Benchmark await coro_func(*args)."""
+
+        inner_loops = kwargs.pop('inner_loops', None)
+        metadata = kwargs.pop('metadata', None)
+        metadata = self._pop_rate_metadata(kwargs, metadata)
+        self._no_keyword_argument(kwargs)
+
+        if not self._check_worker_task():
+            return None
+
+        from perf._async import AsyncBench
+        policy = self.parse_args().loop_policy
+        bench = AsyncBench(coro_func, args, policy)
+
+        task = WorkerProcessTask(self, name, bench.task_func, metadata)
+        task.inner_loops = inner_loops
+        task.overhead_func = bench.overhead_func
+        try:
+            return self._main(task)
+        finally:
+            bench.close()
+
     def timeit(self, name, stmt, setup="pass", inner_loops=None,
                duplicate=None, metadata=None, globals=None):
 
@@ -475,8 +926,13 @@ class Runner:
                             func_metadata=metadata,
                             globals=globals)
 
-    def _worker_cmd(self, python, calibrate, wpipe):
+    def _worker_cmd(self, python, calibrate, wpipe, affinity=None,
+                    loops=None, fork_server=False):
         args = self.args
+        if affinity is None:
+            affinity = args.affinity
+        if loops is None:
+            loops = args.loops
 
         cmd = [python]
         cmd.extend(self._program_args)
@@ -484,27 +940,83 @@ class Runner:
                     '--worker-task=%s' % self._worker_task,
                     '--values', str(args.values),
                     '--warmups', str(args.warmups),
-                    '--loops', str(args.loops),
+                    '--loops', str(loops),
                     '--min-time', str(args.min_time)))
         if calibrate:
             cmd.append('--calibrate')
         if args.verbose:
             cmd.append('-' + 'v' * args.verbose)
-        if args.affinity:
-            cmd.append('--affinity=%s' % args.affinity)
+        if affinity:
+            cmd.append('--affinity=%s' % affinity)
+        if args.subtract_overhead:
+            cmd.append('--subtract-overhead')
+        if args.counters:
+            cmd.append('--counters=%s' % ','.join(args.counters))
+        if args.warmups == 'auto':
+            cmd.append('--max-warmups=%s' % args.max_warmups)
+        if args.cpu_time:
+            cmd.append('--cpu-time')
+        if args.gc:
+            cmd.append('--gc=%s' % args.gc)
+        if args.loop_policy != 'asyncio':
+            cmd.append('--loop-policy=%s' % args.loop_policy)
         if args.tracemalloc:
             cmd.append('--tracemalloc')
         if args.track_memory:
             cmd.append('--track-memory')
+        if args.track_allocations:
+            cmd.append('--track-allocations=%s' % args.track_allocations)
+        if fork_server:
+            cmd.append('--fork-server')
 
+        # must be the last arguments: perf command uses them as the
+        # program arguments
         if self._add_cmdline_args:
             self._add_cmdline_args(cmd, self.args)
 
         return cmd
 
-    def _spawn_worker(self, python=None, calibrate=False):
+    @staticmethod
+    def _add_spawn_overhead(suite, start_time):
+        # Time spent by the worker outside the benchmark: process creation,
+        # imports, metadata collection and serialization of the result
+        elapsed = monotonic_clock() - start_time
+        for bench in suite:
+            runs = []
+            for run in bench.get_runs():
+                duration = run._metadata.get('duration')
+                if duration is not None:
+                    overhead = max(elapsed - duration, 0.0)
+                    run = run._update_metadata({'spawn_overhead': overhead})
+                runs.append(run)
+            bench._replace_runs(runs)
+
+    def _spawn_worker(self, python=None, calibrate=False, affinity=None,
+                      loops=None):
         if not python:
             python = self.args.python
+        return self._retry_worker(self._spawn_worker_process, python,
+                                  calibrate, affinity, loops)
+
+    def _retry_worker(self, func, *args):
+        # Call func(*args) to run a worker; replace a failed worker with a
+        # new worker while the --max-failures budget is not exhausted
+        while True:
+            try:
+                return func(*args)
+            except WorkerError as exc:
+                with self._failures_lock:
+                    self._worker_failures.append(exc)
+                    nfailure = len(self._worker_failures)
+                if nfailure > self.args.max_failures:
+                    raise
+                if not self.args.quiet:
+                    print("WARNING: %s: spawn a new worker (failure %s/%s)"
+                          % (exc, nfailure, self.args.max_failures),
+                          file=sys.stderr)
+
+    def _spawn_worker_process(self, python, calibrate, affinity, loops):
+        start_time = monotonic_clock()
 
         env = create_environ(self.args.inherit_environ,
                              self.args.locale)
@@ -513,7 +1025,8 @@ class Runner:
         with rpipe:
             with wpipe:
                 warg = wpipe.to_subprocess()
-                cmd = self._worker_cmd(python, calibrate, warg)
+                cmd = self._worker_cmd(python, calibrate, warg, affinity,
+                                       loops)
 
                 kw = {}
                 if MS_WINDOWS:
@@ -526,17 +1039,66 @@ class Runner:
 
                 proc = subprocess.Popen(cmd, env=env, **kw)
 
-            with popen_killer(proc):
-                with rpipe.open_text() as rfile:
-                    bench_json = rfile.read()
-
-                exitcode = proc.wait()
+            watchdog = None
+            if self.args.worker_timeout:
+                watchdog = _Watchdog(proc, self.args.worker_timeout)
+                watchdog.reset()
+                # only a warmup or a value proves that the benchmark
+                # makes progress, not metadata
+                reader = StreamReader(
+                    on_warmup=lambda loops, value: watchdog.reset(),
+                    on_value=lambda value: watchdog.reset())
+            else:
+                reader = StreamReader()
+            try:
+                with popen_killer(proc):
+                    with rpipe.open_binary() as rfile:
+                        reader.read(rfile)
+
+                    exitcode = proc.wait()
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+
+        timeout = (watchdog is not None and watchdog.expired)
+        if exitcode or timeout:
+            if timeout:
+                what = ("killed after %s without value"
+                        % format_timedelta(self.args.worker_timeout))
+            else:
+                what = "failed with %s" % _format_exitcode(exitcode)
+            raise WorkerError("%s worker %s (after %s and %s)"
+                              % (cmd[0], what,
+                                 format_number(len(reader.warmups),
+                                               'warmup'),
+                                 format_number(len(reader.values), 'value')),
+                              python, exitcode, timeout)
+
+        suite = reader.get_suite()
+        if suite is not None:
+            self._add_spawn_overhead(suite, start_time)
+        return suite
+
+    def _fork_worker(self, fork_server, calibrate=False):
+        start_time = monotonic_clock()
+        suite = self._retry_worker(fork_server.spawn_worker, calibrate)
+        if suite is not None:
+            self._add_spawn_overhead(suite, start_time)
+        return suite
+
+    def _iter_forked_suites(self, python, nprocess, calibrate):
+        from perf._fork_server import ForkServer
 
-        if exitcode:
-            raise RuntimeError("%s failed with exit code %s"
-                               % (cmd[0], exitcode))
+        if not python:
+            python = self.args.python
 
-        return _load_suite_from_pipe(bench_json)
+        fork_server = ForkServer(self, python)
+        try:
+            for process in range(nprocess):
+                yield self._fork_worker(fork_server, calibrate)
+                calibrate = False
+        finally:
+            fork_server.close()
 
     def _display_result(self, bench, checks=True):
         args = self.args
@@ -545,17 +1107,8 @@ class Runner:
         if self.args.quiet:
             checks = False
 
-        if args.pipe is not None:
-            wpipe = WritePipe.from_subprocess(args.pipe)
-
-            with wpipe.open_text() as wfile:
-                try:
-                    bench.dump(wfile)
-                except IOError as exc:
-                    if exc.errno != errno.EPIPE:
-                        raise
-                    # ignore broken pipe error
-        else:
+        if args.pipe is None:
+            # worker values were already written into the pipe
             lines = format_benchmark(bench,
                                      checks=checks,
                                      metadata=args.metadata,
@@ -577,31 +1130,193 @@ class Runner:
             else:
                 bench.dump(args.output)
 
-    def _spawn_workers(self, python=None, newline=True):
+    def _spawn_parallel_workers(self, python, nprocess):
+        # Run up to args.parallel workers at once, each worker pinned to its
+        # own CPU. Suites are yielded in the order in which workers were
+        # spawned, so runs are merged in the same order than sequential
+        # workers.
+        free_cpus = six.moves.queue.Queue()
+        for cpu in self._parallel_cpus[:self.args.parallel]:
+            free_cpus.put(cpu)
+
+        def spawn_worker(cpu):
+            try:
+                return self._spawn_worker(python,
+                                          affinity=format_cpu_list([cpu]))
+            finally:
+                # the CPU can now be used by the next worker
+                free_cpus.put(cpu)
+
+        threads = collections.deque()
+        try:
+            for process in range(nprocess):
+                cpu = free_cpus.get()
+                thread = _WorkerThread(functools.partial(spawn_worker, cpu))
+                thread.start()
+                threads.append(thread)
+
+                while threads and not threads[0].is_alive():
+                    yield threads.popleft().get_suite()
+
+            while threads:
+                yield threads.popleft().get_suite()
+        finally:
+            # the consumer stopped early: wait until running workers complete
+            for thread in threads:
+                thread.join()
+
+    def _iter_worker_suites(self, python, nprocess, calibrate):
+        if not nprocess:
+            return
+
+        if self.args.fork_server:
+            for suite in self._iter_forked_suites(python, nprocess, calibrate):
+                yield suite
+            return
+
+        if calibrate:
+            # Other workers must wait until the calibration worker completes,
+            # since they use the calibrated number of loops
+            yield self._spawn_worker(python, calibrate)
+            nprocess -= 1
+
+        if self.args.parallel > 1:
+            for suite in self._spawn_parallel_workers(python, nprocess):
+                yield suite
+        else:
+            for process in range(nprocess):
+                yield self._spawn_worker(python)
+
+    @staticmethod
+    def _get_worker_bench(suite):
+        if suite is None:
+            raise RuntimeError("perf worker process didn't produce JSON result")
+
+        benchmarks = suite.get_benchmarks()
+        if len(benchmarks) != 1:
+            raise ValueError("worker produced %s benchmarks instead of 1"
+                             % len(benchmarks))
+        return benchmarks[0]
+
+    @staticmethod
+    def _get_precision(bench):
+        # Confidence interval computed on the mean of each process, not on
+        # pooled values: see grouped_mean_precision()
+        return grouped_mean_precision([run._values
+                                       for run in bench.get_runs()
+                                       if not run._is_calibration()])
+
+    def _precision_reached(self, bench):
+        # Adaptive number of processes (--target-precision): check if the
+        # confidence interval of the mean is tight enough
+        nrun = sum(1 for run in bench.get_runs() if not run._is_calibration())
+        # run at least 3 processes to benchmark 3 different (randomized)
+        # hash functions
+        if nrun < 3:
+            return False
+
+        precision = self._get_precision(bench)
+        return (precision is not None
+                and precision <= self.args.target_precision)
+
+    def _get_calibration_cache(self):
+        if self._calibration_cache is None:
+            from perf._calibration_cache import CalibrationCache
+            self._calibration_cache = CalibrationCache(self.args.calibration_cache)
+        return self._calibration_cache
+
+    def _get_cached_loops(self, name, python):
+        # Return (key, entry) of the calibration cache: entry is None
+        # if the number of loops is not cached
+        if not self.args.calibration_cache or not name:
+            return (None, None)
+
+        if not python:
+            python = self.args.python
+        cache = self._get_calibration_cache()
+        key = cache.get_key(name, python, self.args.min_time)
+        return (key, cache.get(key))
+
+    def _cache_calibration(self, key, calibration_run):
+        if key is None:
+            return
+
+        python_version = calibration_run._metadata.get('python_version')
+        self._get_calibration_cache().set(key, calibration_run._get_loops(),
+                                          python_version)
+
+    def _check_cached_loops(self, key, entry, run):
+        from perf._calibration_cache import check_cached_loops
+
+        if check_cached_loops(run, entry, self.args.calibration_margin):
+            return
+
+        # the next run will calibrate the benchmark again
+        self._get_calibration_cache().invalidate(key)
+        if self.args.verbose:
+            print("Calibration cache: %s are no longer valid, "
+                  "invalidate the cache entry"
+                  % format_number(entry['loops'], 'loop'))
+
+    def _get_checkpoint(self):
+        if self._checkpoint is None:
+            from perf._checkpoint import Checkpoint
+            self._checkpoint = Checkpoint(self.args.checkpoint)
+        return self._checkpoint
+
+    def _spawn_workers(self, python=None, newline=True, name=None):
         bench = None
         args = self.args
         verbose = args.verbose
         quiet = args.quiet
-        nprocess = args.processes
+        if args.target_precision:
+            nprocess = args.max_processes
+        else:
+            nprocess = args.processes
         old_loops = self.args.loops
+
+        self._worker_failures = []
+        if verbose and self._worker_task > 0:
+            print()
+
+        checkpoint = None
+        if args.checkpoint and name:
+            checkpoint = self._get_checkpoint()
+            checkpoint_python = python or args.python
+            runs = checkpoint.get_runs(name, checkpoint_python)
+            if runs:
+                # Resume an interrupted session
+                bench = perf.Benchmark(runs)
+                ndone = sum(1 for run in runs if not run._is_calibration())
+                nprocess = max(nprocess - ndone, 0)
+                if args.target_precision and self._precision_reached(bench):
+                    nprocess = 0
+                if not args.loops:
+                    args.loops = runs[-1]._get_loops()
+                if verbose:
+                    print("Checkpoint: %s already completed, %s to run"
+                          % (format_number(ndone, 'process', 'processes'),
+                             format_number(nprocess, 'process',
+                                           'processes')))
+
+        cache_key = cache_entry = None
+        if not args.loops:
+            cache_key, cache_entry = self._get_cached_loops(name, python)
+            if cache_entry is not None:
+                args.loops = cache_entry['loops']
+
         need_calibration = (not args.loops)
         if need_calibration:
             nprocess += 1
         calibrate = need_calibration
 
-        if verbose and self._worker_task > 0:
-            print()
-
-        for process in range(1, nprocess + 1):
-            suite = self._spawn_worker(python, calibrate)
-            if suite is None:
-                raise RuntimeError("perf worker process didn't produce JSON result")
+        if verbose and cache_entry is not None:
+            print("Calibration: use %s loops (cached)"
+                  % format_number(args.loops))
 
-            benchmarks = suite.get_benchmarks()
-            if len(benchmarks) != 1:
-                raise ValueError("worker produced %s benchmarks instead of 1"
-                                 % len(benchmarks))
-            worker_bench = benchmarks[0]
+        suites = self._iter_worker_suites(python, nprocess, calibrate)
+        for process, suite in enumerate(suites, 1):
+            worker_bench = self._get_worker_bench(suite)
 
             if verbose:
                 run = worker_bench.get_runs()[-1]
@@ -619,15 +1334,31 @@ class Runner:
                 args.loops = first_run._get_loops()
                 if verbose:
                     print("Calibration: use %s loops" % format_number(args.loops))
+                self._cache_calibration(cache_key, first_run)
+            elif cache_entry is not None:
+                # Only check the first worker which used cached loops
+                self._check_cached_loops(cache_key, cache_entry,
+                                         worker_bench.get_runs()[-1])
+                cache_entry = None
             calibrate = False
 
             if bench is not None:
                 bench.add_runs(worker_bench)
             else:
                 bench = worker_bench
+            if checkpoint is not None:
+                checkpoint.add(name, checkpoint_python, worker_bench)
 
             sys.stdout.flush()
 
+            if args.target_precision and self._precision_reached(bench):
+                break
+        suites.close()
+
+        if args.target_precision:
+            self._add_precision_metadata(bench)
+        self._add_failure_metadata(bench)
+
         if not quiet and newline:
             print()
 
@@ -637,12 +1368,166 @@ class Runner:
 
         return bench
 
-    def _master(self):
-        bench = self._spawn_workers()
+    def _add_precision_metadata(self, bench):
+        nprocess = sum(1 for run in bench.get_runs()
+                       if not run._is_calibration())
+        metadata = {'processes': nprocess}
+        precision = self._get_precision(bench)
+        if precision is not None:
+            metadata['precision'] = precision
+
+        if self.args.verbose:
+            if precision is not None:
+                print("Precision: %.1f%% of the mean after %s"
+                      % (precision * 100, format_number(nprocess, 'process',
+                                                        'processes')))
+            else:
+                print("Precision: unknown after %s"
+                      % format_number(nprocess, 'process', 'processes'))
+
+        runs = [run._update_metadata(metadata) for run in bench.get_runs()]
+        bench._replace_runs(runs)
+
+    def _add_failure_metadata(self, bench, python=None):
+        failures = self._worker_failures
+        if python:
+            failures = [exc for exc in failures if exc.python == python]
+        if not failures:
+            return
+
+        metadata = {'worker_failures': len(failures)}
+        exitcodes = [exc.exitcode for exc in failures if not exc.timeout]
+        if exitcodes:
+            metadata['worker_exitcodes'] = ', '.join(map(str, exitcodes))
+        if not MS_WINDOWS:
+            signals = sorted(set(_signal_name(-exitcode)
+                                 for exitcode in exitcodes if exitcode < 0))
+            if signals:
+                metadata['worker_signals'] = ', '.join(signals)
+        timeouts = sum(1 for exc in failures if exc.timeout)
+        if timeouts:
+            metadata['worker_timeouts'] = timeouts
+
+        runs = [run._update_metadata(metadata) for run in bench.get_runs()]
+        bench._replace_runs(runs)
+
+    def _master(self, name=None):
+        bench = self._spawn_workers(name=name)
         self._display_result(bench)
         return bench
 
-    def _compare_to(self):
+    def _spawn_compare_pair(self, pythons, loops, order):
+        # Spawn a worker per Python executable, return suites ordered
+        # as pythons
+        suites = [None, None]
+        if self._compare_cpus is not None:
+            threads = []
+            for index in order:
+                func = functools.partial(self._spawn_worker, pythons[index],
+                                         affinity=self._compare_cpus[index],
+                                         loops=loops[index])
+                thread = _WorkerThread(func)
+                thread.start()
+                threads.append((index, thread))
+            for index, thread in threads:
+                suites[index] = thread.get_suite()
+        else:
+            for index in order:
+                suites[index] = self._spawn_worker(pythons[index],
+                                                   loops=loops[index])
+        return suites
+
+    def _spawn_compare_workers(self, pythons, names, bench_name=None):
+        # Alternate REF_PYTHON and PYTHON workers (--compare-mode), rather
+        # than running all workers of REF_PYTHON and then all workers of
+        # PYTHON, so that a slow drift of the system performance has the
+        # same impact on both Python executables
+        args = self.args
+        verbose = args.verbose
+        quiet = args.quiet
+        nprocess = args.processes
+        benchs = [None, None]
+        self._worker_failures = []
+
+        def add_worker(index, suite, run_index):
+            worker_bench = self._get_worker_bench(suite)
+            if verbose:
+                run = worker_bench.get_runs()[-1]
+                for line in format_run(worker_bench, run_index, run):
+                    print("%s: %s" % (names[index], line))
+            elif not quiet:
+                print(".", end='')
+            sys.stdout.flush()
+
+            if benchs[index] is not None:
+                benchs[index].add_runs(worker_bench)
+            else:
+                benchs[index] = worker_bench
+            return worker_bench
+
+        loops = [args.loops, args.loops]
+        cached = [None, None]
+        if not args.loops:
+            # Calibrate each Python executable
+            for index, python in enumerate(pythons):
+                cache_key, cache_entry = self._get_cached_loops(bench_name,
+                                                                python)
+                if cache_entry is not None:
+                    loops[index] = cache_entry['loops']
+                    cached[index] = (cache_key, cache_entry)
+                    if verbose:
+                        print("%s: Calibration: use %s loops (cached)"
+                              % (names[index], format_number(loops[index])))
+                    continue
+
+                suite = self._spawn_worker(python, calibrate=True)
+                worker_bench = add_worker(index, suite, 'calibration')
+                first_run = worker_bench.get_runs()[0]
+                loops[index] = first_run._get_loops()
+                if verbose:
+                    print("%s: Calibration: use %s loops"
+                          % (names[index], format_number(loops[index])))
+                self._cache_calibration(cache_key, first_run)
+
+        for process in range(1, nprocess + 1):
+            order = [0, 1]
+            if args.compare_mode == 'random':
+                random.shuffle(order)
+            suites = self._spawn_compare_pair(pythons, loops, order)
+            for index in order:
+                run_index = '%s/%s' % (process, nprocess)
+                worker_bench = add_worker(index, suites[index], run_index)
+                if cached[index] is not None:
+                    cache_key, cache_entry = cached[index]
+                    self._check_cached_loops(cache_key, cache_entry,
+                                             worker_bench.get_runs()[-1])
+                    cached[index] = None
+
+        if not quiet:
+            print()
+        for python, bench in zip(pythons, benchs):
+            self._add_failure_metadata(bench, python)
+        return benchs
+
+    def _display_compare_bench(self, bench, multiline):
+        args = self.args
+
+        if multiline:
+            self._display_result(bench)
+        elif not args.quiet:
+            print(' ' + format_result_value(bench))
+
+        if multiline:
+            print()
+        elif not args.quiet:
+            warnings = format_checks(bench)
+            if warnings:
+                print()
+                for line in warnings:
+                    print(line)
+                print()
+
+    def _compare_to(self, name=None):
         from perf._compare import timeit_compare_benchs
 
         args = self.args
@@ -655,30 +1540,29 @@ class Runner:
         else:
             name_ref, name_changed = get_python_names(python_ref, python_changed)
 
-        benchs = []
-        for python, name in ((python_ref, name_ref), (python_changed, name_changed)):
-            if multiline:
-                display_title('Benchmark %s' % name)
-            elif not args.quiet:
-                print(name, end=': ')
-
-            bench = self._spawn_workers(python=python, newline=False)
-            benchs.append(bench)
-
-            if multiline:
-                self._display_result(bench)
-            elif not args.quiet:
-                print(' ' + format_result_value(bench))
-
-            if multiline:
-                print()
-            elif not args.quiet:
-                warnings = format_checks(bench)
-                if warnings:
-                    print()
-                    for line in warnings:
-                        print(line)
-                    print()
+        if args.compare_mode != 'sequential':
+            benchs = self._spawn_compare_workers((python_ref, python_changed),
+                                                 (name_ref, name_changed),
+                                                 name)
+            for bench, python_name in zip(benchs, (name_ref, name_changed)):
+                if multiline:
+                    display_title('Benchmark %s' % python_name)
+                elif not args.quiet:
+                    print(python_name, end=':')
+                self._display_compare_bench(bench, multiline)
+        else:
+            benchs = []
+            for python, python_name in ((python_ref, name_ref),
+                                        (python_changed, name_changed)):
+                if multiline:
+                    display_title('Benchmark %s' % python_name)
+                elif not args.quiet:
+                    print(python_name, end=': ')
+
+                bench = self._spawn_workers(python=python, newline=False,
+                                            name=name)
+                benchs.append(bench)
+                self._display_compare_bench(bench, multiline)
 
         if multiline:
             display_title('Compare')
@@ -687,41 +1571,33 @@ class Runner:
         timeit_compare_benchs(name_ref, benchs[0], name_changed, benchs[1], args)
 
     def bench_command(self, name, command):
+        return self._bench_command(name, command)
+
+    def _bench_command(self, name, command, python_importtime=False):
         if not self._check_worker_task():
             return None
 
+        if python_importtime:
+            # command[0] is a Python interpreter: write the import time of
+            # each module into stderr, parsed by ImportTimeProbe
+            command = [command[0], '-X', 'importtime'] + list(command[1:])
+
         command_str = ' '.join(map(repr, command))
         metadata = {'command': command_str}
-
-        path = os.path.dirname(__file__)
-        script = os.path.join(path, '_process_time.py')
-        run_script = [sys.executable, script]
+        helper = CommandHelper(command, capture_stderr=python_importtime)
 
         def task_func(task, loops):
-            args = run_script + [str(loops)] + command
-            proc = subprocess.Popen(args,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    universal_newlines=True)
-            output = popen_communicate(proc)[0]
-            if proc.returncode:
-                raise Exception("Command failed with exit code %s"
-                                % proc.returncode)
-
-            rss = None
-            try:
-                lines = output.splitlines()
-                timing = float(lines[0])
-                if len(lines) >= 2:
-                    rss = int(lines[1])
-            except ValueError:
-                raise ValueError("failed to parse script output: %r" % output)
+            result = helper.run(loops)
 
+            rss = result['max_rss']
             if rss:
                 # store the maximum
                 max_rss = task.metadata.get('command_max_rss', 0)
                 task.metadata['command_max_rss'] = max(max_rss, rss)
-            return timing
+            return result['elapsed']
 
-        task = BenchCommandTask(self, name, task_func, metadata)
-        return self._main(task)
+        task = BenchCommandTask(self, name, task_func, metadata, helper)
+        try:
+            return self._main(task)
+        finally:
+            helper.close()
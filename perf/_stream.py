@@ -0,0 +1,262 @@
+"""
+Streaming protocol between a worker process and the master process.
+
+While the benchmark is running, the worker writes binary messages into its
+--pipe. Each message starts with a type byte:
+
+* b'M': metadata of the benchmark, written once before the first value:
+  length (uint32) followed by a JSON object;
+* b'W': a warmup, loops (uint64) and value (double);
+* b'V': a value (double);
+* b'R': end of the run: length (uint32) followed by a JSON object.
+  "metadata" only contains metadata which are new or changed since the b'M'
+  message, "removed" lists removed metadata. "values" and "warmups" are only
+  written if the worker replaced the streamed values (ex: --track-memory).
+  "series" contains the series measured in parallel to values (ex:
+  --counters).
+
+Integers and doubles use the native byte order: the worker and the master
+run on the same machine.
+
+The master builds the Run incrementally. Values, warmups and metadata were
+already validated by the worker, so the master creates the Run without
+validating them again. The on_warmup and on_value callbacks of StreamReader
+are called with each warmup and value as soon as they are decoded: the
+Runner uses them to reset the --worker-timeout watchdog.
+
+Output starting with "{" is parsed as BenchmarkSuite JSON documents, one per
+line: format written by workers of perf 1.1 and older.
+"""
+from __future__ import division, print_function, absolute_import
+
+import errno
+import io
+import json
+import os
+import re
+import struct
+
+import perf
+from perf._bench import BenchmarkSuite
+
+
+_METADATA = b'M'
+_WARMUP = b'W'
+_VALUE = b'V'
+_RUN = b'R'
+_LEGACY_JSON = b'{'
+
+_LENGTH = struct.Struct('=I')
+_WARMUP_DATA = struct.Struct('=Qd')
+_VALUE_DATA = struct.Struct('=d')
+_VALUE_SIZE = 1 + _VALUE_DATA.size
+_VALUES_REGEX = re.compile(('(?:V.{%s})+' % _VALUE_DATA.size).encode('ascii'),
+                           re.DOTALL)
+
+
+class StreamWriter(object):
+    # Worker side of the protocol
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._metadata = None
+        self._warmups = []
+        self._values = []
+        self._broken = False
+
+    def _write(self, data):
+        if self._broken:
+            return
+
+        try:
+            self._wfile.write(data)
+            self._wfile.flush()
+        except IOError as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+            # ignore broken pipe error
+            self._broken = True
+
+    def _write_json(self, msg_type, obj):
+        data = json.dumps(obj, sort_keys=True).encode('utf8')
+        self._write(msg_type + _LENGTH.pack(len(data)) + data)
+
+    def write_metadata(self, metadata):
+        self._metadata = dict(metadata)
+        self._warmups = []
+        self._values = []
+        self._write_json(_METADATA, self._metadata)
+
+    def write_warmup(self, loops, value):
+        self._warmups.append((loops, value))
+        self._write(_WARMUP + _WARMUP_DATA.pack(loops, value))
+
+    def write_value(self, value):
+        self._values.append(value)
+        self._write(_VALUE + _VALUE_DATA.pack(value))
+
+    def write_run(self, run):
+        if self._metadata is None:
+            self.write_metadata({})
+
+        metadata = {}
+        for name, value in run._metadata.items():
+            if self._metadata.get(name) != value:
+                metadata[name] = value
+        removed = sorted(set(self._metadata) - set(run._metadata))
+
+        end = {'metadata': metadata}
+        if removed:
+            end['removed'] = removed
+        if (run.values != tuple(self._values)
+                or run.warmups != tuple(self._warmups)):
+            end['values'] = run.values
+            end['warmups'] = run.warmups
+        if run._series:
+            end['series'] = run._series
+        self._write_json(_RUN, end)
+        self._metadata = None
+
+
+class StreamReader(object):
+    # Master side of the protocol
+
+    def __init__(self, on_warmup=None, on_value=None):
+        # on_warmup(loops, value) and on_value(value) callbacks
+        self._on_warmup = on_warmup
+        self._on_value = on_value
+        self._suite = None
+        self._metadata = None
+        # warmups and values received for the current run
+        self.warmups = []
+        self.values = []
+        # set to True if the output ends with an incomplete message
+        self.truncated = False
+        self._buffer = b''
+        self._legacy = False
+
+    def _add_suite(self, suite):
+        if self._suite is not None:
+            for bench in suite:
+                self._suite.add_benchmark(bench)
+        else:
+            self._suite = suite
+
+    def _add_run(self, end):
+        metadata = dict(self._metadata or {})
+        for name in end.get('removed', ()):
+            metadata.pop(name, None)
+        metadata.update(end['metadata'])
+
+        if 'values' in end:
+            values = end['values']
+            warmups = [tuple(item) for item in end['warmups']]
+        else:
+            values = self.values
+            warmups = self.warmups
+        run = perf.Run._from_worker(values, warmups, metadata,
+                                    end.get('series'))
+        bench = perf.Benchmark((run,))
+        self._add_suite(BenchmarkSuite([bench]))
+
+        self._metadata = None
+        self.warmups = []
+        self.values = []
+
+    def _parse(self):
+        data = self._buffer
+        size = len(data)
+        pos = 0
+        while pos < size:
+            msg_type = data[pos:pos + 1]
+            if msg_type == _VALUE:
+                # fast path: decode consecutive values at once
+                match = _VALUES_REGEX.match(data, pos)
+                if match is None:
+                    break
+                nvalue = (match.end() - pos) // _VALUE_SIZE
+                values = struct.unpack_from('=' + 'xd' * nvalue, data, pos)
+                self.values.extend(values)
+                pos = match.end()
+                if self._on_value is not None:
+                    for value in values:
+                        self._on_value(value)
+            elif msg_type == _WARMUP:
+                end = pos + 1 + _WARMUP_DATA.size
+                if end > size:
+                    break
+                loops, value = _WARMUP_DATA.unpack_from(data, pos + 1)
+                loops = int(loops)
+                self.warmups.append((loops, value))
+                pos = end
+                if self._on_warmup is not None:
+                    self._on_warmup(loops, value)
+            elif msg_type in (_METADATA, _RUN):
+                end = pos + 1 + _LENGTH.size
+                if end > size:
+                    break
+                length = _LENGTH.unpack_from(data, pos + 1)[0]
+                if end + length > size:
+                    break
+                obj = json.loads(data[end:end + length].decode('utf8'))
+                pos = end + length
+
+                if msg_type == _METADATA:
+                    self._metadata = obj
+                    self.warmups = []
+                    self.values = []
+                else:
+                    self._add_run(obj)
+            elif msg_type == _LEGACY_JSON:
+                # parsed at the end of file
+                self._legacy = True
+                return
+            else:
+                raise ValueError("invalid worker message type: %r"
+                                 % msg_type)
+        self._buffer = data[pos:]
+
+    def feed(self, data):
+        self._buffer += data
+        if not self._legacy:
+            self._parse()
+
+    def close(self):
+        if self._legacy:
+            for line in self._buffer.decode('utf8').split("\n"):
+                if not line:
+                    continue
+                self._add_suite(BenchmarkSuite.loads(line))
+        elif self._buffer:
+            # the worker died while writing a message
+            self.truncated = True
+        self._buffer = b''
+
+    def read(self, rfile):
+        # Read messages until the end of file
+        try:
+            fd = rfile.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            fd = None
+
+        while True:
+            if fd is not None:
+                # get data as soon as it's available
+                data = os.read(fd, 64 * 1024)
+            else:
+                data = rfile.read()
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+    def get_suite(self):
+        return self._suite
+
+
+def load_worker_result(data):
+    # Parse the whole output of a worker
+    reader = StreamReader()
+    reader.feed(data)
+    reader.close()
+    return reader.get_suite()
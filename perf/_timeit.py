@@ -193,14 +193,17 @@ def bench_timeit(runner, name, stmt, setup,
             inner_loops = duplicate
         metadata['timeit_duplicate'] = duplicate
 
-    kwargs = {'metadata': metadata}
-    if inner_loops:
-        kwargs['inner_loops'] = inner_loops
-
     timer = None
     try:
         timer = create_timer(stmt, setup, globals)
-        runner.bench_time_func(name, timer.time_func, **kwargs)
+        # the same loop with an empty statement
+        empty_timer = Timer()
+
+        def overhead_func(task, loops):
+            return {'loop_overhead': empty_timer.time_func(loops)}
+
+        runner._bench_time_func(name, timer.time_func, (), inner_loops,
+                                metadata, overhead_func)
     except SystemExit:
         raise
     except:
@@ -138,6 +138,75 @@ def is_significant(sample1, sample2):
     return (abs(t_score) >= critical_value, t_score)
 
 
+def mean_precision(values):
+    """Relative half-width of the 95% confidence interval of the mean.
+
+    Args:
+        values: sample of values, all values must be greater than zero.
+
+    Returns:
+        The half-width of the confidence interval divided by the mean, as a
+        float, or None if the sample has less than 2 values.
+    """
+    if len(values) < 2:
+        return None
+    mean = statistics.mean(values)
+    stdev = statistics.stdev(values)
+    error = tdist95conf_level(len(values) - 1) * stdev / math.sqrt(len(values))
+    return error / mean
+
+
+def grouped_mean_precision(groups):
+    """Precision of the mean of values grouped by worker process.
+
+    Values of the same process are not independent: they share the same
+    hash function, memory layout, etc. The confidence interval is computed
+    on the mean of each process, to take the variance between processes into
+    account. The precision of pooled values is used as a lower bound.
+
+    Args:
+        groups: list of samples, one sample per process.
+
+    Returns:
+        The precision as computed by mean_precision(), or None if there are
+        less than 2 non-empty groups.
+    """
+    groups = [group for group in groups if len(group)]
+    means = [statistics.mean(group) for group in groups]
+    precision = mean_precision(means)
+    if precision is None:
+        return None
+    pooled = mean_precision([value for group in groups for value in group])
+    return max(precision, pooled)
+
+
+def is_steady_state(values, window, max_cv, max_drift):
+    """Check if the last values of a series reached a steady state.
+
+    Args:
+        values: series of values, all values must be greater than zero.
+        window: number of last values which are checked.
+        max_cv: maximum coefficient of variation (standard deviation divided
+            by the mean) of the last values.
+        max_drift: maximum relative difference between the mean of the first
+            half and the mean of the second half of the last values, to
+            detect values which are still decreasing (or increasing) slowly.
+
+    Returns:
+        True if the last values are stable, False otherwise or if there are
+        less than window values.
+    """
+    if len(values) < window:
+        return False
+    values = values[-window:]
+    mean = statistics.mean(values)
+    if statistics.stdev(values) > max_cv * mean:
+        return False
+    half = window // 2
+    drift = statistics.mean(values[-half:]) - statistics.mean(values[:half])
+    return (abs(drift) <= max_drift * mean)
+
+
 def parse_run_list(run_list):
     run_list = run_list.strip()
 
@@ -434,6 +503,11 @@ class ReadPipe(_Pipe):
         self._file = file
         return file
 
+    def open_binary(self):
+        file = os.fdopen(self._fd, "rb")
+        self._file = file
+        return file
+
 
 class WritePipe(_Pipe):
     def to_subprocess(self):
@@ -462,6 +536,11 @@ class WritePipe(_Pipe):
         self._file = file
         return file
 
+    def open_binary(self):
+        file = os.fdopen(self._fd, "wb")
+        self._file = file
+        return file
+
 
 def create_pipe():
     rfd, wfd = os.pipe()
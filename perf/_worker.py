@@ -1,8 +1,13 @@
 from __future__ import division, print_function, absolute_import
 
+import gc
+import os
+import sys
+import time
+
 import perf
 from perf._formatter import format_number, format_value
-from perf._utils import MS_WINDOWS
+from perf._utils import MS_WINDOWS, is_steady_state
 
 try:
     # Python 3.3 provides a real monotonic clock (PEP 418)
@@ -13,6 +18,144 @@ except ImportError:
 
 
 MAX_LOOPS = 2 ** 32
+# Steady state detector of --warmups=auto: the last values must have a
+# coefficient of variation smaller than 5%, and the mean of the two halves
+# must differ by less than 2%
+AUTO_WARMUPS_WINDOW = 4
+AUTO_WARMUPS_MAX_CV = 0.05
+AUTO_WARMUPS_MAX_DRIFT = 0.02
+# Number of measures of the overhead, the minimum is used
+OVERHEAD_NVALUE = 3
+
+
+def _get_cpu_clocks():
+    # Return a list of (series name, clock function, resolution in seconds)
+    # of available CPU time clocks. Use the nanosecond variants when
+    # available (Python 3.7) to not lose precision in deltas.
+    clocks = []
+    for name in ('process_time', 'thread_time'):
+        func = getattr(time, name + '_ns', None)
+        if func is not None:
+            resolution = 1e-9
+        else:
+            func = getattr(time, name, None)
+            if func is None:
+                # process_time() requires Python 3.3,
+                # thread_time() requires Python 3.7
+                continue
+            resolution = 1.0
+        clocks.append((name, func, resolution))
+    return clocks
+
+
+class CPUTimeProbe(object):
+    # Measure the process and thread CPU time of each value (--cpu-time),
+    # in seconds
+    def __init__(self):
+        self._clocks = _get_cpu_clocks()
+        self._start = None
+
+    @property
+    def names(self):
+        return [name for name, func, resolution in self._clocks]
+
+    def start(self):
+        self._start = [func() for name, func, resolution in self._clocks]
+
+    def stop(self):
+        end = [func() for name, func, resolution in self._clocks]
+        return dict((name, (end_time - start_time) * resolution)
+                    for (name, func, resolution), start_time, end_time
+                    in zip(self._clocks, self._start, end))
+
+    def close(self):
+        pass
+
+
+class GCProbe(object):
+    # Measure the activity of the garbage collector during each value
+    # (--gc option) using gc.callbacks: number of collections per
+    # generation, number of collected objects and time spent in the GC
+    NAMES = ('gc_gen0', 'gc_gen1', 'gc_gen2', 'gc_collected', 'gc_time')
+
+    def __init__(self):
+        self._counts = None
+        self._collect_start = None
+        gc.callbacks.append(self._callback)
+
+    @staticmethod
+    def is_available():
+        # gc.callbacks requires Python 3.3
+        return hasattr(gc, 'callbacks')
+
+    def _callback(self, phase, info):
+        if self._counts is None:
+            return
+
+        if phase == 'start':
+            self._collect_start = perf.perf_counter()
+        elif self._collect_start is not None:
+            counts = self._counts
+            counts['gc_time'] += perf.perf_counter() - self._collect_start
+            counts['gc_gen%s' % info['generation']] += 1
+            counts['gc_collected'] += info['collected']
+            self._collect_start = None
+
+    def start(self):
+        self._collect_start = None
+        self._counts = dict.fromkeys(self.NAMES, 0)
+
+    def stop(self):
+        counts = self._counts
+        self._counts = None
+        return counts
+
+    def close(self):
+        gc.callbacks.remove(self._callback)
+
+
+class AllocationProbe(object):
+    # Count memory allocations of each value (--track-allocations): net
+    # number of allocated memory blocks using sys.getallocatedblocks(), and
+    # optionally the net size of memory traced by tracemalloc. Counters are
+    # only read before and after each value, so the overhead on timings is
+    # negligible (except of tracemalloc).
+
+    def __init__(self, use_tracemalloc=False):
+        self._tracemalloc = None
+        if use_tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+            self._tracemalloc = tracemalloc
+        self._start = None
+
+    @staticmethod
+    def is_available():
+        # sys.getallocatedblocks() requires CPython 3.4
+        return hasattr(sys, 'getallocatedblocks')
+
+    def _read(self):
+        blocks = sys.getallocatedblocks()
+        if self._tracemalloc is not None:
+            return (blocks, self._tracemalloc.get_traced_memory()[0])
+        return (blocks, None)
+
+    def start(self):
+        self._start = self._read()
+
+    def stop(self):
+        blocks, traced = self._read()
+        start_blocks, start_traced = self._start
+        # Series must be positive: memory freed by the value counts as zero
+        result = {'allocated_blocks': max(blocks - start_blocks, 0)}
+        if traced is not None:
+            result['traced_bytes'] = max(traced - start_traced, 0)
+        return result
+
+    def close(self):
+        if self._tracemalloc is not None:
+            self._tracemalloc.stop()
+            self._tracemalloc = None
 
 
 class WorkerTask:
@@ -34,9 +177,33 @@ class WorkerTask:
         self.inner_loops = None
         self.warmups = None
         self.values = None
+        # Optional function measuring the loop and call overhead of
+        # task_func: overhead_func(task, loops) returns a dict
+        # {metadata name: raw value}
+        self.overhead_func = None
+        # Objects measuring each value: probe.start() is called before
+        # task_func() and probe.stop() after, stop() returns a dict
+        # {series name: raw number}
+        self.probes = []
+        # Series of numbers per loop measured by probes:
+        # dict {name: list of numbers}, one number per value
+        self.series = None
+        # StreamWriter used to send values to the master process as soon
+        # as they are produced
+        self._stream = None
+
+    def _set_args(self, args):
+        # Used by the fork server: the task is created by the template
+        # process, worker arguments are only known in the forked child
+        self.args = args
+        self.loops = args.loops
 
     def run_bench(self, nvalue,
-                  is_warmup=False, is_calibrate=False, calibrate=False):
+                  is_warmup=False, is_calibrate=False, calibrate=False,
+                  until_steady=False):
+        # If until_steady is true, nvalue is the maximum number of values:
+        # stop as soon as values computed with the current number of loops
+        # reached a steady state
         unit = self.metadata.get('unit')
         args = self.args
         if self.loops <= 0:
@@ -54,11 +221,25 @@ class WorkerTask:
         inner_loops = self.inner_loops
         if not inner_loops:
             inner_loops = 1
+        probes = self.probes if not is_warmup else None
+        gc_mode = args.gc
         while True:
             if index > nvalue:
                 break
 
-            raw_value = self.task_func(self, self.loops)
+            if gc_mode == 'collect-between':
+                gc.collect()
+            if gc_mode == 'disable':
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    raw_value = self._run_task(probes)
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+            else:
+                raw_value = self._run_task(probes)
+
             raw_value = float(raw_value)
             value = raw_value / (self.loops * inner_loops)
 
@@ -69,6 +250,11 @@ class WorkerTask:
                 values.append((self.loops, value))
             else:
                 values.append(value)
+            if self._stream is not None:
+                if is_warmup:
+                    self._stream.write_warmup(self.loops, value)
+                else:
+                    self._stream.write_value(value)
 
             if args.verbose:
                 text = format_value(unit, value)
@@ -80,12 +266,17 @@ class WorkerTask:
                 print("%s %s: %s" % (value_name, index, text))
 
             if calibrate and raw_value < args.min_time:
-                self.loops *= 2
+                self.loops = self.predict_loops(raw_value)
                 if self.loops > MAX_LOOPS:
                     raise ValueError("error in calibration, loops is "
                                      "too big: %s" % self.loops)
                 # need more values for the calibration
                 nvalue += 1
+            elif until_steady and self._is_steady(values, is_warmup):
+                if args.verbose:
+                    print("Steady state reached after %s"
+                          % format_number(index, value_name.lower()))
+                break
 
             index += 1
 
@@ -96,6 +287,54 @@ class WorkerTask:
 
         return values
 
+    def _run_task(self, probes):
+        if not probes:
+            return self.task_func(self, self.loops)
+
+        for probe in probes:
+            probe.start()
+        raw_value = self.task_func(self, self.loops)
+        measures = {}
+        for probe in reversed(probes):
+            measures.update(probe.stop())
+
+        inner_loops = self.inner_loops
+        if not inner_loops:
+            inner_loops = 1
+        total_loops = self.loops * inner_loops
+        # A probe can return a new series after the first value (ex: a module
+        # only imported by the command at the second value): the series is
+        # zero for previous values
+        nvalue = max([len(numbers) for numbers in self.series.values()] or [0])
+        for name, number in measures.items():
+            numbers = self.series.setdefault(name, [0.0] * nvalue)
+            numbers.append(number / total_loops)
+        return raw_value
+
+    def _is_steady(self, values, is_warmup):
+        if is_warmup:
+            values = [value for loops, value in values if loops == self.loops]
+        return is_steady_state(values, AUTO_WARMUPS_WINDOW,
+                               AUTO_WARMUPS_MAX_CV, AUTO_WARMUPS_MAX_DRIFT)
+
+    def predict_loops(self, raw_value):
+        # Compute the number of loops of the next calibration value, when
+        # raw_value is shorter than min_time. Estimate the cost of one loop
+        # iteration from raw_value to jump directly to the power of 2 number
+        # of loops taking at least min_time, rather than doubling loops for
+        # each value. The estimate is an upper bound of the cost (timer and
+        # loop setup overhead), so the next value is only too short if the
+        # estimate was too pessimistic.
+        loops = self.loops * 2
+        if raw_value <= 0:
+            # the timer is too coarse to measure a single value: double loops
+            return loops
+
+        estimate = self.loops * self.args.min_time / raw_value
+        while loops < estimate and loops <= MAX_LOOPS:
+            loops *= 2
+        return loops
+
     def calibrate_loops(self):
         return self.run_bench(nvalue=1,
                               calibrate=True,
@@ -105,12 +344,83 @@ class WorkerTask:
         from perf._collect_metadata import collect_metadata
         return collect_metadata(process=False)
 
+    def open_counters(self):
+        if not self.args.counters:
+            return None
+
+        from perf._perf_event import Counters
+        # the master process already checked that counters are available
+        counters = Counters(self.args.counters)
+        if not counters.names:
+            return None
+        return counters
+
+    def open_cpu_time(self):
+        if not self.args.cpu_time:
+            return None
+
+        probe = CPUTimeProbe()
+        if not probe.names:
+            # Python 2 has no CPU time clock
+            return None
+        return probe
+
+    def open_gc_probe(self):
+        if not self.args.gc or not GCProbe.is_available():
+            return None
+        return GCProbe()
+
+    def open_allocation_probe(self):
+        mode = self.args.track_allocations
+        if not mode or not AllocationProbe.is_available():
+            return None
+        return AllocationProbe(use_tracemalloc=(mode == 'tracemalloc'))
+
+    def open_probes(self):
+        # The last probe is the closest to the benchmark function
+        probes = []
+        for probe in (self.open_counters(), self.open_cpu_time(),
+                      self.open_gc_probe(), self.open_allocation_probe()):
+            if probe is not None:
+                probes.append(probe)
+        return probes
+
+    def measure_overhead(self):
+        args = self.args
+        inner_loops = self.inner_loops
+        if not inner_loops:
+            inner_loops = 1
+
+        # Run the benchmark loop with the same number of loops, but with an
+        # empty statement or a no-op function
+        overhead = {}
+        for index in range(OVERHEAD_NVALUE):
+            for name, raw_value in self.overhead_func(self, self.loops).items():
+                value = max(raw_value, 0.0) / (self.loops * inner_loops)
+                overhead[name] = min(overhead.get(name, value), value)
+        self.metadata.update(overhead)
+
+        if args.subtract_overhead:
+            total = sum(overhead.values())
+            values = [value - total for value in self.values]
+            if min(values) <= 0:
+                raise ValueError("benchmark value (%s) is smaller than "
+                                 "the overhead (%s): don't use "
+                                 "--subtract-overhead"
+                                 % (format_value('second', min(self.values)),
+                                    format_value('second', total)))
+            self.values = values
+
     def compute_values(self):
         args = self.args
 
         self.metadata['name'] = self.name
         if self.inner_loops is not None:
             self.metadata['inner_loops'] = self.inner_loops
+        if args.gc:
+            self.metadata['gc_mode'] = args.gc
+        if self._stream is not None:
+            self._stream.write_metadata(self.metadata)
 
         calibrate = (not self.loops)
         if calibrate:
@@ -122,7 +432,12 @@ class WorkerTask:
                 calibrate = True
             calibrate_warmups = None
 
-        if args.warmups:
+        if args.warmups == 'auto':
+            warmups = self.run_bench(nvalue=args.max_warmups,
+                                     is_warmup=True, calibrate=calibrate,
+                                     until_steady=True)
+            self.metadata['warmups'] = len(warmups)
+        elif args.warmups:
             warmups = self.run_bench(nvalue=args.warmups,
                                      is_warmup=True, calibrate=calibrate)
         else:
@@ -130,7 +445,19 @@ class WorkerTask:
         if calibrate_warmups:
             warmups = calibrate_warmups + warmups
         self.warmups = warmups
-        self.values = self.run_bench(nvalue=args.values)
+
+        self.series = {}
+        probes = self.open_probes()
+        self.probes.extend(probes)
+        try:
+            self.values = self.run_bench(nvalue=args.values)
+        finally:
+            for probe in probes:
+                self.probes.remove(probe)
+                probe.close()
+        if (self.overhead_func is not None and self.values
+                and not (args.track_memory or args.tracemalloc)):
+            self.measure_overhead()
 
         metadata2 = self.collect_metadata()
         metadata2.update(self.metadata)
@@ -143,10 +470,18 @@ class WorkerTask:
         self.compute_values()
         self.metadata['duration'] = monotonic_clock() - start_time
 
-        return perf.Run(self.values,
-                        warmups=self.warmups,
-                        metadata=self.metadata,
-                        collect_metadata=False)
+        run = perf.Run(self.values,
+                       warmups=self.warmups,
+                       metadata=self.metadata,
+                       collect_metadata=False)
+        if self.series:
+            run._set_series(self.series)
+        return run
+
+    def close(self):
+        # Release resources of the task: called by a child process of the
+        # fork server before it exits
+        pass
 
 
 class WorkerProcessTask(WorkerTask):
@@ -178,6 +513,7 @@ class WorkerProcessTask(WorkerTask):
             # drop timings, replace them with the memory peak
             self.metadata['unit'] = 'byte'
             self.warmups = None
+            self.series = None
             self.values = (traced_peak,)
 
         if args.track_memory:
@@ -186,6 +522,7 @@ class WorkerProcessTask(WorkerTask):
             else:
                 mem_thread.stop()
                 mem_peak = mem_thread.peak_usage
+                self.metadata.update(mem_thread.get_metadata())
 
             if not mem_peak:
                 raise RuntimeError("failed to get the memory peak usage")
@@ -193,6 +530,7 @@ class WorkerProcessTask(WorkerTask):
             # drop timings, replace them with the memory peak
             self.metadata['unit'] = 'byte'
             self.warmups = None
+            self.series = None
             self.values = (mem_peak,)
 
     def collect_metadata(self):
@@ -200,7 +538,144 @@ class WorkerProcessTask(WorkerTask):
         return collect_metadata()
 
 
+class CommandHelper(object):
+    # Long-lived helper process running a command for Runner.bench_command()
+    # (_process_time.py --server): spawned on the first value, so the fork
+    # server doesn't share it between children.
+    #
+    # If capture_stderr is true, the stderr of the command is written into a
+    # temporary file: see read_stderr().
+
+    def __init__(self, command, capture_stderr=False):
+        self.command = command
+        self.capture_stderr = capture_stderr
+        self.stderr_path = None
+        self._proc = None
+        self.usage = None
+
+    def _spawn(self):
+        import subprocess
+
+        script = os.path.join(os.path.dirname(__file__), '_process_time.py')
+        args = [sys.executable, script, '--server']
+        if self.capture_stderr:
+            import tempfile
+
+            fd, self.stderr_path = tempfile.mkstemp(prefix='perf_stderr_')
+            os.close(fd)
+            args.extend(('--stderr', self.stderr_path))
+        args.extend(self.command)
+        self._proc = subprocess.Popen(args,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      universal_newlines=True)
+
+    # Resource usage written by the helper if os.wait4() is available
+    USAGE_FIELDS = ('user_time', 'sys_time', 'minflt', 'majflt',
+                    'nvcsw', 'nivcsw')
+
+    def run(self, loops):
+        # Run the command loops times. Return a dict with the keys elapsed
+        # and max_rss, and the keys of USAGE_FIELDS if the resource usage is
+        # available. The last usage is also stored in the usage attribute.
+        if self._proc is None:
+            self._spawn()
+
+        proc = self._proc
+        proc.stdin.write("%s\n" % loops)
+        proc.stdin.flush()
+        line = proc.stdout.readline()
+        if not line:
+            self.close()
+            raise RuntimeError("command helper process exited unexpectedly")
+
+        parts = line.split()
+        if parts[0] == 'error':
+            raise Exception("Command failed with exit code %s" % parts[1])
+        try:
+            result = {'elapsed': float(parts[0]),
+                      'max_rss': int(parts[1])}
+            if len(parts) > 2:
+                for name, part in zip(self.USAGE_FIELDS, parts[2:]):
+                    result[name] = float(part)
+        except (ValueError, IndexError):
+            raise ValueError("failed to parse command helper output: %r"
+                             % line)
+        self.usage = result
+        return result
+
+    def read_stderr(self):
+        # Return the stderr written by the command since the previous call,
+        # as bytes
+        if self.stderr_path is None:
+            return b''
+        with open(self.stderr_path, 'r+b') as fp:
+            data = fp.read()
+            # the helper opens the file in append mode
+            fp.truncate(0)
+        return data
+
+    def close(self):
+        proc = self._proc
+        if proc is None:
+            return
+        self._proc = None
+
+        # the helper exits at the end of its stdin
+        proc.stdin.close()
+        proc.stdout.close()
+        proc.wait()
+
+        if self.stderr_path is not None:
+            os.unlink(self.stderr_path)
+            self.stderr_path = None
+
+
+class CommandUsageProbe(object):
+    # Resource usage of the command of each value (Runner.bench_command()),
+    # read by the helper process with os.wait4(): series command_user_time,
+    # command_sys_time, command_minflt, command_majflt, command_nvcsw and
+    # command_nivcsw.
+
+    def __init__(self, helper):
+        self._helper = helper
+
+    def start(self):
+        self._helper.usage = None
+
+    def stop(self):
+        usage = self._helper.usage
+        if usage is None:
+            return {}
+        return dict(('command_%s' % name, usage[name])
+                    for name in CommandHelper.USAGE_FIELDS
+                    if name in usage)
+
+    def close(self):
+        pass
+
+
 class BenchCommandTask(WorkerTask):
+    def __init__(self, runner, name, task_func, func_metadata, helper):
+        WorkerTask.__init__(self, runner, name, task_func, func_metadata)
+        self.helper = helper
+
+    def open_cpu_time(self):
+        # The CPU time of the worker process doesn't include the CPU time of
+        # the command: see open_probes()
+        return None
+
+    def open_probes(self):
+        probes = WorkerTask.open_probes(self)
+        probes.append(CommandUsageProbe(self.helper))
+        if self.helper.capture_stderr:
+            from perf._importtime import ImportTimeProbe
+            probes.append(ImportTimeProbe(self.helper))
+        return probes
+
+    def close(self):
+        self.helper.close()
+
     def compute_values(self):
         WorkerTask.compute_values(self)
         if self.args.track_memory:
@@ -210,4 +685,5 @@ class BenchCommandTask(WorkerTask):
 
             self.metadata['unit'] = 'byte'
             self.warmups = None
+            self.series = None
             self.values = (value,)
@@ -87,6 +87,22 @@ class RunTests(unittest.TestCase):
             self.assertEqual(run.warmups, ((4, 3),))
             self.assertIsInstance(run.warmups[0][1], number_type)
 
+    def test_compact_values(self):
+        run = perf.Run([1.0, 2.0], warmups=[(1, 3.0), (2, 4.0)],
+                       collect_metadata=False)
+        self.assertEqual(run._values.typecode, 'd')
+        self.assertEqual(run.values, (1.0, 2.0))
+        self.assertEqual(run.warmups, ((1, 3.0), (2, 4.0)))
+
+        # integers are kept as integers
+        run = perf.Run([1, 2], collect_metadata=False)
+        self.assertEqual(run.values, (1, 2))
+        self.assertIsInstance(run.values[0], int)
+
+        # large integers fall back to a tuple
+        run = perf.Run([2 ** 70], collect_metadata=False)
+        self.assertEqual(run.values, (2 ** 70,))
+
     def test_get_date(self):
         date = datetime.datetime.now().isoformat(' ')
         run = perf.Run([1.0], metadata={'date': date},
@@ -96,6 +112,39 @@ class RunTests(unittest.TestCase):
         run = perf.Run([1.0], collect_metadata=False)
         self.assertIsNone(run._get_date())
 
+    def test_series(self):
+        run = create_run([1.0, 2.0])
+        run._set_series({'task-clock': [5, 6]})
+        self.assertEqual(run._get_series_names(), ['task-clock'])
+        self.assertEqual(run._get_series('task-clock'), (5, 6))
+        self.assertIsNone(run._get_series('cycles'))
+
+        # series are kept if values are unchanged
+        run2 = run._replace(metadata={'name': 'bench2'})
+        self.assertEqual(run2._get_series('task-clock'), (5, 6))
+        run2 = run._replace(values=[3.0, 4.0])
+        self.assertIsNone(run2._get_series('task-clock'))
+
+        # JSON roundtrip
+        bench = perf.Benchmark([run])
+        with tests.temporary_file() as tmp_name:
+            bench.dump(tmp_name)
+            bench2 = perf.Benchmark.load(tmp_name)
+        self.assertEqual(bench2._get_series_names(), ['task-clock'])
+        self.assertEqual(bench2._get_series('task-clock'),
+                         ([1.0, 2.0], [5, 6]))
+
+        # use a series as values
+        bench._extract_metadata('task-clock')
+        self.assertEqual(bench.get_values(), (5, 6))
+        # task-clock is stored in seconds
+        self.assertEqual(bench.get_unit(), 'second')
+
+        with self.assertRaises(ValueError):
+            run._set_series({'task-clock': [5]})
+        with self.assertRaises(ValueError):
+            run._set_series({'task-clock': [5, -1]})
+
 
 class BenchmarkTests(unittest.TestCase):
     def check_runs(self, bench, warmups, values):
@@ -200,6 +249,26 @@ class BenchmarkTests(unittest.TestCase):
 
         self.check_benchmarks_equal(bench, bench2)
 
+    def test_load_shared_metadata(self):
+        runs = [create_run([1.0], metadata={'hostname': 'host', 'date': date})
+                for date in ('2017-03-01 12:00:00', '2017-03-01 12:00:10')]
+        bench = perf.Benchmark(runs)
+
+        with tests.temporary_file() as tmp_name:
+            bench.dump(tmp_name)
+            bench2 = perf.Benchmark.load(tmp_name)
+
+        # metadata common to all runs are shared by reference
+        run1, run2 = bench2.get_runs()
+        self.assertIs(run1._metadata._common, run2._metadata._common)
+        self.assertEqual(run1._metadata._overlay,
+                         {'date': '2017-03-01 12:00:00'})
+        self.assertEqual(run2.get_metadata(),
+                         {'name': 'bench', 'hostname': 'host',
+                          'date': '2017-03-01 12:00:10'})
+        self.assertEqual(bench2.get_metadata(),
+                         {'name': 'bench', 'hostname': 'host'})
+
     def test_dump_replace(self):
         bench = self.create_dummy_benchmark()
 
@@ -290,6 +359,22 @@ class BenchmarkTests(unittest.TestCase):
         bench.add_run(create_run([5.0]))
         self.assertEqual(bench.get_nvalue(), 3)
 
+    def test_get_values(self):
+        run = create_run([2.0, 3.0])
+        bench = perf.Benchmark([run])
+        self.assertEqual(bench.get_values(), (2.0, 3.0))
+        # single run: values are not copied
+        self.assertIs(bench._get_values(), run._values)
+
+        # the tuple is cached
+        self.assertIs(bench.get_values(), run.values)
+        self.assertIs(run.values, run.values)
+
+        bench.add_run(create_run([5.0]))
+        self.assertEqual(bench.get_values(), (2.0, 3.0, 5.0))
+        self.assertIs(bench.get_values(), bench.get_values())
+        self.assertEqual(bench.mean(), 10.0 / 3)
+
     def test_get_runs(self):
         run1 = create_run([1.0])
         run2 = create_run([2.0])
@@ -426,6 +511,56 @@ class TestBenchmarkSuite(unittest.TestCase):
         with self.assertRaises(KeyError):
             suite.get_benchmark('non_existent')
 
+    def test_name_index(self):
+        telco = self.benchmark('telco')
+        go = self.benchmark('go')
+        suite = perf.BenchmarkSuite([telco, go])
+
+        with self.assertRaises(ValueError):
+            suite.add_benchmark(go)
+        with self.assertRaises(ValueError):
+            suite.add_benchmark(self.benchmark('go'))
+
+        # the index must be updated when a benchmark is renamed
+        go.update_metadata({'name': 'go2'})
+        self.assertIs(suite.get_benchmark('go2'), go)
+        with self.assertRaises(KeyError):
+            suite.get_benchmark('go')
+
+        # a renamed benchmark must still be seen by add_benchmark()
+        # and add_runs()
+        with self.assertRaises(ValueError):
+            suite.add_benchmark(self.benchmark('go2'))
+        with self.assertRaises(ValueError):
+            suite.add_benchmark(go)
+        suite.add_runs(self.benchmark('go2'))
+        self.assertEqual(suite.get_benchmark_names(), ['telco', 'go2'])
+        self.assertEqual(go.get_nrun(), 2)
+
+        suite._convert_exclude_benchmark('telco')
+        self.assertEqual(suite.get_benchmark_names(), ['go2'])
+        with self.assertRaises(KeyError):
+            suite.get_benchmark('telco')
+
+        suite.add_benchmark(telco)
+        suite._convert_include_benchmark('telco')
+        self.assertEqual(suite.get_benchmarks(), [telco])
+        with self.assertRaises(KeyError):
+            suite.get_benchmark('go2')
+
+    def test_convert_duplicated_names(self):
+        # a suite loaded from JSON can contain benchmarks with the same name
+        telco = self.benchmark('telco')
+        go = self.benchmark('go')
+        suite = perf.BenchmarkSuite([telco, go])
+        go.update_metadata({'name': 'telco'})
+        suite._convert_include_benchmark('telco')
+        self.assertEqual(suite.get_benchmarks(), [telco, go])
+
+        suite.add_benchmark(self.benchmark('go'))
+        suite._convert_exclude_benchmark('telco')
+        self.assertEqual(suite.get_benchmark_names(), ['go'])
+
     def create_dummy_suite(self):
         telco = self.benchmark('telco')
         go = self.benchmark('go')
@@ -15,6 +15,38 @@ class CLITests(unittest.TestCase):
         self.assertEqual(cli.format_result(bench),
                          'Mean +- std dev: 1.50 sec +- 0.50 sec')
 
+    def test_format_result_rate(self):
+        # 1 MB per loop iteration
+        run = perf.Run([1.0, 0.5, 0.25],
+                       metadata={'name': 'mybench',
+                                 'rate_unit': 'byte/s',
+                                 'items_per_loop': 1024 ** 2},
+                       collect_metadata=False)
+        bench = perf.Benchmark([run])
+        # harmonic mean of throughputs
+        self.assertEqual(bench.format_value(bench.mean()), '1.71 MB/s')
+        self.assertEqual(bench.format_values((0.5, 0.25)),
+                         ('2.00 MB/s', '4.00 MB/s'))
+        self.assertEqual(cli.format_result_value(bench),
+                         '1.71 MB/s +- 1.12 MB/s')
+
+    def test_compute_speed_rate(self):
+        from perf._compare import compute_speed
+
+        def create_bench(values):
+            run = perf.Run(values,
+                           metadata={'name': 'bench',
+                                     'rate_unit': 'op/s',
+                                     'items_per_loop': 10},
+                           collect_metadata=False)
+            return perf.Benchmark([run])
+
+        ref = create_bench([2.0, 2.0])
+        changed = create_bench([1.0, 1.0])
+        # higher throughput means faster
+        self.assertEqual(compute_speed(ref, changed), (2.0, 100.0))
+        self.assertEqual(compute_speed(changed, ref), (0.5, -50.0))
+
     def test_format_result_calibration(self):
         run = perf.Run([], warmups=[(100, 1.0)],
                        metadata={'name': 'bench', 'loops': 100},
@@ -23,12 +23,18 @@ class ExampleTests(unittest.TestCase):
         if not_tested:
             raise Exception("not tested scripts: %s" % sorted(not_tested))
 
-    def check_command(self, script, args, nproc=3):
+    def check_command(self, script, args, nproc=3, env=None):
         self.TESTED.add(script)
         script = os.path.join(EXAMPLES_DIR, script)
 
-        cmd = [sys.executable] + [script] + args + ["--inherit-env=PYTHONPATH"]
-        proc = tests.get_output(cmd)
+        inherit = ["PYTHONPATH"]
+        kw = {}
+        if env:
+            inherit.extend(env)
+            kw['env'] = dict(os.environ, **env)
+        cmd = ([sys.executable] + [script] + args
+               + ["--inherit-env=%s" % ','.join(inherit)])
+        proc = tests.get_output(cmd, **kw)
 
         self.assertRegex(proc.stdout,
                          r'Mean \+- std dev: [0-9.]+ [mun]s '
@@ -46,6 +52,12 @@ class ExampleTests(unittest.TestCase):
         args = ['-p2', '-w0', '--min-time=0.001']
         self.check_command(script, args)
 
+    @unittest.skipUnless(hasattr(os, 'fork'), 'need os.fork()')
+    def test_bench_func_fork_server(self):
+        script = 'bench_func.py'
+        args = ['-p2', '-w1', '--min-time=0.001', '--fork-server']
+        self.check_command(script, args, env={'PYTHONHASHSEED': '0'})
+
     def test_bench_time_func(self):
         script = 'bench_time_func.py'
         args = ['-p2', '-w1', '--min-time=0.001']
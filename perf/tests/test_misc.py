@@ -1,5 +1,6 @@
 import os.path
 import sys
+import textwrap
 
 import perf
 from perf import _utils as utils
@@ -84,5 +85,95 @@ class MiscTests(unittest.TestCase):
             sys.path[:] = old_path
 
 
+class MemoryTests(unittest.TestCase):
+    def test_parse_private_memory(self):
+        from perf._memory import parse_private_memory
+        data = (b"Rss:                3000 kB\n"
+                b"Private_Clean:       100 kB\n"
+                b"Private_Dirty:      2000 kB\n"
+                b"Private_Hugetlb:       0 kB\n")
+        self.assertEqual(parse_private_memory(data), 2100 * 1024)
+
+    def test_downsample(self):
+        from perf._memory import downsample
+        samples = [(0.0, 1), (0.1, 5), (0.2, 3), (0.3, 2), (1.0, 4)]
+        # keep the maximum of each bucket, empty buckets repeat the
+        # previous usage
+        self.assertEqual(downsample(samples, 4), [5, 2, 2, 4])
+        self.assertEqual(downsample(samples[:2], 4), [1, 5])
+
+    def test_bucket_timeline(self):
+        from perf._memory import BucketTimeline
+        timeline = BucketTimeline(4, 1.0)
+        for timestamp, usage in ((0.0, 1), (0.5, 3), (1.0, 2), (3.5, 4)):
+            timeline.add(timestamp, usage)
+        self.assertEqual(timeline.get_samples(),
+                         [(0.0, 3), (1.0, 2), (3.0, 4)])
+
+        # buckets are merged, the number of buckets is bounded
+        timeline.add(5.0, 1)
+        self.assertEqual(timeline.duration, 2.0)
+        self.assertEqual(timeline.get_samples(),
+                         [(0.0, 3), (2.0, 4), (4.0, 1)])
+        for index in range(1000):
+            timeline.add(6.0 + index, index)
+        self.assertLessEqual(len(timeline.buckets), 4)
+        self.assertEqual(timeline.nsample, 1005)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps'),
+                         'need /proc/self/smaps')
+    def test_memory_thread(self):
+        from perf._memory import PeakMemoryUsageThread
+        mem_thread = PeakMemoryUsageThread()
+        mem_thread.start()
+        mem_thread.stop()
+
+        metadata = mem_thread.get_metadata()
+        self.assertGreater(mem_thread.peak_usage, 0)
+        self.assertGreaterEqual(metadata['mem_samples'], 1)
+        self.assertLessEqual(metadata['mem_min_usage'],
+                             mem_thread.peak_usage)
+        self.assertGreaterEqual(metadata['mem_sampler_time'], 0.0)
+
+
 if __name__ == "__main__":
     unittest.main()
+
+
+class ImportTimeTests(unittest.TestCase):
+    def test_parse_importtime(self):
+        from perf._importtime import parse_importtime
+
+        text = textwrap.dedent("""
+            import time: self [us] | cumulative | imported package
+            import time:       271 |        271 |   _io
+            import time:       610 |       1580 | _frozen_importlib_external
+            unrelated output
+            import time: self [us] | cumulative | imported package
+            import time:       250 |        250 |   _io
+        """)
+        self.assertEqual(parse_importtime(text),
+                         {'_io': [521, 521],
+                          '_frozen_importlib_external': [610, 1580]})
+
+    def test_split_import_times(self):
+        from perf._importtime import split_import_times
+
+        run = perf.Run([1.0, 2.0],
+                       metadata={'name': 'cmd', 'unit': 'second'},
+                       collect_metadata=False)
+        run._set_series({'import:os:self_time': [0.1, 0.2],
+                         'import:os:cumulative_time': [0.3, 0.4],
+                         # not imported by the first value
+                         'import:json:self_time': [0.0, 0.5],
+                         'import:json:cumulative_time': [0.0, 0.5],
+                         'process_time': [0.5, 1.5]})
+        bench, suite = split_import_times(perf.Benchmark([run]))
+
+        self.assertEqual(bench.get_values(), (1.0, 2.0))
+        self.assertEqual(bench._get_series_names(), ['process_time'])
+        self.assertEqual(suite.get_benchmark_names(), ['cmd: import os'])
+        bench = suite.get_benchmark('cmd: import os')
+        self.assertEqual(bench.get_values(), (0.1, 0.2))
+        self.assertEqual(bench._get_series('cumulative_time'),
+                         ([0.1, 0.2], [0.3, 0.4]))
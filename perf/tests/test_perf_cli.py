@@ -352,6 +352,67 @@ class TestPerfCLI(BaseTestCase, unittest.TestCase):
         self.assertRegex(stdout,
                          r'^\.\ncommand: [0-9.]+ (?:ms|sec)$')
 
+    @unittest.skipUnless(hasattr(os, 'fork'), 'need os.fork()')
+    def test_command_fork_server(self):
+        command = [sys.executable, '-c', 'pass']
+        env = dict(os.environ, PYTHONHASHSEED='0')
+        stdout = self.run_command('command', '--fork-server',
+                                  '--inherit-environ=PYTHONHASHSEED',
+                                  '-p', '2', '-n', '2', '-l', '1', '-w', '0',
+                                  '--', *command, env=env)
+        self.assertRegex(stdout,
+                         r'command: Mean \+- std dev: [0-9.]+ (?:ms|sec) '
+                         r'\+- [0-9.]+ (?:ms|sec)')
+
+        # the hash secret is not randomized in forked workers
+        proc = tests.get_output([sys.executable, '-m', 'perf', 'command',
+                                 '--fork-server', '--', sys.executable,
+                                 '-c', 'pass'])
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn('PYTHONHASHSEED', proc.stdout)
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'need python3 -X importtime')
+    def test_command_python_importtime(self):
+        with tests.temporary_file() as tmp_name:
+            stdout = self.run_command('command', '--python-importtime',
+                                      '-p', '2', '-n', '2', '-l', '1',
+                                      '-w', '0', '-o', tmp_name,
+                                      sys.executable, '-c', 'import json')
+            suite = perf.BenchmarkSuite.load(tmp_name)
+
+        self.assertIn('Slowest imports (self time):', stdout)
+        bench = suite.get_benchmark('command')
+        self.assertEqual(bench.get_metadata()['command'],
+                         ' '.join(map(repr, [sys.executable, '-X',
+                                             'importtime', '-c',
+                                             'import json'])))
+        for run in bench.get_runs():
+            self.assertFalse(any(name.startswith('import:')
+                                 for name in run._get_series_names()))
+
+        bench = suite.get_benchmark('command: import json')
+        self.assertEqual(bench.get_nrun(), 2)
+        self.assertEqual(bench.get_nvalue(), 4)
+        self.assertEqual(bench.get_unit(), 'second')
+        values, cumulative = bench._get_series('cumulative_time')
+        for value, cumulative_time in zip(bench.get_values(), cumulative):
+            self.assertGreaterEqual(cumulative_time, value)
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'need python3 -X importtime')
+    def test_command_python_importtime_compare_to(self):
+        stdout = self.run_command('command', '--python-importtime',
+                                  '--compare-to', sys.executable,
+                                  '--python-names=ref:changed',
+                                  '-p', '2', '-n', '2', '-l', '1',
+                                  '-w', '0', '-v',
+                                  sys.executable, '-c', 'import json')
+        self.assertIn('Slowest imports of ref (self time):', stdout)
+        self.assertIn('Slowest imports of changed (self time):', stdout)
+        # import series were moved out of the command benchmark
+        self.assertNotIn('import:', stdout)
+
     def test_check_unstable(self):
         suite = self.create_suite()
 
@@ -385,6 +446,27 @@ class TestPerfCLI(BaseTestCase, unittest.TestCase):
         expected = expected.format(os.path.basename(sys.executable))
         self.assertEqual(stdout.rstrip(), expected)
 
+    def test_check_cpu_time(self):
+        runs = []
+        for value, cpu_time in ((1.0, 0.99), (1.0, 0.5), (1.0, 1.0)):
+            run = perf.Run([value], metadata={'name': 'bench'},
+                           collect_metadata=False)
+            run._set_series({'process_time': [cpu_time]})
+            runs.append(run)
+        bench = perf.Benchmark(runs)
+
+        with tests.temporary_file() as tmp_name:
+            bench.dump(tmp_name)
+            stdout = self.run_command('check', tmp_name)
+            stats = self.run_command('stats', tmp_name)
+
+        self.assertIn('* 1 values (33%) have a wall time at least 10% '
+                      'greater than their process_time', stdout)
+        self.assertIn('- process_time: Mean +- std dev: 830 ms +- 286 ms',
+                      stats)
+        self.assertIn('Wall time / process_time ratio: mean 1.34, '
+                      'min 1.00, max 2.00', stats)
+
 
 class TestConvert(BaseTestCase, unittest.TestCase):
     def test_stdout(self):
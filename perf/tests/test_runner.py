@@ -1,14 +1,23 @@
 import collections
+import gc
+import io
+import json
 import os.path
+import subprocess
 import sys
 import tempfile
 import textwrap
+import time
 
 import six
 
 import perf
 from perf import tests
+from perf._perf_event import Counters
+from perf._runner import WorkerError, _Watchdog
+from perf._stream import StreamReader, load_worker_result
 from perf._utils import create_pipe, MS_WINDOWS
+from perf._worker import CommandHelper
 from perf.tests import mock
 from perf.tests import unittest
 from perf.tests import ExitStack
@@ -36,19 +45,27 @@ class TestRunner(unittest.TestCase):
 
         name = kwargs.pop('name', 'bench')
         time_func = kwargs.pop('time_func', None)
+        # collect_metadata=False doesn't collect system metadata: faster and
+        # doesn't depend on the platform
+        collect_metadata = kwargs.pop('collect_metadata', True)
 
         runner = perf.Runner(**kwargs)
         # disable CPU affinity to not pollute stdout
         runner._cpu_affinity = lambda: None
         runner.parse_args(args)
 
-        with mock.patch('perf.perf_counter', fake_timer):
-            with tests.capture_stdout() as stdout:
-                with tests.capture_stderr() as stderr:
-                    if time_func:
-                        bench = runner.bench_time_func(name, time_func)
-                    else:
-                        bench = runner.bench_func(name, check_args, None, 1, 2)
+        with ExitStack() as cm:
+            cm.enter_context(mock.patch('perf.perf_counter', fake_timer))
+            if not collect_metadata:
+                cm.enter_context(
+                    mock.patch('perf._collect_metadata.collect_metadata',
+                               return_value={}))
+            stdout = cm.enter_context(tests.capture_stdout())
+            stderr = cm.enter_context(tests.capture_stderr())
+            if time_func:
+                bench = runner.bench_time_func(name, time_func)
+            else:
+                bench = runner.bench_func(name, check_args, None, 1, 2)
 
         stdout = stdout.getvalue()
         stderr = stderr.getvalue()
@@ -67,6 +84,104 @@ class TestRunner(unittest.TestCase):
         self.assertRegex(result.stdout,
                          r'^bench: Mean \+- std dev: 1\.00 sec \+- 0\.00 sec\n$')
 
+    def test_overhead(self):
+        # fake timer: each value takes 1 second, the empty loop too
+        result = self.exec_runner('--worker', '-l1', collect_metadata=False)
+        run = result.bench.get_runs()[-1]
+        self.assertEqual(run._metadata['loop_overhead'], 1.0)
+        self.assertEqual(run._metadata['call_overhead'], 0.0)
+
+        with self.assertRaises(ValueError):
+            self.exec_runner('--worker', '-l1', '--subtract-overhead',
+                             collect_metadata=False)
+
+    def test_subtract_overhead(self):
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-w0', '-n2', '-l10',
+                           '--subtract-overhead'])
+        with tests.capture_stdout():
+            bench = runner.bench_func('bench', sorted, list(range(100)))
+
+        run = bench.get_runs()[0]
+        self.assertGreater(run._metadata['loop_overhead'], 0.0)
+        self.assertGreaterEqual(run._metadata['call_overhead'], 0.0)
+        self.assertEqual(len(run.values), 2)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'need Python 3.5')
+    def test_bench_async_func(self):
+        namespace = {}
+        exec(textwrap.dedent("""
+            async def coro_func(a, b):
+                return a + b
+        """), namespace)
+
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-w0', '-n2', '-l10'])
+        with tests.capture_stdout():
+            bench = runner.bench_async_func('bench', namespace['coro_func'],
+                                            1, 2)
+
+        run = bench.get_runs()[0]
+        self.assertEqual(run._metadata['event_loop'], 'asyncio')
+        self.assertIn('call_overhead', run._metadata)
+        self.assertEqual(len(run.values), 2)
+
+    def test_gc(self):
+        def create_cycles():
+            for _ in range(1000):
+                obj = []
+                obj.append(obj)
+
+        for mode in ('default', 'disable', 'collect-between'):
+            runner = perf.Runner()
+            runner.parse_args(['--worker', '-w0', '-n2', '-l10',
+                               '--gc', mode])
+            with tests.capture_stdout():
+                bench = runner.bench_func('bench', create_cycles)
+            self.assertTrue(gc.isenabled())
+
+            run = bench.get_runs()[0]
+            self.assertEqual(run._metadata['gc_mode'], mode)
+            if not hasattr(gc, 'callbacks'):
+                continue
+            self.assertEqual(run._get_series_names(),
+                             ['gc_collected', 'gc_gen0', 'gc_gen1',
+                              'gc_gen2', 'gc_time'])
+            collected = run._get_series('gc_collected')
+            if mode == 'disable':
+                self.assertEqual(collected, (0, 0))
+            else:
+                self.assertGreater(sum(collected), 0)
+
+    @unittest.skipUnless(hasattr(sys, 'getallocatedblocks'),
+                         'need sys.getallocatedblocks()')
+    def test_track_allocations(self):
+        # each call keeps a new list alive
+        lists = []
+
+        def func():
+            lists.append([])
+
+        # a collection of the garbage of previous tests during a value would
+        # free more memory blocks than the value allocates
+        gc.collect()
+
+        runner = perf.Runner()
+        runner.parse_args(['--worker', '-w0', '-n2', '-l1000',
+                           '--track-allocations=tracemalloc'])
+        with tests.capture_stdout():
+            bench = runner.bench_func('bench', func)
+
+        run = bench.get_runs()[0]
+        # timings are kept
+        self.assertEqual(len(run.values), 2)
+        self.assertEqual(run._get_series_names(),
+                         ['allocated_blocks', 'traced_bytes'])
+        for blocks in run._get_series('allocated_blocks'):
+            self.assertGreater(blocks, 0.5)
+        for size in run._get_series('traced_bytes'):
+            self.assertGreater(size, 0)
+
     def test_debug_single_value(self):
         result = self.exec_runner('--debug-single-value', '--worker')
         self.assertEqual(result.bench.get_nvalue(), 1)
@@ -82,10 +197,37 @@ class TestRunner(unittest.TestCase):
 
                 result = self.exec_runner('--pipe', str(arg), '--worker')
 
-            with rpipe.open_text() as rfile:
-                bench_json = rfile.read()
+            with rpipe.open_binary() as rfile:
+                data = rfile.read()
+
+        # values are streamed as soon as they are produced
+        warmups = []
+        values = []
+        reader = StreamReader(on_warmup=lambda *args: warmups.append(args),
+                              on_value=values.append)
+        reader.read(io.BytesIO(data[:-1]))
+        self.assertTrue(reader.truncated)
+        self.assertEqual(len(reader.warmups), 2)
+        self.assertEqual(len(reader.values), 3)
+        self.assertEqual(warmups, reader.warmups)
+        self.assertEqual(values, reader.values)
+        self.assertIsNone(reader.get_suite())
+
+        suite = load_worker_result(data)
+        self.assertEqual(tests.benchmark_as_json(suite.get_benchmarks()[0]),
+                         tests.benchmark_as_json(result.bench))
 
-        self.assertEqual(bench_json,
+    def test_load_worker_result_legacy(self):
+        # perf 1.1 workers dump a whole BenchmarkSuite as JSON
+        result = self.exec_runner('--worker', collect_metadata=False)
+        suite = perf.BenchmarkSuite([result.bench])
+        with tests.temporary_file() as tmp_name:
+            suite.dump(tmp_name)
+            with open(tmp_name, 'rb') as fp:
+                data = fp.read()
+
+        suite = load_worker_result(data)
+        self.assertEqual(tests.benchmark_as_json(suite.get_benchmarks()[0]),
                          tests.benchmark_as_json(result.bench))
 
     def test_json_exists(self):
@@ -128,29 +270,26 @@ class TestRunner(unittest.TestCase):
         for run in result.bench.get_runs():
             self.assertEqual(run.get_total_loops(), 2 ** 17)
 
+        # the number of loops is estimated from the first value
         expected = textwrap.dedent('''
             Calibration 1: 1.00 us (1 loop: 1.00 us)
-            Calibration 2: 1.00 us (2 loops: 2.00 us)
-            Calibration 3: 1.00 us (4 loops: 4.00 us)
-            Calibration 4: 1.00 us (8 loops: 8.00 us)
-            Calibration 5: 1.00 us (16 loops: 16.0 us)
-            Calibration 6: 1.00 us (32 loops: 32.0 us)
-            Calibration 7: 1.00 us (64 loops: 64.0 us)
-            Calibration 8: 1.00 us (128 loops: 128 us)
-            Calibration 9: 1.00 us (256 loops: 256 us)
-            Calibration 10: 1.00 us (512 loops: 512 us)
-            Calibration 11: 1.00 us (1024 loops: 1.02 ms)
-            Calibration 12: 1.00 us (2048 loops: 2.05 ms)
-            Calibration 13: 1.00 us (4096 loops: 4.10 ms)
-            Calibration 14: 1.00 us (8192 loops: 8.19 ms)
-            Calibration 15: 1.00 us (2^14 loops: 16.4 ms)
-            Calibration 16: 1.00 us (2^15 loops: 32.8 ms)
-            Calibration 17: 1.00 us (2^16 loops: 65.5 ms)
-            Calibration 18: 1.00 us (2^17 loops: 131 ms)
-
+            Calibration 2: 1.00 us (2^17 loops: 131 ms)
+            Calibration: use 2^17 loops
         ''').strip()
         self.assertIn(expected, result.stdout)
 
+    def test_loops_calibration_estimate(self):
+        # timer overhead of 50 us: the first estimate is too pessimistic
+        def time_func(loops):
+            return 50e-6 + loops * 1e-7
+
+        result = self.exec_runner('--worker', '-v', time_func=time_func,
+                                  collect_metadata=False)
+        for run in result.bench.get_runs():
+            self.assertEqual(run.get_total_loops(), 2 ** 20)
+        self.assertIn('Calibration 3: ', result.stdout)
+        self.assertNotIn('Calibration 4: ', result.stdout)
+
     def test_loops_calibration_min_time(self):
         def time_func(loops):
             # number of iterations => number of microseconds
@@ -249,6 +388,35 @@ class TestRunner(unittest.TestCase):
                           # warmup 2
                           (32, 1.0 / 32)))
 
+    def test_auto_warmups(self):
+        runner = perf.Runner()
+        runner._cpu_affinity = lambda: None
+        runner.parse_args(['--worker', '-w', 'auto', '-n1', '-l1'])
+
+        # JIT-like benchmark: values become stable after 3 values
+        def time_func(loops):
+            time_func.step += 1
+            return max(4.0 - time_func.step, 1.0)
+        time_func.step = 0
+
+        with tests.capture_stdout():
+            bench = runner.bench_time_func('bench', time_func)
+
+        run = bench.get_runs()[0]
+        self.assertEqual(run.warmups, ((1, 3.0), (1, 2.0)) + ((1, 1.0),) * 4)
+        self.assertEqual(run._metadata['warmups'], 6)
+
+        # maximum number of warmups
+        runner = perf.Runner()
+        runner._cpu_affinity = lambda: None
+        runner.parse_args(['--worker', '-w', 'auto', '--max-warmups=3',
+                           '-n1', '-l1'])
+        time_func.step = 0
+        with tests.capture_stdout():
+            bench = runner.bench_time_func('bench', time_func)
+        run = bench.get_runs()[0]
+        self.assertEqual(run._metadata['warmups'], 3)
+
     def test_loops_power(self):
         runner = perf.Runner()
         runner.parse_args(['--loops', '2^8'])
@@ -329,8 +497,8 @@ class TestRunner(unittest.TestCase):
 
             cm.enter_context(mock.patch('perf._runner.abs_executable',
                              side_effect=abs_executable))
-            cm.enter_context(mock.patch('perf._runner._load_suite_from_pipe',
-                                        return_value=suite))
+            mock_reader = cm.enter_context(mock.patch('perf._runner.StreamReader'))
+            mock_reader.return_value.get_suite.return_value = suite
 
             runner = perf.Runner()
 
@@ -356,6 +524,411 @@ class TestRunner(unittest.TestCase):
             call2 = popen_call('python1')
             mock_subprocess.Popen.assert_has_calls([call1, call2])
 
+    def mock_workers(self, cm, values=(1.5,), metadata=None, exitcodes=(),
+                     offsets=None):
+        # Mock worker processes: each worker produces a run with values.
+        # offsets: list of offsets added to values, one offset per worker
+        # (cycled)
+        def abs_executable(python):
+            return python
+
+        nworker = [0]
+
+        def load_suite():
+            run_metadata = {'name': 'name'}
+            if metadata:
+                run_metadata.update(metadata)
+            run_values = values
+            if offsets:
+                offset = offsets[nworker[0] % len(offsets)]
+                nworker[0] += 1
+                run_values = [value + offset for value in values]
+            run = perf.Run(run_values,
+                           metadata=run_metadata,
+                           collect_metadata=False)
+            bench = perf.Benchmark([run])
+            return perf.BenchmarkSuite([bench])
+
+        # exit codes of the first workers, next workers succeed
+        exitcodes = list(exitcodes)
+
+        def popen(*args, **kw):
+            mock_popen = mock.Mock()
+            mock_popen.wait.return_value = exitcodes.pop(0) if exitcodes else 0
+            return mock_popen
+
+        mock_subprocess = cm.enter_context(mock.patch('perf._runner.subprocess'))
+        mock_subprocess.Popen.side_effect = popen
+
+        cm.enter_context(mock.patch('perf._runner.abs_executable',
+                         side_effect=abs_executable))
+        mock_reader = cm.enter_context(mock.patch('perf._runner.StreamReader'))
+        mock_reader.return_value.get_suite.side_effect = load_suite
+        return mock_subprocess
+
+    def test_parallel(self):
+        def time_func(loops):
+            return 1.0
+
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm)
+            cm.enter_context(mock.patch('perf._runner.get_isolated_cpus',
+                                        return_value=[2, 3]))
+
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--parallel=4",
+                               "-p5", "-w1", "-n1", "-l3"])
+            # parallelism is limited by the number of isolated CPUs
+            self.assertEqual(runner.args.parallel, 2)
+
+            with tests.capture_stdout():
+                bench = runner.bench_time_func('name', time_func)
+
+        self.assertEqual(bench.get_nrun(), 5)
+        self.assertEqual(mock_subprocess.Popen.call_count, 5)
+        affinities = set()
+        for call in mock_subprocess.Popen.call_args_list:
+            cmd = call[0][0]
+            options = [arg for arg in cmd if arg.startswith('--affinity=')]
+            self.assertEqual(len(options), 1)
+            affinities.add(options[0])
+        self.assertEqual(affinities, {'--affinity=2', '--affinity=3'})
+
+    def test_parallel_no_cpu(self):
+        runner = perf.Runner()
+        with mock.patch('perf._runner.get_isolated_cpus', return_value=None):
+            with tests.capture_stdout() as stdout:
+                with self.assertRaises(SystemExit) as cm:
+                    runner.parse_args(['--parallel=2'])
+
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(stdout.getvalue().rstrip(),
+                         'ERROR: --parallel requires isolated CPUs '
+                         'or the --affinity option')
+
+    def test_target_precision(self):
+        def time_func(loops):
+            return 1.0
+
+        # stable benchmark: stop after 3 processes
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm, values=(1.0, 1.0, 1.0))
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--target-precision=1%",
+                               "-l3"])
+            self.assertEqual(runner.args.target_precision, 0.01)
+            self.assertEqual(runner.args.max_processes, 40)
+
+            with tests.capture_stdout():
+                bench = runner.bench_time_func('name', time_func)
+
+        self.assertEqual(mock_subprocess.Popen.call_count, 3)
+        self.assertEqual(bench.get_nrun(), 3)
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['processes'], 3)
+        self.assertEqual(metadata['precision'], 0.0)
+
+        # unstable benchmark: stop at --max-processes
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm, values=(1.0, 2.0, 3.0))
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--target-precision=1",
+                               "--max-processes=5", "-l3"])
+
+            with tests.capture_stdout():
+                bench = runner.bench_time_func('name', time_func)
+
+        self.assertEqual(mock_subprocess.Popen.call_count, 5)
+        self.assertEqual(bench.get_metadata()['processes'], 5)
+
+        # values are stable in each process, but there is an offset between
+        # processes: the precision of pooled values would be 1%, stop at
+        # --max-processes
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm, values=(1.0,) * 30,
+                                                offsets=(0.0, 0.1))
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--target-precision=2%",
+                               "--max-processes=5", "-l3"])
+
+            with tests.capture_stdout():
+                bench = runner.bench_time_func('name', time_func)
+
+        self.assertEqual(mock_subprocess.Popen.call_count, 5)
+        self.assertGreater(bench.get_metadata()['precision'], 0.05)
+
+    def test_max_failures(self):
+        def time_func(loops):
+            return 1.0
+
+        # two failed workers are replaced with new workers
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm, exitcodes=(1, -9))
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--max-failures=2",
+                               "-p3", "-l3"])
+            with tests.capture_stdout():
+                with tests.capture_stderr() as stderr:
+                    bench = runner.bench_time_func('name', time_func)
+
+        self.assertEqual(mock_subprocess.Popen.call_count, 5)
+        self.assertEqual(bench.get_nrun(), 3)
+        self.assertIn('python worker failed with exit code 1',
+                      stderr.getvalue())
+        metadata = bench.get_metadata()
+        self.assertEqual(metadata['worker_failures'], 2)
+        self.assertEqual(metadata['worker_exitcodes'], '1, -9')
+        if not MS_WINDOWS:
+            self.assertEqual(metadata['worker_signals'], 'SIGKILL')
+
+        # the failure budget is exhausted
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm, exitcodes=(1, 1))
+            runner = perf.Runner()
+            runner.parse_args(["--python=python", "--max-failures=1",
+                               "-p3", "-l3"])
+            with tests.capture_stdout():
+                with tests.capture_stderr():
+                    with self.assertRaises(WorkerError) as cm:
+                        runner.bench_time_func('name', time_func)
+        self.assertEqual(cm.exception.exitcode, 1)
+
+    def test_checkpoint(self):
+        def time_func(loops):
+            return 1.0
+
+        def run_bench(checkpoint, exitcodes=()):
+            with ExitStack() as cm:
+                mock_subprocess = self.mock_workers(cm, exitcodes=exitcodes)
+                runner = perf.Runner()
+                runner.parse_args(["--python=python", "--checkpoint",
+                                   checkpoint, "-p3", "-l3"])
+                with tests.capture_stdout():
+                    with tests.capture_stderr():
+                        try:
+                            bench = runner.bench_time_func('name', time_func)
+                        except WorkerError:
+                            bench = None
+            return (mock_subprocess.Popen.call_count, bench)
+
+        with tests.temporary_file() as checkpoint:
+            # the second worker fails: the first run is checkpointed
+            ncall, bench = run_bench(checkpoint, exitcodes=(0, 1))
+            self.assertEqual(ncall, 2)
+            self.assertIsNone(bench)
+
+            # resume the session: only spawn the two missing workers
+            ncall, bench = run_bench(checkpoint)
+            self.assertEqual(ncall, 2)
+            self.assertEqual(bench.get_nrun(), 3)
+
+            # all processes completed: don't spawn any worker
+            ncall, bench = run_bench(checkpoint)
+            self.assertEqual(ncall, 0)
+            self.assertEqual(bench.get_nrun(), 3)
+
+            # an interrupted write is removed
+            with open(checkpoint) as fp:
+                content = fp.read()
+            with open(checkpoint, 'a') as fp:
+                fp.write('{"name": "name", ')
+            ncall, bench = run_bench(checkpoint)
+            self.assertEqual(bench.get_nrun(), 3)
+            with open(checkpoint) as fp:
+                self.assertEqual(fp.read(), content)
+
+    def test_counters(self):
+        with self.assertRaises(SystemExit):
+            with tests.capture_stdout() as stdout:
+                self.exec_runner('--counters', 'unknown')
+        self.assertIn('unknown counter', stdout.getvalue())
+
+        counters = Counters(['task-clock'])
+        available = counters.names
+        counters.close()
+        if not available:
+            self.skipTest("task-clock counter is not available")
+
+        result = self.exec_runner('--worker', '-n3', '-l2',
+                                  '--counters', 'task-clock',
+                                  collect_metadata=False)
+        run = result.bench.get_runs()[-1]
+        self.assertEqual(run._get_series_names(), ['task-clock'])
+        self.assertEqual(len(run._get_series('task-clock')), 3)
+
+    def test_counters_scale(self):
+        from perf._perf_event import _scale_count
+
+        # the counter ran all the time it was enabled
+        self.assertEqual(_scale_count((10, 100, 100), (30, 200, 200)), 20)
+        # multiplexed counter: it only ran half of the time
+        self.assertEqual(_scale_count((10, 100, 50), (30, 200, 100)), 40)
+        # the counter was never scheduled
+        self.assertEqual(_scale_count((0, 100, 0), (0, 200, 0)), 0)
+
+    @unittest.skipUnless(hasattr(time, 'process_time'),
+                         'need time.process_time()')
+    def test_cpu_time(self):
+        result = self.exec_runner('--worker', '-n3', '-l2', '--cpu-time',
+                                  collect_metadata=False)
+        run = result.bench.get_runs()[-1]
+        self.assertIn('process_time', run._get_series_names())
+        self.assertEqual(len(run._get_series('process_time')), 3)
+
+    def test_watchdog(self):
+        proc = subprocess.Popen([sys.executable, '-c',
+                                 'import time; time.sleep(60)'])
+        watchdog = _Watchdog(proc, 0.1)
+        watchdog.reset()
+        exitcode = proc.wait()
+        watchdog.cancel()
+        self.assertTrue(watchdog.expired)
+        self.assertNotEqual(exitcode, 0)
+
+    def test_watchdog_reset(self):
+        # values produced before the deadline keep the worker alive
+        proc = subprocess.Popen([sys.executable, '-c',
+                                 'import time; time.sleep(60)'])
+        try:
+            watchdog = _Watchdog(proc, 0.5)
+            watchdog.reset()
+            for _ in range(5):
+                time.sleep(0.2)
+                watchdog.reset()
+            self.assertFalse(watchdog.expired)
+            self.assertIsNone(proc.poll())
+
+            self.assertNotEqual(proc.wait(), 0)
+            watchdog.cancel()
+            self.assertTrue(watchdog.expired)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    def test_watchdog_completed(self):
+        # the timer expires after the worker completed, but before the
+        # watchdog is cancelled: the worker must not be reported as a timeout
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        watchdog = _Watchdog(proc, 60.0)
+        watchdog.reset()
+        self.assertEqual(proc.wait(), 0)
+        watchdog._expire()
+        watchdog.cancel()
+        self.assertFalse(watchdog.expired)
+
+        # the timer callback runs after cancel()
+        proc = subprocess.Popen([sys.executable, '-c',
+                                 'import time; time.sleep(60)'])
+        try:
+            watchdog = _Watchdog(proc, 60.0)
+            watchdog.reset()
+            watchdog.cancel()
+            watchdog._expire()
+            self.assertFalse(watchdog.expired)
+            self.assertIsNone(proc.poll())
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_calibration_cache(self):
+        def time_func(loops):
+            return 1.0
+
+        def run_bench(cache, values, python_version='3.6'):
+            metadata = {'loops': 8, 'python_version': python_version}
+            with ExitStack() as cm:
+                mock_subprocess = self.mock_workers(cm, values=values,
+                                                    metadata=metadata)
+                runner = perf.Runner()
+                runner.parse_args(["--python=python", "-p2",
+                                   "--calibration-cache", cache])
+                with tests.capture_stdout():
+                    runner.bench_time_func('name', time_func)
+            return mock_subprocess.Popen.call_count
+
+        with tests.temporary_file() as cache:
+            # first run: calibrate and fill the cache
+            self.assertEqual(run_bench(cache, (1.0,)), 3)
+            with open(cache) as fp:
+                entries = json.load(fp)['entries']
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]['name'], 'name')
+            self.assertEqual(entries[0]['loops'], 8)
+
+            # second run: use cached loops
+            self.assertEqual(run_bench(cache, (1.0,)), 2)
+
+            # raw value shorter than min_time minus 25%
+            # (8 loops x 5 ms = 40 ms < 75 ms): the entry is invalidated
+            self.assertEqual(run_bench(cache, (0.005,)), 2)
+            with open(cache) as fp:
+                self.assertEqual(json.load(fp)['entries'], [])
+
+            # Python version changed: the entry is invalidated
+            self.assertEqual(run_bench(cache, (1.0,)), 3)
+            self.assertEqual(run_bench(cache, (1.0,), '3.7'), 2)
+            with open(cache) as fp:
+                self.assertEqual(json.load(fp)['entries'], [])
+
+    def get_popen_options(self, mock_subprocess, prefix):
+        # Get (python, option) of each spawned worker, where option is the
+        # command line argument starting with prefix
+        calls = []
+        for call in mock_subprocess.Popen.call_args_list:
+            cmd = call[0][0]
+            options = [arg for arg in cmd if arg.startswith(prefix)]
+            calls.append((cmd[0], options[0] if options else None))
+        return calls
+
+    def test_compare_mode_interleaved(self):
+        def time_func(loops):
+            return 1.0
+
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm)
+
+            runner = perf.Runner()
+            runner.parse_args(["--python=python1", "--compare-to=python2",
+                               "--compare-mode=interleaved",
+                               "-p3", "-w1", "-n1"])
+            with tests.capture_stdout():
+                runner.bench_time_func('name', time_func)
+
+        calls = self.get_popen_options(mock_subprocess, '--calibrate')
+        self.assertEqual(calls,
+                         [('python2', '--calibrate'),
+                          ('python1', '--calibrate'),
+                          ('python2', None),
+                          ('python1', None),
+                          ('python2', None),
+                          ('python1', None),
+                          ('python2', None),
+                          ('python1', None)])
+
+    def test_compare_mode_concurrent(self):
+        def time_func(loops):
+            return 1.0
+
+        with ExitStack() as cm:
+            mock_subprocess = self.mock_workers(cm)
+            cm.enter_context(mock.patch('perf._runner.get_isolated_cpus',
+                                        return_value=[1, 2, 3, 4]))
+
+            runner = perf.Runner()
+            runner.parse_args(["--python=python1", "--compare-to=python2",
+                               "--compare-mode=concurrent",
+                               "-p2", "-w1", "-n1", "-l1"])
+            with tests.capture_stdout():
+                runner.bench_time_func('name', time_func)
+
+        calls = self.get_popen_options(mock_subprocess, '--affinity=')
+        self.assertEqual(sorted(calls),
+                         [('python1', '--affinity=3-4'),
+                          ('python1', '--affinity=3-4'),
+                          ('python2', '--affinity=1-2'),
+                          ('python2', '--affinity=1-2')])
+
     def test_parse_args_twice_error(self):
         args = ["--worker"]
         runner = perf.Runner()
@@ -387,6 +960,34 @@ class TestRunner(unittest.TestCase):
 
         self.assertEqual(bench.get_metadata()['command'],
                          ' '.join(map(repr, args)))
+        if hasattr(os, 'wait4'):
+            run = bench.get_runs()[-1]
+            self.assertEqual(run._get_series_names(),
+                             ['command_majflt', 'command_minflt',
+                              'command_nivcsw', 'command_nvcsw',
+                              'command_sys_time', 'command_user_time'])
+            self.assertGreater(run._get_series('command_minflt')[0], 0)
+
+    def test_command_helper(self):
+        helper = CommandHelper([sys.executable, '-c', 'pass'])
+        try:
+            # the same helper process runs all values
+            for loops in (1, 2):
+                result = helper.run(loops)
+                self.assertGreater(result['elapsed'], 0)
+                self.assertGreaterEqual(result['user_time'], 0)
+        finally:
+            helper.close()
+
+        helper = CommandHelper([sys.executable, '-c',
+                                'import sys; sys.exit(3)'])
+        try:
+            with self.assertRaises(Exception) as cm:
+                helper.run(1)
+            self.assertEqual(str(cm.exception),
+                             'Command failed with exit code 3')
+        finally:
+            helper.close()
 
 
 class TestRunnerCPUAffinity(unittest.TestCase):
@@ -62,6 +62,38 @@ class TestStatistics(unittest.TestCase):
         self.assertEqual(utils.median_abs_dev(range(97)), 24.0)
         self.assertEqual(utils.median_abs_dev((1, 1, 2, 2, 4, 6, 9)), 1.0)
 
+    def test_mean_precision(self):
+        self.assertIsNone(utils.mean_precision([1.0]))
+        self.assertEqual(utils.mean_precision([2.0] * 5), 0.0)
+        # mean=2.0, stdev=1.0, t(df=2)=4.303
+        self.assertAlmostEqual(utils.mean_precision([1.0, 2.0, 3.0]),
+                               4.303 / (3 ** 0.5) / 2.0)
+
+    def test_grouped_mean_precision(self):
+        self.assertIsNone(utils.grouped_mean_precision([[1.0, 2.0, 3.0]]))
+        # computed on the mean of each group
+        self.assertAlmostEqual(
+            utils.grouped_mean_precision([[1.0] * 10, [2.0] * 10,
+                                          [3.0] * 10]),
+            4.303 / (3 ** 0.5) / 2.0)
+        # pooled values are a lower bound
+        self.assertEqual(utils.grouped_mean_precision([[1.0, 3.0],
+                                                       [1.0, 3.0]]),
+                         utils.mean_precision([1.0, 3.0, 1.0, 3.0]))
+
+    def test_is_steady_state(self):
+        def is_steady(values):
+            return utils.is_steady_state(values, 4, 0.05, 0.02)
+
+        # not enough values
+        self.assertFalse(is_steady([1.0] * 3))
+        # only the last values are checked
+        self.assertTrue(is_steady([5.0, 3.0, 1.0, 1.0, 1.0, 1.0]))
+        # too much variation
+        self.assertFalse(is_steady([1.0, 1.2, 1.0, 1.2]))
+        # values are still decreasing
+        self.assertFalse(is_steady([1.04, 1.03, 1.01, 1.0]))
+
 
 class TestUtils(unittest.TestCase):
     def test_parse_iso8601(self):